@@ -1,4 +1,5 @@
 from src.data.database import DatabaseManager
+from src.data.snapshot import SnapshotManager
 from src.ml.predict import MatchPredictor
 from src.ml.preprocess import Preprocessor
 from src.ml.train import MLTrainer
@@ -15,7 +16,10 @@ def main(
     transform_data: bool = False,
     preprocess_for_ml: bool = False,
     train_model: bool = False,
+    incremental_training: bool = False,
     predict_all_matches: bool = False,
+    archive_finished_seasons: bool = False,
+    snapshot: bool = False,
 ):
     # Initialize database
     db = DatabaseManager()
@@ -46,15 +50,30 @@ def main(
     if preprocess_for_ml:
         preprocessor = Preprocessor()
         preprocessor.preprocess()
+        # rewrite the store once incremental runs fragmented it, before
+        # training maps it
+        preprocessor.store.maybe_compact()
 
     if train_model:
         trainer = MLTrainer()
-        trainer.training_pipeline()
+        if incremental_training:
+            # fine-tune the served model on new matches only
+            trainer.incremental_pipeline()
+        else:
+            trainer.training_pipeline()
 
     if predict_all_matches:
         predictor = MatchPredictor()
         predictor.predict_all_matches()
 
+    # Move finished seasons out of the hot database
+    if archive_finished_seasons:
+        db.archive_finished_seasons()
+
+    # Export parquet snapshots for training, notebooks and the dashboard
+    if snapshot:
+        SnapshotManager().export()
+
 
 if __name__ == "__main__":
     main(
@@ -64,4 +83,6 @@ if __name__ == "__main__":
         preprocess_for_ml=True,
         train_model=True,
         predict_all_matches=True,
+        archive_finished_seasons=True,
+        snapshot=True,
     )
@@ -2,6 +2,7 @@ import pandas as pd
 import streamlit as st
 from src.config import PREDICT_METADATA_TABLE
 from src.data.database import DatabaseManager
+from src.data.snapshot import SnapshotManager
 
 # Page configuration
 st.set_page_config(page_title="Upcoming Matches", page_icon="📅", layout="wide")
@@ -13,6 +14,22 @@ st.markdown("View predictions for upcoming soccer matches.")
 @st.cache_data(ttl=3600)  # Cache for 1 hour
 def load_upcoming_matches():
     db = DatabaseManager()
+    df = SnapshotManager().read_table(
+        PREDICT_METADATA_TABLE,
+        columns=[
+            "season_link",
+            "date",
+            "home",
+            "away",
+            "home_win_pred_prob",
+            "draw_pred_prob",
+            "away_win_pred_prob",
+        ],
+        filters=[("type", "=", "prediction")],
+        min_watermark=db.table_watermark([PREDICT_METADATA_TABLE]),
+    )
+    if df is not None:
+        return df.sort_values("date", ascending=True, ignore_index=True)
     df = db.get_dataframe(
         f"SELECT season_link, date, home, away, home_win_pred_prob, draw_pred_prob, away_win_pred_prob FROM {PREDICT_METADATA_TABLE} WHERE type='prediction' ORDER BY date ASC"
     )
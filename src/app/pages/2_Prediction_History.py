@@ -2,6 +2,7 @@ import pandas as pd
 import streamlit as st
 from src.config import PREDICT_METADATA_TABLE
 from src.data.database import DatabaseManager
+from src.data.snapshot import SnapshotManager
 
 # Page configuration
 st.set_page_config(page_title="Predictions History", page_icon="📅", layout="wide")
@@ -13,8 +14,26 @@ st.markdown("Explore historical match predictions and their outcomes.")
 @st.cache_data(ttl=3600)  # Cache for 1 hour
 def load_data():
     db = DatabaseManager()
+    df = SnapshotManager().read_table(
+        PREDICT_METADATA_TABLE,
+        columns=[
+            "season_link",
+            "date",
+            "home",
+            "away",
+            "winner",
+            "home_win_pred_prob",
+            "draw_pred_prob",
+            "away_win_pred_prob",
+        ],
+        filters=[("type", "=", "training")],
+        min_watermark=db.table_watermark([PREDICT_METADATA_TABLE]),
+    )
+    if df is not None:
+        return df.sort_values("date", ascending=False, ignore_index=True)
     df = db.get_dataframe(
-        f"SELECT season_link, date, home, away, winner, home_win_pred_prob, draw_pred_prob, away_win_pred_prob FROM {PREDICT_METADATA_TABLE} WHERE type='training' ORDER BY date DESC"
+        f"SELECT season_link, date, home, away, winner, home_win_pred_prob, draw_pred_prob, away_win_pred_prob FROM {PREDICT_METADATA_TABLE} WHERE type='training' ORDER BY date DESC",
+        include_archives=True,
     )
     return df
 
@@ -4,26 +4,67 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 from src.config import PREDICT_METADATA_TABLE
 from src.data.database import DatabaseManager
+from src.data.snapshot import SnapshotManager
 
 st.title("📊 Model Metrics")
 
+# rows of the match predictions table fetched at a time
+PAGE_SIZE = 500
+
+
+# One engine per version of the data, not per rerun: the engine picks the
+# snapshot or SQLite when built, so it is rebuilt once predictions change, a
+# snapshot is exported or a season is archived
+@st.cache_resource(max_entries=1)
+def load_engine(watermark: str, snapshot: str, archives: tuple):
+    return DatabaseManager().analytics_engine()
+
+
 db = DatabaseManager()
-df = db.get_dataframe(
-    f"""SELECT season_link, date, home, away, winner, score,
-                home_win_pred_prob, draw_pred_prob, away_win_pred_prob 
-         FROM {PREDICT_METADATA_TABLE} 
-         WHERE type='training' AND winner IS NOT NULL 
-         ORDER BY date DESC"""
+# Aggregates run in DuckDB when available, otherwise in pandas
+snapshot_manifest = SnapshotManager().manifest()
+engine = load_engine(
+    db.table_watermark([PREDICT_METADATA_TABLE]),
+    snapshot_manifest["name"] if snapshot_manifest else None,
+    tuple(str(path) for path in db.list_archives()),
 )
+if engine is not None:
+    df = None
+    has_data = engine.summary(0)["total_matches"] > 0
+else:
+    df = SnapshotManager().read_table(
+        PREDICT_METADATA_TABLE,
+        columns=[
+            "season_link",
+            "date",
+            "home",
+            "away",
+            "winner",
+            "score",
+            "home_win_pred_prob",
+            "draw_pred_prob",
+            "away_win_pred_prob",
+        ],
+        filters=[("type", "=", "training")],
+        min_watermark=db.table_watermark([PREDICT_METADATA_TABLE]),
+    )
+    if df is not None:
+        df = df[df["winner"].notna()].sort_values(
+            "date", ascending=False, ignore_index=True
+        )
+    else:
+        df = db.get_dataframe(
+            f"""SELECT season_link, date, home, away, winner, score,
+                        home_win_pred_prob, draw_pred_prob, away_win_pred_prob 
+                 FROM {PREDICT_METADATA_TABLE} 
+                 WHERE type='training' AND winner IS NOT NULL 
+                 ORDER BY date DESC""",
+            include_archives=True,
+        )
 
-if not df.empty:
-    # Extract league name
-    df["league"] = df["season_link"].str.extract(r"(\w+-\w+)(?=-Scores)")
-    df.drop("season_link", axis=1, inplace=True)
-
-    # Map actual winner to readable format
-    df["winner"] = df["winner"].map({"0": "Home", "1": "Away", "2": "Draw"})
+    has_data = not df.empty
 
+if has_data:
     # User selectable threshold
     st.sidebar.subheader("Prediction Settings")
     threshold = st.sidebar.slider(
@@ -36,107 +77,133 @@ if not df.empty:
     )
     threshold_decimal = threshold / 100
 
-    # Calculate predicted winner with threshold
-    def get_predicted_winner_with_threshold(row):
-        # Check for NaN values in probabilities
-        if (
-            pd.isna(row["home_win_pred_prob"])
-            or pd.isna(row["draw_pred_prob"])
-            or pd.isna(row["away_win_pred_prob"])
-        ):
-            return "No Prediction"
-
-        max_prob = max(
-            row["home_win_pred_prob"], row["draw_pred_prob"], row["away_win_pred_prob"]
-        )
+    if engine is not None:
+        summary = engine.summary(threshold_decimal)
+        total_matches = summary["total_matches"]
+        confident_predictions = summary["confident_predictions"]
+        correct_predictions = summary["correct_predictions"]
+        accuracy = summary["accuracy"]
+        coverage = summary["coverage"]
 
-        # Only predict if max probability exceeds threshold
-        if max_prob >= threshold_decimal:
-            if row["home_win_pred_prob"] == max_prob:
-                return "Home"
-            elif row["draw_pred_prob"] == max_prob:
-                return "Draw"
-            else:
-                return "Away"
-        else:
-            return "No Prediction"  # Below threshold
+        class_metrics = engine.class_metrics(threshold_decimal)
+        home_precision, home_recall = class_metrics["Home"]
+        away_precision, away_recall = class_metrics["Away"]
+        draw_precision, draw_recall = class_metrics["Draw"]
 
-    df["predicted_winner"] = df.apply(get_predicted_winner_with_threshold, axis=1)
-    df["correct"] = (df["winner"] == df["predicted_winner"]) & (
-        df["predicted_winner"] != "No Prediction"
-    )
-
-    # Calculate metrics
-    total_matches = len(df)
-    confident_predictions = len(df[df["predicted_winner"] != "No Prediction"])
-    correct_predictions = df["correct"].sum()
+        confusion_pivot = engine.confusion_matrix(threshold_decimal)
+    else:
+        # Extract league name
+        df["league"] = df["season_link"].str.extract(r"(\w+-\w+)(?=-Scores)")
+        df.drop("season_link", axis=1, inplace=True)
+
+        # Map actual winner to readable format
+        df["winner"] = df["winner"].map({"0": "Home", "1": "Away", "2": "Draw"})
+
+        # Calculate predicted winner with threshold
+        def get_predicted_winner_with_threshold(row):
+            # Check for NaN values in probabilities
+            if (
+                pd.isna(row["home_win_pred_prob"])
+                or pd.isna(row["draw_pred_prob"])
+                or pd.isna(row["away_win_pred_prob"])
+            ):
+                return "No Prediction"
+
+            max_prob = max(
+                row["home_win_pred_prob"],
+                row["draw_pred_prob"],
+                row["away_win_pred_prob"],
+            )
 
-    # Accuracy only for confident predictions
-    accuracy = (
-        (correct_predictions / confident_predictions * 100)
-        if confident_predictions > 0
-        else 0
-    )
+            # Only predict if max probability exceeds threshold
+            if max_prob >= threshold_decimal:
+                if row["home_win_pred_prob"] == max_prob:
+                    return "Home"
+                elif row["draw_pred_prob"] == max_prob:
+                    return "Draw"
+                else:
+                    return "Away"
+            else:
+                return "No Prediction"  # Below threshold
 
-    # Coverage (percentage of matches where we made predictions)
-    coverage = (confident_predictions / total_matches * 100) if total_matches > 0 else 0
+        df["predicted_winner"] = df.apply(get_predicted_winner_with_threshold, axis=1)
+        df["correct"] = (df["winner"] == df["predicted_winner"]) & (
+            df["predicted_winner"] != "No Prediction"
+        )
 
-    # Calculate precision and recall for each class (only for confident predictions)
-    def calculate_class_metrics(df, class_name):
-        confident_df = df[df["predicted_winner"] != "No Prediction"]
+        # Calculate metrics
+        total_matches = len(df)
+        confident_predictions = len(df[df["predicted_winner"] != "No Prediction"])
+        correct_predictions = df["correct"].sum()
 
-        true_positives = (
-            (confident_df["winner"] == class_name)
-            & (confident_df["predicted_winner"] == class_name)
-        ).sum()
-        false_positives = (
-            (confident_df["winner"] != class_name)
-            & (confident_df["predicted_winner"] == class_name)
-        ).sum()
-        false_negatives = (
-            (df["winner"] == class_name)
-            & (confident_df["predicted_winner"] != class_name)
-        ).sum()
-
-        precision = (
-            true_positives / (true_positives + false_positives)
-            if (true_positives + false_positives) > 0
+        # Accuracy only for confident predictions
+        accuracy = (
+            (correct_predictions / confident_predictions * 100)
+            if confident_predictions > 0
             else 0
         )
-        recall = (
-            true_positives / (true_positives + false_negatives)
-            if (true_positives + false_negatives) > 0
-            else 0
-        )
-
-        return precision * 100, recall * 100
 
-    home_precision, home_recall = calculate_class_metrics(df, "Home")
-    away_precision, away_recall = calculate_class_metrics(df, "Away")
-    draw_precision, draw_recall = calculate_class_metrics(df, "Draw")
+        # Coverage (percentage of matches where we made predictions)
+        coverage = (
+            (confident_predictions / total_matches * 100) if total_matches > 0 else 0
+        )
 
-    # Create confusion matrix (only confident predictions)
-    confident_df = df[df["predicted_winner"] != "No Prediction"]
-    confusion_data = []
-    classes = ["Home", "Away", "Draw"]
+        # Calculate precision and recall for each class (only for confident predictions)
+        def calculate_class_metrics(df, class_name):
+            confident_df = df[df["predicted_winner"] != "No Prediction"]
 
-    for actual in classes:
-        for predicted in classes:
-            count = (
-                (confident_df["winner"] == actual)
-                & (confident_df["predicted_winner"] == predicted)
+            true_positives = (
+                (confident_df["winner"] == class_name)
+                & (confident_df["predicted_winner"] == class_name)
+            ).sum()
+            false_positives = (
+                (confident_df["winner"] != class_name)
+                & (confident_df["predicted_winner"] == class_name)
             ).sum()
-            confusion_data.append(
-                {"Actual": actual, "Predicted": predicted, "Count": count}
+            false_negatives = (
+                (df["winner"] == class_name)
+                & (confident_df["predicted_winner"] != class_name)
+            ).sum()
+
+            precision = (
+                true_positives / (true_positives + false_positives)
+                if (true_positives + false_positives) > 0
+                else 0
             )
+            recall = (
+                true_positives / (true_positives + false_negatives)
+                if (true_positives + false_negatives) > 0
+                else 0
+            )
+
+            return precision * 100, recall * 100
+
+        home_precision, home_recall = calculate_class_metrics(df, "Home")
+        away_precision, away_recall = calculate_class_metrics(df, "Away")
+        draw_precision, draw_recall = calculate_class_metrics(df, "Draw")
 
-    confusion_df = pd.DataFrame(confusion_data)
-    confusion_pivot = confusion_df.pivot(
-        index="Actual", columns="Predicted", values="Count"
-    ).fillna(0)
+        # Create confusion matrix (only confident predictions)
+        confident_df = df[df["predicted_winner"] != "No Prediction"]
+        confusion_data = []
+        classes = ["Home", "Away", "Draw"]
+
+        for actual in classes:
+            for predicted in classes:
+                count = (
+                    (confident_df["winner"] == actual)
+                    & (confident_df["predicted_winner"] == predicted)
+                ).sum()
+                confusion_data.append(
+                    {"Actual": actual, "Predicted": predicted, "Count": count}
+                )
+
+        confusion_df = pd.DataFrame(confusion_data)
+        confusion_pivot = confusion_df.pivot(
+            index="Actual", columns="Predicted", values="Count"
+        ).fillna(0)
 
     # Create confusion matrix plot
-    if not confident_df.empty:
+    if confident_predictions > 0:
         fig, ax = plt.subplots(figsize=(8, 6))
         sns.heatmap(
             confusion_pivot, annot=True, fmt="d", cmap="Blues", cbar=True, ax=ax
@@ -197,60 +264,79 @@ if not df.empty:
     else:
         st.warning("No confident predictions made with the current threshold.")
 
+    if engine is not None:
+        col1, col2 = st.columns(2)
+        with col1:
+            st.subheader("Accuracy by League")
+            st.write(engine.accuracy_by("league", threshold_decimal))
+        with col2:
+            st.subheader("Accuracy by Team")
+            st.write(engine.accuracy_by("team", threshold_decimal))
+
     # Show matches table
     st.subheader("Match Predictions")
 
-    # Format probabilities for display
-    display_df = df.copy()
+    if engine is not None:
+        # formatted in DuckDB, one page at a time
+        pages = max(1, -(-total_matches // PAGE_SIZE))
+        page = st.number_input("Page", min_value=1, max_value=pages, value=1)
+        st.write(
+            engine.predictions(
+                threshold_decimal, limit=PAGE_SIZE, offset=(page - 1) * PAGE_SIZE
+            )
+        )
+    else:
+        # Format probabilities for display
+        display_df = df.copy()
 
-    # Create new columns with proper names - handle NaN values
-    display_df["Home Win %"] = display_df["home_win_pred_prob"].apply(
-        lambda x: f"{int(x * 100)} %" if pd.notna(x) else "N/A %"
-    )
-    display_df["Draw %"] = display_df["draw_pred_prob"].apply(
-        lambda x: f"{int(x * 100)} %" if pd.notna(x) else "N/A %"
-    )
-    display_df["Away Win %"] = display_df["away_win_pred_prob"].apply(
-        lambda x: f"{int(x * 100)} %" if pd.notna(x) else "N/A %"
-    )
+        # Create new columns with proper names - handle NaN values
+        display_df["Home Win %"] = display_df["home_win_pred_prob"].apply(
+            lambda x: f"{int(x * 100)} %" if pd.notna(x) else "N/A %"
+        )
+        display_df["Draw %"] = display_df["draw_pred_prob"].apply(
+            lambda x: f"{int(x * 100)} %" if pd.notna(x) else "N/A %"
+        )
+        display_df["Away Win %"] = display_df["away_win_pred_prob"].apply(
+            lambda x: f"{int(x * 100)} %" if pd.notna(x) else "N/A %"
+        )
 
-    # Add max probability column - handle NaN values
-    display_df["Max Probability"] = display_df[
-        ["home_win_pred_prob", "draw_pred_prob", "away_win_pred_prob"]
-    ].max(axis=1)
-    display_df["Max Probability %"] = display_df["Max Probability"].apply(
-        lambda x: f"{int(x * 100)} %" if pd.notna(x) else "N/A %"
-    )
+        # Add max probability column - handle NaN values
+        display_df["Max Probability"] = display_df[
+            ["home_win_pred_prob", "draw_pred_prob", "away_win_pred_prob"]
+        ].max(axis=1)
+        display_df["Max Probability %"] = display_df["Max Probability"].apply(
+            lambda x: f"{int(x * 100)} %" if pd.notna(x) else "N/A %"
+        )
 
-    # Final columns for display
-    display_df = display_df[
-        [
-            "league",
-            "date",
-            "home",
-            "away",
-            "score",
-            "winner",
-            "predicted_winner",
-            "Home Win %",
-            "Draw %",
-            "Away Win %",
-            "Max Probability %",
-            "correct",
+        # Final columns for display
+        display_df = display_df[
+            [
+                "league",
+                "date",
+                "home",
+                "away",
+                "score",
+                "winner",
+                "predicted_winner",
+                "Home Win %",
+                "Draw %",
+                "Away Win %",
+                "Max Probability %",
+                "correct",
+            ]
         ]
-    ]
-
-    # Rename for better display
-    display_df.rename(
-        columns={
-            "predicted_winner": "Predicted",
-            "correct": "Correct?",
-            "winner": "Actual",
-        },
-        inplace=True,
-    )
 
-    st.write(display_df)
+        # Rename for better display
+        display_df.rename(
+            columns={
+                "predicted_winner": "Predicted",
+                "correct": "Correct?",
+                "winner": "Actual",
+            },
+            inplace=True,
+        )
+
+        st.write(display_df)
 
 else:
     st.warning("No training data with results available for metrics calculation.")
@@ -5,6 +5,10 @@ from pathlib import Path
 # ==========================================================================
 DATABASE_PATH = Path(__file__).parent.parent / "data"
 PROCESSED_TENSORS_PATH = DATABASE_PATH / "processed_tensors"
+TENSOR_STORE_PATH = PROCESSED_TENSORS_PATH / "store"  # sharded .npy tensor store
+FEATURE_CACHE_PATH = PROCESSED_TENSORS_PATH / "versions"  # a tensor store per version
+ARCHIVE_PATH = DATABASE_PATH / "archive"  # read-only finished season databases
+SNAPSHOT_PATH = DATABASE_PATH / "snapshots"  # parquet exports of the tables
 MODEL_ARTIFACTS_PATH = Path(__file__).parent.parent / "model_artifacts"
 # Logger paths
 LOGS_PATH = Path(__file__).parent.parent / "logs"
@@ -77,6 +81,89 @@ DATABASE_CONFIG = {
 RAW_TABLE = "raw_matches"
 TRANSFORMED_TABLE = "transformed_matches"
 PREDICT_METADATA_TABLE = "predict_metadata"
+RAW_BLOBS_TABLE = "raw_match_blobs"
+RAW_BLOB_DICTIONARIES_TABLE = "raw_blob_dictionaries"
+SEASON_ARCHIVES_TABLE = "season_archives"
+CHANGE_LOG_TABLE = "change_log"
+CHANGE_LOG_OFFSETS_TABLE = "change_log_offsets"
+# Stages that consume the change log, each with its own offset
+CHANGE_LOG_CONSUMERS = ["transformer", "preprocessor", "predictor"]
+# Offsets not moved for this long no longer hold the change log back, e.g. a
+# feature version built once; once pruned past, their consumer does a full scan
+CHANGE_LOG_RETENTION_DAYS = 30
+# Pseudo consumer whose offset is the last pruned change_id
+CHANGE_LOG_PRUNED = "pruned"
+
+# Raw HTML blob compression (zstd with a shared dictionary)
+RAW_BLOB_COMPRESSION_LEVEL = 10
+RAW_BLOB_DICTIONARY_SIZE = 112_640  # bytes
+RAW_BLOB_DICTIONARY_SAMPLES = 1000  # max html pages used to train the dictionary
+RAW_BLOB_DICTIONARY_MIN_SAMPLES = 50  # min html pages required to train it
+
+# Processed tensor store
+TENSOR_STORE_SHARD_SIZE = 10_000  # max matches per shard written by migrations
+# "dense": every window stored in full, "indexed": each oriented match row stored
+# once per shard and windows stored as int32 row indices into it
+TENSOR_STORE_LAYOUT = "indexed"
+# Feature values on disk: "float32", "float16" or "int16" (fixed point with up to
+# two decimals per feature). A shard falls back to float32 unless they round-trip
+# exactly, reads always return float32
+TENSOR_STORE_PRECISION = "float32"
+TENSOR_STORE_COMPRESSION = None  # "zstd": feature arrays compressed in row blocks
+TENSOR_STORE_BLOCK_ROWS = 4096  # rows per compressed block
+# Preprocessing compacts the store once it has more shards or a larger share of
+# superseded rows than this, and no other process reads it
+TENSOR_STORE_MAX_SHARDS = 20
+TENSOR_STORE_MAX_SUPERSEDED = 0.3
+
+# Feature cache: tensor stores versioned by (window size, feature set)
+DEFAULT_WINDOW_SIZE = 10  # last n matches of each team
+FEATURE_CACHE_BUDGET_BYTES = 5 * 1024**3  # least recently used versions evicted above
+# "standard": mean/std, "robust": median/interquartile range of each feature
+NORMALIZATION_METHOD = "standard"
+
+# Walk-forward validation: train on every match before a block of matchdays,
+# test on the block
+WALK_FORWARD_MIN_TRAIN_SEASONS = 2  # seasons always in the training data
+WALK_FORWARD_BLOCK_DAYS = 7  # length of a test block, about one matchday
+WALK_FORWARD_FOLDS = 8  # test blocks, spread evenly over the later seasons
+WALK_FORWARD_WORKERS = 2  # folds trained in parallel processes
+
+# Hyperparameter search: sampled HybridTransformerModel configurations trained
+# in parallel, pruned by successive halving on validation loss
+TUNING_PATH = MODEL_ARTIFACTS_PATH / "tuning"
+TUNING_SEARCH_SPACE = {
+    "num_heads": [2, 4, 8],
+    "dense_units": [[64, 32], [128, 64], [256, 128]],
+    "dropout_rates": [[0.2, 0.1], [0.3, 0.2], [0.5, 0.3]],
+    "learning_rate": [3e-4, 1e-3, 3e-3],
+}
+TUNING_TRIALS = 18  # configurations sampled from the search space
+TUNING_MIN_EPOCHS = 2  # epochs of the first rung
+TUNING_REDUCTION_FACTOR = 3  # 1/3 of the trials kept, 3x the epochs each rung
+TUNING_MAX_EPOCHS = 30
+TUNING_WORKERS = 4  # trials trained in parallel processes
+
+# Versioned models, each tagged with the fingerprint of its training run
+MODEL_REGISTRY_PATH = MODEL_ARTIFACTS_PATH / "registry"
+
+# Training profiler: per epoch performance next to training_history.csv and an
+# optional tf.profiler trace of chosen training steps
+TRAINING_PROFILE_PATH = MODEL_ARTIFACTS_PATH / "training_profile.csv"
+TRAINING_TRACE_PATH = MODEL_ARTIFACTS_PATH / "profile"
+TRAINING_PROFILE_PROBE_STEPS = 20  # batches timed to measure the input pipeline
+
+# Incremental training: the served model fine-tuned on matches it has not seen
+TRAINING_STATE_PATH = MODEL_ARTIFACTS_PATH / "training_state.json"
+INCREMENTAL_EPOCHS = 5
+INCREMENTAL_LEARNING_RATE = 1e-4
+INCREMENTAL_REPLAY_RATIO = 2  # older training matches replayed per new match
+# share of the newest new matches added to the holdout on each run, its oldest
+# matches leave it for training so it keeps its size
+INCREMENTAL_HOLDOUT_SHARE = 0.2
+# holdout loss increase and accuracy drop a fine-tuned model may have and still
+# replace the previous one
+INCREMENTAL_MAX_REGRESSION = 0.002
 
 TRANSFORMED_COLUMNS = [
     "season_link",
@@ -127,6 +214,18 @@ TRANSFORMED_COLUMNS = [
     "away_long_balls",
 ]
 
+# Columns of the matches DataFrame that are not model features
+NOT_FEATURE_COLUMNS = [
+    "date",
+    "home",
+    "away",
+    "attendance",
+    "report_link",
+    "date_added",
+    "last_updated",
+    "season_link",
+]
+
 
 COLUMN_MAP = {
     "Fouls": ("home_fouls", "away_fouls"),
@@ -153,8 +252,8 @@ RAW_TABLE_QUERY = f"""
                     score TEXT,
                     away TEXT NOT NULL,
                     attendance TEXT,
-                    team_stats TEXT,
-                    extra_stats TEXT,
+                    team_stats_id INTEGER REFERENCES {RAW_BLOBS_TABLE}(blob_id),
+                    extra_stats_id INTEGER REFERENCES {RAW_BLOBS_TABLE}(blob_id),
                     
                     -- Metadata
                     date_added TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
@@ -167,6 +266,28 @@ RAW_TABLE_QUERY = f"""
                 CREATE INDEX IF NOT EXISTS idx_match_composite ON {RAW_TABLE}(season_link, home, away);
                 """
 
+RAW_BLOBS_TABLE_QUERY = f"""
+                CREATE TABLE IF NOT EXISTS {RAW_BLOB_DICTIONARIES_TABLE} (
+                    dictionary_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    data BLOB NOT NULL,
+                    sample_count INTEGER NOT NULL,
+
+                    -- Metadata
+                    date_added TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                );
+
+                CREATE TABLE IF NOT EXISTS {RAW_BLOBS_TABLE} (
+                    blob_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    -- NULL when compressed without a shared dictionary
+                    dictionary_id INTEGER REFERENCES {RAW_BLOB_DICTIONARIES_TABLE}(dictionary_id),
+                    raw_size INTEGER NOT NULL,
+                    data BLOB NOT NULL,
+
+                    -- Metadata
+                    date_added TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                );
+                """
+
 TRANSFOMED_TABLE_QUERY = f"""
                 CREATE TABLE IF NOT EXISTS {TRANSFORMED_TABLE} (
                     -- Original match data
@@ -245,6 +366,7 @@ PREDICT_METADATA_TABLE_QUERY = f"""
                     home_win_pred_prob REAL,
                     draw_pred_prob REAL,
                     away_win_pred_prob REAL,
+                    model_version TEXT,  -- registry version that made the prediction
                     report_link TEXT,
 
                     -- Metadata
@@ -255,6 +377,73 @@ PREDICT_METADATA_TABLE_QUERY = f"""
                 )
 """
 
+SEASON_ARCHIVES_TABLE_QUERY = f"""
+                CREATE TABLE IF NOT EXISTS {SEASON_ARCHIVES_TABLE} (
+                    season_link TEXT PRIMARY KEY,
+                    season_label TEXT NOT NULL,
+                    archive_file TEXT NOT NULL,
+
+                    -- Metadata
+                    date_added TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+"""
+
+# Columns whose changes are meaningful for downstream stages
+CHANGE_LOG_TRACKED_COLUMNS = {
+    RAW_TABLE: ["date", "score", "report_link", "team_stats_id", "extra_stats_id"],
+    TRANSFORMED_TABLE: [col for col in TRANSFORMED_COLUMNS if col != "report_link"],
+    PREDICT_METADATA_TABLE: ["date", "score", "winner", "type"],
+}
+
+
+def _change_log_triggers(table: str, columns: list[str]) -> str:
+    changed = " OR ".join(f"OLD.{col} IS NOT NEW.{col}" for col in columns)
+    return f"""
+                CREATE TRIGGER IF NOT EXISTS {table}_change_log_insert
+                AFTER INSERT ON {table}
+                BEGIN
+                    INSERT INTO {CHANGE_LOG_TABLE} (table_name, operation, season_link, home, away, report_link)
+                    VALUES ('{table}', 'insert', NEW.season_link, NEW.home, NEW.away, NEW.report_link);
+                END;
+
+                CREATE TRIGGER IF NOT EXISTS {table}_change_log_update
+                AFTER UPDATE ON {table}
+                WHEN {changed}
+                BEGIN
+                    INSERT INTO {CHANGE_LOG_TABLE} (table_name, operation, season_link, home, away, report_link)
+                    VALUES ('{table}', 'update', NEW.season_link, NEW.home, NEW.away, NEW.report_link);
+                END;
+                """
+
+
+CHANGE_LOG_TABLE_QUERY = f"""
+                CREATE TABLE IF NOT EXISTS {CHANGE_LOG_TABLE} (
+                    change_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    table_name TEXT NOT NULL,
+                    operation TEXT NOT NULL,
+
+                    -- Key of the changed match
+                    season_link TEXT,
+                    home TEXT,
+                    away TEXT,
+                    report_link TEXT,
+
+                    -- Metadata
+                    changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                );
+
+                CREATE INDEX IF NOT EXISTS idx_change_log_table ON {CHANGE_LOG_TABLE}(table_name, change_id);
+
+                CREATE TABLE IF NOT EXISTS {CHANGE_LOG_OFFSETS_TABLE} (
+                    consumer TEXT PRIMARY KEY,
+                    last_change_id INTEGER NOT NULL,
+
+                    -- Metadata
+                    last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                );
+                {"".join(_change_log_triggers(table, columns) for table, columns in CHANGE_LOG_TRACKED_COLUMNS.items())}
+                """
+
 # ==========================================================================
 # ML Configuration
 # ==========================================================================
@@ -0,0 +1,220 @@
+import pandas as pd
+
+from src.config import DATABASE_LOGGER_PATH, PREDICT_METADATA_TABLE
+from src.data.snapshot import SnapshotManager
+from src.logger import get_logger
+
+try:
+    import duckdb
+except ImportError:  # optional dependency
+    duckdb = None
+
+logger = get_logger("Database", DATABASE_LOGGER_PATH)
+
+OUTCOMES = ["Home", "Away", "Draw"]
+
+
+def _percent(column: str) -> str:
+    """SQL formatting a probability as a whole percentage, 'N/A %' if NULL"""
+    return f"COALESCE(CAST(trunc({column} * 100) AS INTEGER) || ' %', 'N/A %')"
+
+
+# Predicted outcome of a match given a minimum probability threshold ($threshold)
+PREDICTIONS_QUERY = f"""
+    SELECT
+        *,
+        regexp_extract(season_link, '(\\w+-\\w+)-Scores', 1) AS league,
+        CASE CAST(winner AS VARCHAR)
+            WHEN '0' THEN 'Home' WHEN '1' THEN 'Away' WHEN '2' THEN 'Draw'
+        END AS actual,
+        CASE
+            WHEN home_win_pred_prob IS NULL OR draw_pred_prob IS NULL
+                 OR away_win_pred_prob IS NULL THEN 'No Prediction'
+            WHEN greatest(home_win_pred_prob, draw_pred_prob, away_win_pred_prob) < $threshold
+                THEN 'No Prediction'
+            WHEN home_win_pred_prob = greatest(home_win_pred_prob, draw_pred_prob, away_win_pred_prob)
+                THEN 'Home'
+            WHEN draw_pred_prob = greatest(home_win_pred_prob, draw_pred_prob, away_win_pred_prob)
+                THEN 'Draw'
+            ELSE 'Away'
+        END AS predicted
+    FROM {PREDICT_METADATA_TABLE}
+    WHERE type = 'training' AND winner IS NOT NULL
+"""
+
+
+class AnalyticsEngine:
+    """Vectorized aggregate queries for the dashboard, executed by DuckDB.
+
+    predict_metadata is read from the current parquet snapshot when it is fresh,
+    otherwise straight from the SQLite hot database and its season archives, so
+    only the aggregated results reach pandas. The source is picked once, when
+    the engine is built.
+
+    Reading SQLite needs DuckDB's sqlite extension, provisioned at install time
+    with `python -m src.data.analytics`; it is never downloaded at runtime.
+    """
+
+    def __init__(self, db):
+        if duckdb is None:
+            raise ImportError("duckdb is not installed")
+        self.db = db
+        # extensions are provisioned at install time, never downloaded here
+        self.conn = duckdb.connect(config={"autoinstall_known_extensions": False})
+        self.source = self._register_source()
+
+    def _register_source(self) -> str:
+        snapshot = SnapshotManager()
+        if snapshot.is_fresh(self.db.table_watermark([PREDICT_METADATA_TABLE])):
+            manifest = snapshot.manifest()
+            if PREDICT_METADATA_TABLE in manifest["tables"]:
+                files = snapshot.path / manifest["name"] / PREDICT_METADATA_TABLE
+                self.conn.execute(
+                    f"""
+                    CREATE VIEW {PREDICT_METADATA_TABLE} AS
+                    SELECT * FROM read_parquet('{files}/**/*.parquet', hive_partitioning = true)
+                    """
+                )
+                return "snapshot"
+
+        try:
+            self.conn.execute("LOAD sqlite")
+        except duckdb.Error as e:
+            raise RuntimeError(
+                f"DuckDB sqlite extension not installed, run `python -m src.data.analytics`: {e}"
+            ) from e
+        databases = [self.db.config["sqlite_path"], *self.db.list_archives()]
+        scans = " UNION ALL BY NAME ".join(
+            f"SELECT * FROM sqlite_scan('{path}', '{PREDICT_METADATA_TABLE}')"
+            for path in databases
+        )
+        self.conn.execute(f"CREATE VIEW {PREDICT_METADATA_TABLE} AS {scans}")
+        return "sqlite"
+
+    def _query(self, query: str, threshold: float, params: dict = None):
+        """Run query over the `predictions` relation for the given threshold.
+        Each query gets its own cursor, so a cached engine can serve several
+        dashboard sessions at once"""
+        return self.conn.cursor().execute(
+            f"WITH predictions AS ({PREDICTIONS_QUERY}) {query}",
+            {"threshold": threshold, **(params or {})},
+        )
+
+    def summary(self, threshold: float) -> dict:
+        """Total matches, confident and correct predictions, accuracy and coverage (%)"""
+        total, confident, correct = self._query(
+            """
+            SELECT
+                COUNT(*),
+                COUNT(*) FILTER (WHERE predicted != 'No Prediction'),
+                COUNT(*) FILTER (WHERE predicted = actual)
+            FROM predictions
+            """,
+            threshold,
+        ).fetchone()
+        return {
+            "total_matches": total,
+            "confident_predictions": confident,
+            "correct_predictions": correct,
+            "accuracy": correct / confident * 100 if confident > 0 else 0,
+            "coverage": confident / total * 100 if total > 0 else 0,
+        }
+
+    def confusion_matrix(self, threshold: float) -> pd.DataFrame:
+        """Actual x predicted counts of the confident predictions"""
+        counts = self._query(
+            """
+            SELECT actual, predicted, COUNT(*) AS count
+            FROM predictions
+            WHERE predicted != 'No Prediction' AND actual IS NOT NULL
+            GROUP BY actual, predicted
+            """,
+            threshold,
+        ).df()
+        return (
+            counts.pivot(index="actual", columns="predicted", values="count")
+            .reindex(index=OUTCOMES, columns=OUTCOMES)
+            .fillna(0)
+            .astype(int)
+            .rename_axis(index="Actual", columns="Predicted")
+        )
+
+    def class_metrics(self, threshold: float) -> dict:
+        """{outcome: (precision %, recall %)} over the confident predictions"""
+        rows = self._query(
+            """
+            SELECT
+                outcome,
+                COALESCE(100.0 * COUNT(*) FILTER (WHERE predicted = outcome AND actual = outcome)
+                    / NULLIF(COUNT(*) FILTER (WHERE predicted = outcome), 0), 0),
+                COALESCE(100.0 * COUNT(*) FILTER (WHERE predicted = outcome AND actual = outcome)
+                    / NULLIF(COUNT(*) FILTER (
+                        WHERE actual = outcome AND predicted != 'No Prediction'
+                    ), 0), 0)
+            FROM predictions, (SELECT unnest($outcomes) AS outcome)
+            GROUP BY outcome
+            """,
+            threshold,
+            {"outcomes": OUTCOMES},
+        ).fetchall()
+        metrics = {outcome: (precision, recall) for outcome, precision, recall in rows}
+        return {outcome: metrics.get(outcome, (0, 0)) for outcome in OUTCOMES}
+
+    def predictions(
+        self, threshold: float, limit: int = None, offset: int = 0
+    ) -> pd.DataFrame:
+        """Per match predictions formatted for display, most recent first.
+        Only the limit rows after offset are fetched, all of them if None"""
+        return self._query(
+            f"""
+            SELECT
+                league, date, home, away, score,
+                actual AS "Actual",
+                predicted AS "Predicted",
+                {_percent("home_win_pred_prob")} AS "Home Win %",
+                {_percent("draw_pred_prob")} AS "Draw %",
+                {_percent("away_win_pred_prob")} AS "Away Win %",
+                {_percent("greatest(home_win_pred_prob, draw_pred_prob, away_win_pred_prob)")}
+                    AS "Max Probability %",
+                COALESCE(predicted = actual, false) AS "Correct?"
+            FROM predictions
+            ORDER BY date DESC
+            LIMIT $limit OFFSET $offset
+            """,
+            threshold,
+            {"limit": limit, "offset": offset},
+        ).df()
+
+    def accuracy_by(self, group: str, threshold: float) -> pd.DataFrame:
+        """Matches, confident predictions and accuracy per league or team"""
+        if group == "league":
+            source = "SELECT league AS name, predicted, actual FROM predictions"
+        elif group == "team":
+            source = """
+                SELECT home AS name, predicted, actual FROM predictions
+                UNION ALL
+                SELECT away AS name, predicted, actual FROM predictions
+            """
+        else:
+            raise ValueError(f"Unknown group {group}, expected 'league' or 'team'")
+        return self._query(
+            f"""
+            SELECT
+                name AS {group},
+                COUNT(*) AS matches,
+                COUNT(*) FILTER (WHERE predicted != 'No Prediction') AS confident_predictions,
+                100.0 * COUNT(*) FILTER (WHERE predicted = actual)
+                    / NULLIF(COUNT(*) FILTER (WHERE predicted != 'No Prediction'), 0) AS accuracy
+            FROM ({source})
+            GROUP BY name
+            ORDER BY matches DESC, name
+            """,
+            threshold,
+        ).df()
+
+
+if __name__ == "__main__":
+    # Install time: provision the sqlite extension the engine loads
+    duckdb.execute("INSTALL sqlite")
+    duckdb.execute("LOAD sqlite")
+    logger.info("DuckDB sqlite extension installed")
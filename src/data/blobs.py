@@ -0,0 +1,147 @@
+import zstandard
+
+from src.config import (
+    DATABASE_LOGGER_PATH,
+    RAW_BLOB_COMPRESSION_LEVEL,
+    RAW_BLOB_DICTIONARIES_TABLE,
+    RAW_BLOB_DICTIONARY_MIN_SAMPLES,
+    RAW_BLOB_DICTIONARY_SAMPLES,
+    RAW_BLOB_DICTIONARY_SIZE,
+    RAW_BLOBS_TABLE,
+)
+from src.logger import get_logger
+
+logger = get_logger("Database", DATABASE_LOGGER_PATH)
+
+
+class BlobStore:
+    """Compressed storage for the raw match report HTML.
+
+    Pages are compressed with zstd using the latest shared dictionary (if one
+    has been trained) and referenced from raw_matches by blob_id, so scans of
+    the match metadata never read the HTML.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._compressor = None
+        self._compressor_dictionary_id = None
+        self._decompressors = {}
+
+    # ------------------------------------------------------------------
+    # Dictionaries
+    # ------------------------------------------------------------------
+    def _latest_dictionary(self, conn=None):
+        query = f"SELECT dictionary_id, data FROM {RAW_BLOB_DICTIONARIES_TABLE} ORDER BY dictionary_id DESC LIMIT 1"
+        rows = conn.execute(query).fetchall() if conn else self.db.execute_query(query)
+        if not rows:
+            return None, None
+        return rows[0][0], zstandard.ZstdCompressionDict(rows[0][1])
+
+    def _get_compressor(self, conn=None):
+        if self._compressor is None:
+            dictionary_id, dictionary = self._latest_dictionary(conn)
+            self._compressor = zstandard.ZstdCompressor(
+                level=RAW_BLOB_COMPRESSION_LEVEL, dict_data=dictionary
+            )
+            self._compressor_dictionary_id = dictionary_id
+        return self._compressor, self._compressor_dictionary_id
+
+    def _get_decompressor(self, dictionary_id, conn=None):
+        if dictionary_id not in self._decompressors:
+            dictionary = None
+            if dictionary_id is not None:
+                query = f"SELECT data FROM {RAW_BLOB_DICTIONARIES_TABLE} WHERE dictionary_id = ?"
+                rows = (
+                    conn.execute(query, (dictionary_id,)).fetchall()
+                    if conn
+                    else self.db.execute_query(query, (dictionary_id,))
+                )
+                dictionary = zstandard.ZstdCompressionDict(rows[0][0])
+            self._decompressors[dictionary_id] = zstandard.ZstdDecompressor(
+                dict_data=dictionary
+            )
+        return self._decompressors[dictionary_id]
+
+    def train_dictionary(self, samples: list[str], conn=None):
+        """Train a shared zstd dictionary from html samples and store it.
+
+        Returns the new dictionary_id, or None if there are not enough samples.
+        """
+        samples = [s.encode("utf-8") for s in samples if s]
+        if len(samples) < RAW_BLOB_DICTIONARY_MIN_SAMPLES:
+            logger.info(
+                f"Not enough html samples to train a dictionary ({len(samples)}/{RAW_BLOB_DICTIONARY_MIN_SAMPLES})"
+            )
+            return None
+        try:
+            dictionary = zstandard.train_dictionary(RAW_BLOB_DICTIONARY_SIZE, samples)
+        except zstandard.ZstdError as e:
+            logger.error(f"Error training zstd dictionary: {e}")
+            return None
+
+        query = f"INSERT INTO {RAW_BLOB_DICTIONARIES_TABLE} (data, sample_count) VALUES (?, ?) RETURNING dictionary_id"
+        params = (dictionary.as_bytes(), len(samples))
+        if conn:
+            dictionary_id = conn.execute(query, params).fetchone()[0]
+        else:
+            dictionary_id = self.db.execute_query(query, params)[0][0]
+
+        # New blobs are compressed with the new dictionary from now on
+        self._compressor = None
+        logger.info(
+            f"Trained zstd dictionary {dictionary_id} from {len(samples)} html samples"
+        )
+        return dictionary_id
+
+    def ensure_dictionary(self):
+        """Train the first dictionary once enough blobs have been stored"""
+        try:
+            if self._latest_dictionary()[0] is not None:
+                return
+            rows = self.db.execute_query(
+                f"SELECT blob_id FROM {RAW_BLOBS_TABLE} ORDER BY blob_id DESC LIMIT ?",
+                (RAW_BLOB_DICTIONARY_SAMPLES,),
+            )
+            samples = self.get_many([row[0] for row in rows])
+            self.train_dictionary(list(samples.values()))
+        except Exception as e:
+            logger.error(f"Error ensuring blob dictionary: {e}")
+
+    # ------------------------------------------------------------------
+    # Blobs
+    # ------------------------------------------------------------------
+    def put(self, html: str, conn=None):
+        """Compress html and store it, returning its blob_id (None for empty html)"""
+        if html is None:
+            return None
+        raw = html.encode("utf-8")
+        compressor, dictionary_id = self._get_compressor(conn)
+        query = f"INSERT INTO {RAW_BLOBS_TABLE} (dictionary_id, raw_size, data) VALUES (?, ?, ?) RETURNING blob_id"
+        params = (dictionary_id, len(raw), compressor.compress(raw))
+        if conn:
+            return conn.execute(query, params).fetchone()[0]
+        return self.db.execute_query(query, params)[0][0]
+
+    def get(self, blob_id: int):
+        """Return the decompressed html for blob_id"""
+        if blob_id is None:
+            return None
+        return self.get_many([blob_id]).get(blob_id)
+
+    def get_many(self, blob_ids: list[int]) -> dict:
+        """Return {blob_id: html} for the given blob ids"""
+        blob_ids = [blob_id for blob_id in blob_ids if blob_id is not None]
+        pages = {}
+        # Stay well below SQLite's bound parameter limit
+        for start in range(0, len(blob_ids), 500):
+            chunk = blob_ids[start : start + 500]
+            placeholders = ", ".join(["?"] * len(chunk))
+            rows = self.db.execute_query(
+                f"SELECT blob_id, dictionary_id, data FROM {RAW_BLOBS_TABLE} WHERE blob_id IN ({placeholders})",
+                tuple(chunk),
+            )
+            for blob_id, dictionary_id, data in rows:
+                decompressor = self._get_decompressor(dictionary_id)
+                pages[blob_id] = decompressor.decompress(data).decode("utf-8")
+        return pages
@@ -0,0 +1,163 @@
+from src.config import (
+    CHANGE_LOG_CONSUMERS,
+    CHANGE_LOG_OFFSETS_TABLE,
+    CHANGE_LOG_PRUNED,
+    CHANGE_LOG_RETENTION_DAYS,
+    CHANGE_LOG_TABLE,
+    DATABASE_LOGGER_PATH,
+)
+from src.logger import get_logger
+
+logger = get_logger("Database", DATABASE_LOGGER_PATH)
+
+
+class ChangeLog:
+    """Consumer view of the change_log table.
+
+    Triggers append a row to change_log whenever a match is inserted or
+    meaningfully updated. Each consumer keeps its own offset: begin() fixes the
+    window of changes (offset, latest], the stage processes the matches changed
+    in that window and commit() moves the offset to the end of the window.
+
+    A consumer without an offset has never run against the change log, so it
+    must do one full scan (is_bootstrap) before switching to deltas. So must a
+    consumer whose offset is behind changes already pruned: offsets not moved
+    for CHANGE_LOG_RETENTION_DAYS do not hold pruning back.
+    """
+
+    def __init__(self, db, consumer: str):
+        self.db = db
+        self.consumer = consumer
+        self.start = None
+        self.end = None
+        self.expired = False  # offset behind pruned changes, they are lost
+
+    @property
+    def is_bootstrap(self) -> bool:
+        return self.start is None
+
+    def _offset(self, consumer: str):
+        offset = self.db.execute_query(
+            f"SELECT last_change_id FROM {CHANGE_LOG_OFFSETS_TABLE} WHERE consumer = ?",
+            (consumer,),
+        )
+        return offset[0][0] if offset else None
+
+    def begin(self):
+        """Fix the window of changes to consume in this run"""
+        self.start = self._offset(self.consumer)
+        pruned = self._offset(CHANGE_LOG_PRUNED) or 0
+        # an empty log has consumed everything up to the pruned changes
+        self.end = self.db.execute_query(
+            f"SELECT COALESCE(MAX(change_id), ?) FROM {CHANGE_LOG_TABLE}", (pruned,)
+        )[0][0]
+        self.expired = self.start is not None and self.start < pruned
+        if self.expired:
+            logger.info(
+                f"{self.consumer} offset {self.start} is behind pruned change {pruned}"
+            )
+            self.start = None
+        if self.is_bootstrap:
+            logger.info(f"No change log offset for {self.consumer}, full scan")
+        else:
+            logger.info(
+                f"{self.consumer} consuming changes {self.start + 1}..{self.end}"
+            )
+        return self
+
+    def keys_subquery(self, tables: list[str]):
+        """SQL selecting the distinct (season_link, home, away) changed in the window,
+        and its params"""
+        placeholders = ", ".join(["?"] * len(tables))
+        query = f"""
+            SELECT DISTINCT season_link, home, away FROM {CHANGE_LOG_TABLE}
+            WHERE table_name IN ({placeholders}) AND change_id > ? AND change_id <= ?
+        """
+        return query, (*tables, self.start or 0, self.end)
+
+    def changed_keys(self, tables: list[str]) -> set:
+        """Set of (season_link, home, away) changed in the window"""
+        query, params = self.keys_subquery(tables)
+        return {tuple(row) for row in self.db.execute_query(query, params)}
+
+    def first_change(self, keys: set):
+        """First change_id of the window for any of keys, None if none of them
+        changed in the window"""
+        rows = self.db.execute_query(
+            f"""
+            SELECT change_id, season_link, home, away FROM {CHANGE_LOG_TABLE}
+            WHERE change_id > ? AND change_id <= ?
+            ORDER BY change_id
+            """,
+            (self.start or 0, self.end),
+        )
+        for change_id, *key in rows:
+            if tuple(key) in keys:
+                return change_id
+        return None
+
+    def commit(self, failed_keys: set = None):
+        """Mark the changes in the window as consumed.
+
+        With failed_keys, the (season_link, home, away) the stage could not
+        process, the offset stops before the first of their changes so they
+        are consumed again in the next run.
+        """
+        end = self.end
+        first_failed = self.first_change(failed_keys) if failed_keys else None
+        if first_failed is not None:
+            end = first_failed - 1
+            logger.warning(
+                f"{self.consumer} failed on {len(failed_keys)} matches, offset kept at change {end}"
+            )
+        self.db.execute_query(
+            f"""
+            INSERT INTO {CHANGE_LOG_OFFSETS_TABLE} (consumer, last_change_id)
+            VALUES (?, ?)
+            ON CONFLICT(consumer) DO UPDATE SET
+                last_change_id = excluded.last_change_id,
+                last_updated = CURRENT_TIMESTAMP
+            """,
+            (self.consumer, end),
+        )
+        self.prune()
+
+    def prune(self):
+        """Delete changes every consumer has already consumed.
+
+        A stage can have several offsets, e.g. preprocessor:<feature version>:
+        the slowest one moved within CHANGE_LOG_RETENTION_DAYS counts, or the
+        latest one if none was.
+        """
+        rows = self.db.execute_query(
+            f"""
+            SELECT consumer, last_change_id, last_updated >= datetime('now', ?)
+            FROM {CHANGE_LOG_OFFSETS_TABLE}
+            """,
+            (f"-{CHANGE_LOG_RETENTION_DAYS} days",),
+        )
+        recent, latest = {}, {}
+        for consumer, last_change_id, is_recent in rows:
+            stage = consumer.split(":")[0]
+            latest[stage] = max(latest.get(stage, last_change_id), last_change_id)
+            if is_recent:
+                recent[stage] = min(recent.get(stage, last_change_id), last_change_id)
+        if not all(consumer in latest for consumer in CHANGE_LOG_CONSUMERS):
+            return
+        consumed = min(
+            recent.get(consumer, latest[consumer]) for consumer in CHANGE_LOG_CONSUMERS
+        )
+        self.db.execute_query(
+            f"DELETE FROM {CHANGE_LOG_TABLE} WHERE change_id <= ?", (consumed,)
+        )
+        # consumers behind it can no longer read a delta
+        self.db.execute_query(
+            f"""
+            INSERT INTO {CHANGE_LOG_OFFSETS_TABLE} (consumer, last_change_id)
+            VALUES (?, ?)
+            ON CONFLICT(consumer) DO UPDATE SET
+                last_change_id = MAX(last_change_id, excluded.last_change_id),
+                last_updated = CURRENT_TIMESTAMP
+            """,
+            (CHANGE_LOG_PRUNED, consumed),
+        )
@@ -2,18 +2,28 @@ import pandas as pd
 import datetime
 import sqlite3
 import json
+import os
+import re
 from contextlib import contextmanager
 import time
 
 import pandas as pd
 from src.config import (
+    ARCHIVE_PATH,
+    CHANGE_LOG_TABLE_QUERY,
     DATABASE_PATH,
     DATABASE_CONFIG,
     PREDICT_METADATA_TABLE,
     PREDICT_METADATA_TABLE_QUERY,
+    RAW_BLOB_DICTIONARIES_TABLE,
+    RAW_BLOB_DICTIONARY_SAMPLES,
+    RAW_BLOBS_TABLE,
+    RAW_BLOBS_TABLE_QUERY,
     RAW_TABLE,
     TRANSFORMED_TABLE,
     RAW_TABLE_QUERY,
+    SEASON_ARCHIVES_TABLE,
+    SEASON_ARCHIVES_TABLE_QUERY,
     TRANSFOMED_TABLE_QUERY,
     DATABASE_LOGGER_PATH,
 )
@@ -22,16 +32,36 @@ from src.logger import get_logger
 logger = get_logger("Database", DATABASE_LOGGER_PATH)
 
 
+# Tables whose finished seasons are moved to the archive databases
+PARTITIONED_TABLES = [
+    RAW_TABLE,
+    RAW_BLOBS_TABLE,
+    RAW_BLOB_DICTIONARIES_TABLE,
+    TRANSFORMED_TABLE,
+    PREDICT_METADATA_TABLE,
+]
+
+
 class DatabaseManager:
     def __init__(self):
         self.config = DATABASE_CONFIG
 
     @contextmanager
-    def get_connection(self):
+    def get_connection(self, include_archives: bool = False):
+        """Open a connection to the hot database.
+
+        With include_archives=True the read-only season archives are attached and
+        every partitioned table name resolves to the union of the hot table and
+        its archived copies, so existing queries read the full history unchanged.
+        Those connections are read-only for the partitioned tables.
+        """
         if self.config["engine"] == "sqlite":
-            conn = sqlite3.connect(self.config["sqlite_path"])
+            # uri=True lets ATTACH open archives with mode=ro
+            conn = sqlite3.connect(self.config["sqlite_path"], uri=True)
             conn.row_factory = sqlite3.Row  # Enable column access by name
             conn.execute("PRAGMA journal_mode = WAL")  # Better concurrency
+            if include_archives:
+                self._attach_archives(conn)
         else:
             import psycopg2
 
@@ -52,6 +82,13 @@ class DatabaseManager:
             conn.execute("PRAGMA journal_mode = WAL")  # Better concurrency
             conn.close()
 
+    def initialize_raw_blobs_table(self):
+        """Create the compressed html blob and dictionary tables"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.executescript(RAW_BLOBS_TABLE_QUERY)
+            conn.commit()
+
     def initialize_raw_table(self):
         """Create raw table with all columns"""
         with self.get_connection() as conn:
@@ -85,14 +122,38 @@ class DatabaseManager:
         with self.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute(PREDICT_METADATA_TABLE_QUERY)
+            # Column added after the table was first created
+            if "model_version" not in self._table_columns(conn, PREDICT_METADATA_TABLE):
+                cursor.execute(
+                    f"ALTER TABLE {PREDICT_METADATA_TABLE} ADD COLUMN model_version TEXT"
+                )
+            conn.commit()
+
+    def initialize_season_archives_table(self):
+        """Create the table mapping archived seasons to their archive files"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(SEASON_ARCHIVES_TABLE_QUERY)
+            conn.commit()
+
+    def initialize_change_log_table(self):
+        """Create the change log, the consumer offsets and the change triggers"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.executescript(CHANGE_LOG_TABLE_QUERY)
             conn.commit()
 
     def initialize_db(self):
         """initialize_db creates the necessary tables and indexes for the database."""
         self.create_database()
+        self.initialize_raw_blobs_table()
         self.initialize_raw_table()
+        self.migrate_raw_blobs()
         self.initialize_transformed_table()
         self.initialize_predict_metadata_table()
+        self.initialize_season_archives_table()
+        # Last: rebuilding a table (e.g. migrate_raw_blobs) drops its triggers
+        self.initialize_change_log_table()
 
     def _delete_tables(self, table_names: list[str]):
         """Delete listed tables. BE CAREFULLY!"""
@@ -105,8 +166,10 @@ class DatabaseManager:
     def _delete_all_data(self, table_name):
         self.execute_query(f"DELETE FROM {table_name}")
 
-    def execute_query(self, query: str, params: tuple = None) -> list[sqlite3.Row]:
-        with self.get_connection() as conn:
+    def execute_query(
+        self, query: str, params: tuple = None, include_archives: bool = False
+    ) -> list[sqlite3.Row]:
+        with self.get_connection(include_archives) as conn:
             cursor = conn.cursor()
             if params:
                 cursor.execute(query, params)
@@ -120,59 +183,166 @@ class DatabaseManager:
     def change_primary_key(self):
         """Change primary key of RAW_TABLE from (date, home, away) to (season_link, home, away)"""
         with self.get_connection() as conn:
-            cursor = conn.cursor()
-
-            # Step 1: Create a temporary table with the new schema
-            temp_table = f"{RAW_TABLE}_temp"
-            cursor.execute(
+            # One explicit transaction: executescript would commit half way
+            conn.isolation_level = None
+            conn.execute("BEGIN")
+
+            # Step 1: Rename the old table so RAW_TABLE_QUERY builds the new
+            # schema in place. Index names are global, so they are recreated
+            # once the old table is dropped
+            old_table = f"{RAW_TABLE}_old"
+            conn.execute(f"ALTER TABLE {RAW_TABLE} RENAME TO {old_table}")
+            self._execute_statements(conn, RAW_TABLE_QUERY)
+
+            # Step 2: Copy data from old table to new table, html stays in its blobs
+            conn.execute(
                 f"""
-                CREATE TABLE IF NOT EXISTS {temp_table} (
-                    -- Match data
-                    season_link TEXT NOT NULL,
-                    report_link TEXT UNIQUE,
-                    date TEXT NOT NULL,
-                    home TEXT NOT NULL,
-                    score TEXT,
-                    away TEXT NOT NULL,
-                    attendance TEXT,
-                    team_stats TEXT,
-                    extra_stats TEXT,
-                    
-                    -- Metadata
-                    date_added TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-
-                    PRIMARY KEY (season_link, home, away)
-                )
+                INSERT OR IGNORE INTO {RAW_TABLE}
+                (season_link, report_link, date, home, score, away, attendance, team_stats_id, extra_stats_id, date_added, last_updated)
+                SELECT season_link, report_link, date, home, score, away, attendance, team_stats_id, extra_stats_id, date_added, last_updated
+                FROM {old_table} WHERE season_link != ''
             """
             )
 
-            # Step 2: Copy data from old table to new table
-            cursor.execute(
-                f"""
-                INSERT OR IGNORE INTO {temp_table} 
-                (season_link, report_link, date, home, score, away, attendance, team_stats, extra_stats, date_added, last_updated)
-                SELECT season_link, report_link, date, home, score, away, attendance, team_stats, extra_stats, date_added, last_updated
-                FROM {RAW_TABLE} WHERE season_link != ''
-            """
-            )
+            # Step 3: Drop the old table, with its indexes and change log triggers
+            conn.execute(f"DROP TABLE {old_table}")
 
-            # Step 3: Drop the old table
-            cursor.execute(f"DROP TABLE {RAW_TABLE}")
+            # Step 4: Recreate indexes
+            self._execute_statements(conn, RAW_TABLE_QUERY)
 
-            # Step 4: Rename the temporary table to the original name
-            cursor.execute(f"ALTER TABLE {temp_table} RENAME TO {RAW_TABLE}")
+            conn.execute("COMMIT")
 
-            # Step 5: Recreate indexes
-            cursor.execute(
-                f"CREATE INDEX IF NOT EXISTS idx_report_link ON {RAW_TABLE}(report_link)"
-            )
-            cursor.execute(
-                f"CREATE INDEX IF NOT EXISTS idx_match_composite ON {RAW_TABLE}(season_link, home, away)"
-            )
+        # Step 5: Recreate the change log triggers
+        self.initialize_change_log_table()
+        logger.info("Successfully changed primary key to (season_link, home, away)")
 
-            conn.commit()
-            logger.info("Successfully changed primary key to (season_link, home, away)")
+    def storage_report(self) -> dict:
+        """Return the database file size and the bytes used by each table (with its indexes)"""
+        report = {"database_bytes": 0, "tables": {}}
+        with self.get_connection() as conn:
+            page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+            page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+            report["database_bytes"] = page_size * page_count
+            try:
+                rows = conn.execute(
+                    """
+                    SELECT COALESCE(m.tbl_name, s.name) AS table_name, SUM(s.pgsize)
+                    FROM dbstat s LEFT JOIN sqlite_master m ON m.name = s.name
+                    GROUP BY table_name
+                    """
+                ).fetchall()
+                report["tables"] = {row[0]: row[1] for row in rows}
+            except sqlite3.OperationalError:
+                logger.debug("dbstat is not available, reporting file size only")
+        return report
+
+    @staticmethod
+    def _execute_statements(conn, script: str):
+        """Run a multi-statement script inside the current transaction"""
+        for statement in script.split(";"):
+            if statement.strip():
+                conn.execute(statement)
+
+    def _raw_table_columns(self) -> list[str]:
+        return [
+            row["name"] for row in self.execute_query(f"PRAGMA table_info({RAW_TABLE})")
+        ]
+
+    def migrate_raw_blobs(self) -> dict:
+        """Move inline team_stats/extra_stats html out of RAW_TABLE into compressed blobs.
+
+        Trains a shared zstd dictionary from the existing pages, stores every page
+        in RAW_BLOBS_TABLE, rebuilds RAW_TABLE with blob id references and vacuums
+        the database. Returns a size report from before and after the migration.
+        """
+        from src.data.blobs import BlobStore
+
+        if "team_stats" not in self._raw_table_columns():
+            logger.debug(f"{RAW_TABLE} html is already stored as blobs")
+            return {}
+
+        self.initialize_raw_blobs_table()
+        before = self.storage_report()
+        blobs = BlobStore(self)
+        legacy_table = f"{RAW_TABLE}_legacy"
+        html_bytes = 0
+        migrated = 0
+
+        with self.get_connection() as conn:
+            # One explicit transaction: executescript would commit half way
+            conn.isolation_level = None
+            conn.execute("BEGIN")
+            samples = conn.execute(
+                f"""
+                SELECT team_stats, extra_stats FROM {RAW_TABLE}
+                WHERE team_stats IS NOT NULL AND extra_stats IS NOT NULL
+                ORDER BY RANDOM() LIMIT ?
+                """,
+                (RAW_BLOB_DICTIONARY_SAMPLES // 2,),
+            ).fetchall()
+            blobs.train_dictionary([html for row in samples for html in row], conn=conn)
+
+            # Rename first so RAW_TABLE_QUERY builds the new schema in place.
+            # Index names are global: they still belong to the legacy table, so
+            # they are recreated after it is dropped.
+            conn.execute(f"ALTER TABLE {RAW_TABLE} RENAME TO {legacy_table}")
+            self._execute_statements(conn, RAW_TABLE_QUERY)
+
+            legacy_rows = conn.execute(
+                f"""
+                SELECT season_link, report_link, date, home, score, away, attendance,
+                       team_stats, extra_stats, date_added, last_updated
+                FROM {legacy_table}
+                """
+            )
+            for row in legacy_rows.fetchall():
+                html_bytes += sum(
+                    len(html.encode("utf-8"))
+                    for html in (row["team_stats"], row["extra_stats"])
+                    if html
+                )
+                conn.execute(
+                    f"""
+                    INSERT INTO {RAW_TABLE}
+                    (season_link, report_link, date, home, score, away, attendance,
+                     team_stats_id, extra_stats_id, date_added, last_updated)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (
+                        row["season_link"],
+                        row["report_link"],
+                        row["date"],
+                        row["home"],
+                        row["score"],
+                        row["away"],
+                        row["attendance"],
+                        blobs.put(row["team_stats"], conn=conn),
+                        blobs.put(row["extra_stats"], conn=conn),
+                        row["date_added"],
+                        row["last_updated"],
+                    ),
+                )
+                migrated += 1
+
+            conn.execute(f"DROP TABLE {legacy_table}")
+            self._execute_statements(conn, RAW_TABLE_QUERY)
+            conn.execute("COMMIT")
+            conn.execute("VACUUM")
+
+        after = self.storage_report()
+        report = {
+            "migrated_rows": migrated,
+            "html_bytes": html_bytes,
+            "before": before,
+            "after": after,
+        }
+        logger.info(
+            f"Migrated {migrated} rows of {RAW_TABLE} html to {RAW_BLOBS_TABLE}. "
+            f"Database: {before['database_bytes']:,} -> {after['database_bytes']:,} bytes. "
+            f"{RAW_TABLE}: {before['tables'].get(RAW_TABLE, 0):,} -> {after['tables'].get(RAW_TABLE, 0):,} bytes. "
+            f"Html: {html_bytes:,} bytes stored in {after['tables'].get(RAW_BLOBS_TABLE, 0):,} bytes"
+        )
+        return report
 
     def backfill_season_links(self):
         """Backfill season_link for already transformed matches"""
@@ -193,19 +363,256 @@ class DatabaseManager:
         except Exception as e:
             logger.error(f"Error backfilling season_links: {e}")
 
-    def get_dataframe(self, query: str, params: tuple = None) -> pd.DataFrame:
+    def table_watermark(self, tables: list[str]) -> str:
+        """Latest last_updated over tables, used to tell if derived data is stale.
+
+        Archived seasons never change, so the hot tables are enough.
+        """
+        query = " UNION ALL ".join(
+            f"SELECT MAX(last_updated) AS last_updated FROM {table}" for table in tables
+        )
+        return self.execute_query(f"SELECT MAX(last_updated) FROM ({query})")[0][0]
+
+    # ------------------------------------------------------------------
+    # Season archives
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _season_label(season_link: str) -> str:
+        """Season start year of a schedule link, e.g. 2024 for .../2024-2025/schedule/..."""
+        match = re.search(r"/comps/\d+/(\d{4})", season_link)
+        return match.group(1) if match else "unknown"
+
+    @staticmethod
+    def _table_columns(conn, table: str, schema: str = "main") -> list[str]:
+        return [row[1] for row in conn.execute(f"PRAGMA {schema}.table_info({table})")]
+
+    def list_archives(self, conn=None) -> list:
+        """Archive database files, oldest season first"""
+        query = f"SELECT DISTINCT archive_file FROM {SEASON_ARCHIVES_TABLE} ORDER BY archive_file"
+        try:
+            rows = conn.execute(query).fetchall() if conn else self.execute_query(query)
+        except sqlite3.OperationalError:
+            # Database not initialized yet, so nothing is archived
+            return []
+        return [ARCHIVE_PATH / row[0] for row in rows]
+
+    def archived_season_links(self) -> set:
+        rows = self.execute_query(f"SELECT season_link FROM {SEASON_ARCHIVES_TABLE}")
+        return {row[0] for row in rows}
+
+    def _attach_archives(self, conn):
+        """Attach every archive read-only and shadow the partitioned tables with
+        TEMP views over main + archives (TEMP is searched before main)"""
+        archives = self.list_archives(conn)
+        limit = conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+        if len(archives) > limit:
+            raise RuntimeError(
+                f"{len(archives)} archives exceed SQLite's attach limit of {limit}, run compact_archives()"
+            )
+        for i, path in enumerate(archives):
+            conn.execute(f"ATTACH DATABASE ? AS archive_{i}", (f"file:{path}?mode=ro",))
+
+        for table in PARTITIONED_TABLES:
+            columns = self._table_columns(conn, table)
+            if not columns:
+                continue
+            selects = [f"SELECT {', '.join(columns)} FROM main.{table}"]
+            for i in range(len(archives)):
+                archive_columns = self._table_columns(conn, table, f"archive_{i}")
+                if not archive_columns:
+                    continue
+                # Columns added to the hot schema after archiving read as NULL
+                select_columns = [
+                    col if col in archive_columns else f"NULL AS {col}"
+                    for col in columns
+                ]
+                selects.append(
+                    f"SELECT {', '.join(select_columns)} FROM archive_{i}.{table}"
+                )
+            conn.execute(f"CREATE TEMP VIEW {table} AS {' UNION ALL '.join(selects)}")
+
+    def _copy_rows(
+        self, conn, table: str, source: str, target: str, where: str = "1", params=()
+    ):
+        """Copy rows of source.table matching where into target.table, creating it if needed"""
+        if not self._table_columns(conn, table, target):
+            conn.execute(
+                f"CREATE TABLE {target}.{table} AS SELECT * FROM {source}.{table} WHERE 0"
+            )
+        target_columns = self._table_columns(conn, table, target)
+        columns = ", ".join(
+            col
+            for col in self._table_columns(conn, table, source)
+            if col in target_columns
+        )
+        conn.execute(
+            f"INSERT INTO {target}.{table} ({columns}) SELECT {columns} FROM {source}.{table} WHERE {where}",
+            params,
+        )
+
+    def _copy_dictionaries(self, conn, source: str, target: str):
+        """Copy the blob dictionaries the target archive does not have yet"""
+        if not self._table_columns(conn, RAW_BLOB_DICTIONARIES_TABLE, source):
+            return
+        self._copy_rows(conn, RAW_BLOB_DICTIONARIES_TABLE, source, target, "0")
+        self._copy_rows(
+            conn,
+            RAW_BLOB_DICTIONARIES_TABLE,
+            source,
+            target,
+            f"dictionary_id NOT IN (SELECT dictionary_id FROM {target}.{RAW_BLOB_DICTIONARIES_TABLE})",
+        )
+
+    def finished_seasons(self) -> list[str]:
+        """Seasons that are fully scraped, transformed and preprocessed and no
+        longer scraped (not in URLS)"""
+        from src.config import URLS
+
+        rows = self.execute_query(
+            f"""
+            SELECT r.season_link
+            FROM {RAW_TABLE} r
+            LEFT JOIN {TRANSFORMED_TABLE} t ON t.report_link = r.report_link
+            GROUP BY r.season_link
+            HAVING SUM(r.score IS NULL) = 0
+               AND SUM(t.report_link IS NULL) = 0
+               AND NOT EXISTS (
+                    SELECT 1 FROM {PREDICT_METADATA_TABLE} p
+                    WHERE p.season_link = r.season_link
+                      AND (p.type = 'prediction' OR p.home_win_pred_prob IS NULL)
+               )
+            """
+        )
+        return [row[0] for row in rows if row[0] not in URLS]
+
+    def archive_season(self, season_link: str):
+        """Move every row of a finished season from the hot tables into its
+        read-only archive database"""
+        label = self._season_label(season_link)
+        existing = self.execute_query(
+            f"SELECT archive_file FROM {SEASON_ARCHIVES_TABLE} WHERE season_label = ? LIMIT 1",
+            (label,),
+        )
+        archive_file = existing[0][0] if existing else f"season_{label}.db"
+        path = ARCHIVE_PATH / archive_file
+        os.makedirs(ARCHIVE_PATH, exist_ok=True)
+        if path.exists():
+            os.chmod(path, 0o644)
+
+        with self.get_connection() as conn:
+            conn.isolation_level = None
+            conn.execute("ATTACH DATABASE ? AS archive", (str(path),))
+            conn.execute("BEGIN")
+            blob_ids = f"""
+                SELECT team_stats_id FROM main.{RAW_TABLE} WHERE season_link = ?
+                UNION SELECT extra_stats_id FROM main.{RAW_TABLE} WHERE season_link = ?
+            """
+            self._copy_rows(
+                conn,
+                RAW_BLOBS_TABLE,
+                "main",
+                "archive",
+                f"blob_id IN ({blob_ids})",
+                (season_link,) * 2,
+            )
+            self._copy_dictionaries(conn, "main", "archive")
+            for table in [RAW_TABLE, TRANSFORMED_TABLE, PREDICT_METADATA_TABLE]:
+                self._copy_rows(
+                    conn, table, "main", "archive", "season_link = ?", (season_link,)
+                )
+
+            conn.execute(
+                f"DELETE FROM main.{RAW_BLOBS_TABLE} WHERE blob_id IN ({blob_ids})",
+                (season_link,) * 2,
+            )
+            for table in [RAW_TABLE, TRANSFORMED_TABLE, PREDICT_METADATA_TABLE]:
+                conn.execute(
+                    f"DELETE FROM main.{table} WHERE season_link = ?", (season_link,)
+                )
+            conn.execute(
+                f"INSERT OR REPLACE INTO {SEASON_ARCHIVES_TABLE} (season_link, season_label, archive_file) VALUES (?, ?, ?)",
+                (season_link, label, archive_file),
+            )
+            conn.execute("COMMIT")
+            conn.execute("DETACH DATABASE archive")
+
+        os.chmod(path, 0o444)
+        logger.info(f"Archived season {season_link} to {path}")
+
+    def compact_archives(self, max_archives: int = None):
+        """Merge the oldest archive files until they fit SQLite's attach limit"""
+        with self.get_connection() as conn:
+            max_archives = max_archives or conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+        archives = self.list_archives()
+        while len(archives) > max_archives:
+            target, source = archives[0], archives[1]
+            os.chmod(target, 0o644)
+            with self.get_connection() as conn:
+                conn.isolation_level = None
+                conn.execute("ATTACH DATABASE ? AS archive", (str(target),))
+                conn.execute("ATTACH DATABASE ? AS source", (f"file:{source}?mode=ro",))
+                conn.execute("BEGIN")
+                for table in [
+                    RAW_BLOBS_TABLE,
+                    RAW_TABLE,
+                    TRANSFORMED_TABLE,
+                    PREDICT_METADATA_TABLE,
+                ]:
+                    if self._table_columns(conn, table, "source"):
+                        self._copy_rows(conn, table, "source", "archive")
+                self._copy_dictionaries(conn, "source", "archive")
+                conn.execute(
+                    f"UPDATE {SEASON_ARCHIVES_TABLE} SET archive_file = ? WHERE archive_file = ?",
+                    (target.name, source.name),
+                )
+                conn.execute("COMMIT")
+            os.chmod(target, 0o444)
+            os.chmod(source, 0o644)
+            source.unlink()
+            logger.info(f"Compacted archive {source.name} into {target.name}")
+            archives = self.list_archives()
+
+    def archive_finished_seasons(self):
+        """Archive every finished season so incremental runs only touch the hot database"""
+        try:
+            seasons = self.finished_seasons()
+            for season_link in seasons:
+                self.archive_season(season_link)
+            self.compact_archives()
+            logger.info(f"Archived {len(seasons)} finished seasons")
+        except Exception as e:
+            logger.error(f"Error archiving finished seasons: {e}")
+
+    def analytics_engine(self):
+        """DuckDB engine for the dashboard aggregates, or None if duckdb is not
+        available (callers fall back to pandas)"""
+        try:
+            from src.data.analytics import AnalyticsEngine, duckdb
+
+            if duckdb is None:
+                return None
+            return AnalyticsEngine(self)
+        except Exception as e:
+            logger.warning(f"DuckDB analytics unavailable, falling back to pandas: {e}")
+            return None
+
+    def get_dataframe(
+        self, query: str, params: tuple = None, include_archives: bool = False
+    ) -> pd.DataFrame:
         """
         Execute a SQL query and return the results as a pandas DataFrame.
 
         Args:
             query (str): SQL query to execute
             params (tuple, optional): Parameters for parameterized query
+            include_archives (bool, optional): Read the union of the hot tables
+                and the archived seasons
 
         Returns:
             pd.DataFrame: Query results as a DataFrame
         """
         try:
-            with self.get_connection() as conn:
+            with self.get_connection(include_archives) as conn:
                 df = pd.read_sql_query(query, conn, params=params)
                 logger.debug(f"Successfully fetched DataFrame with shape: {df.shape}")
                 return df
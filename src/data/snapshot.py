@@ -0,0 +1,149 @@
+import json
+import os
+import shutil
+from datetime import datetime, timezone
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from src.config import (
+    DATABASE_LOGGER_PATH,
+    PREDICT_METADATA_TABLE,
+    SNAPSHOT_PATH,
+    TRANSFORMED_TABLE,
+)
+from src.data.database import DatabaseManager
+from src.logger import get_logger
+
+logger = get_logger("Database", DATABASE_LOGGER_PATH)
+
+SNAPSHOT_TABLES = [TRANSFORMED_TABLE, PREDICT_METADATA_TABLE]
+PARTITION_COLUMNS = ["league", "season"]
+
+
+class SnapshotManager:
+    """Parquet snapshots of the transformed and prediction tables.
+
+    Each export is written to its own directory, partitioned by league/season
+    (hive layout), with a manifest.json. The CURRENT file points to the latest
+    complete export and is swapped atomically, so readers never see a partial
+    snapshot.
+    """
+
+    def __init__(self, path=SNAPSHOT_PATH):
+        self.path = path
+        self.db = DatabaseManager()
+
+    @staticmethod
+    def _partition_columns(df: pd.DataFrame) -> pd.DataFrame:
+        df["league"] = (
+            df["season_link"].str.extract(r"(\w+-\w+)(?=-Scores)")[0].fillna("unknown")
+        )
+        df["season"] = df["season_link"].map(DatabaseManager._season_label)
+        return df
+
+    def export(self, keep: int = 2) -> dict:
+        """Export SNAPSHOT_TABLES to a new snapshot and make it current"""
+        now = datetime.now(timezone.utc)
+        exported_at = now.strftime("%Y-%m-%d %H:%M:%S")
+        name = f"snapshot-{now.strftime('%Y%m%dT%H%M%S%f')}"
+        staging = self.path / f".{name}.tmp"
+        shutil.rmtree(staging, ignore_errors=True)
+        staging.mkdir(parents=True)
+
+        manifest = {"name": name, "exported_at": exported_at, "tables": {}}
+        for table in SNAPSHOT_TABLES:
+            df = self.db.get_dataframe(f"SELECT * FROM {table}", include_archives=True)
+            if df.empty:
+                continue
+            df = self._partition_columns(df)
+            ds.write_dataset(
+                pa.Table.from_pandas(df, preserve_index=False),
+                staging / table,
+                format="parquet",
+                partitioning=PARTITION_COLUMNS,
+                partitioning_flavor="hive",
+            )
+            manifest["tables"][table] = {
+                "rows": len(df),
+                "columns": [c for c in df.columns if c not in PARTITION_COLUMNS],
+                "partitions": int(df.groupby(PARTITION_COLUMNS).ngroups),
+            }
+        with open(staging / "manifest.json", "w") as f:
+            json.dump(manifest, f, indent=2)
+
+        # Publish: rename the finished directory, then swap the pointer
+        os.replace(staging, self.path / name)
+        pointer = self.path / "CURRENT.tmp"
+        pointer.write_text(name)
+        os.replace(pointer, self.path / "CURRENT")
+        self._remove_old_snapshots(keep)
+
+        logger.info(
+            f"Snapshot {name} exported: "
+            + ", ".join(f"{t} {m['rows']} rows" for t, m in manifest["tables"].items())
+        )
+        return manifest
+
+    def _remove_old_snapshots(self, keep: int):
+        snapshots = sorted(self.path.glob("snapshot-*"))
+        for old in snapshots[:-keep]:
+            shutil.rmtree(old, ignore_errors=True)
+
+    def manifest(self):
+        """Manifest of the current snapshot, or None if there is none"""
+        pointer = self.path / "CURRENT"
+        if not pointer.exists():
+            return None
+        with open(self.path / pointer.read_text().strip() / "manifest.json") as f:
+            return json.load(f)
+
+    def is_fresh(self, watermark: str = None) -> bool:
+        """True if the current snapshot was exported after watermark (a
+        last_updated timestamp), i.e. it contains every change up to it"""
+        manifest = self.manifest()
+        if manifest is None:
+            return False
+        return watermark is None or watermark < manifest["exported_at"]
+
+    def read_table(
+        self,
+        table: str,
+        columns: list[str] = None,
+        filters: list = None,
+        min_watermark: str = None,
+    ):
+        """Read a table from the current snapshot through Arrow.
+
+        Args:
+            table (str): Snapshot table name
+            columns (list[str], optional): Columns to load
+            filters (list, optional): pyarrow filters, e.g. [("type", "=", "training")]
+            min_watermark (str, optional): Only use the snapshot if it is fresher
+                than this last_updated timestamp
+
+        Returns:
+            pd.DataFrame or None if there is no fresh snapshot of the table
+        """
+        try:
+            if not self.is_fresh(min_watermark):
+                return None
+            manifest = self.manifest()
+            if table not in manifest["tables"]:
+                return None
+            arrow_table = pq.read_table(
+                self.path / manifest["name"] / table,
+                columns=columns or manifest["tables"][table]["columns"],
+                filters=filters,
+                partitioning="hive",
+            )
+            return arrow_table.to_pandas()
+        except Exception as e:
+            logger.error(f"Error reading {table} snapshot: {e}")
+            return None
+
+
+if __name__ == "__main__":
+    SnapshotManager().export()
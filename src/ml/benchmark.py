@@ -0,0 +1,500 @@
+import multiprocessing
+import shutil
+import tempfile
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+
+from src.config import ML_LOGGER_PATH, MODEL_ARTIFACTS_PATH, TRANSFORMED_COLUMNS
+from src.logger import get_logger
+from src.ml.preprocess import Preprocessor
+from src.ml.runtime import configure_performance_threads
+from src.ml.tensor_store import (
+    TensorStore,
+    load_legacy_tensors,
+    read_legacy_tensors,
+    window_dataset,
+)
+from src.ml.train import compiled_model
+from src.ml.windows import TeamHistoryIndex, oriented_values
+
+logger = get_logger(
+    "MLBenchmark",
+    ML_LOGGER_PATH,
+)
+
+BENCHMARK_PATH = MODEL_ARTIFACTS_PATH / "benchmarks"
+BENCHMARK_SIZES = [1_000, 5_000, 10_000, 50_000]
+TENSOR_STORE_BENCHMARK_SIZES = [1_000, 10_000]
+# (layout, precision, compression) of the storage formats compared
+STORAGE_FORMATS = [
+    ("dense", "float32", None),
+    ("indexed", "float32", None),
+    ("indexed", "float16", None),
+    ("indexed", "int16", None),
+    ("indexed", "int16", "zstd"),
+    ("dense", "int16", "zstd"),
+]
+
+
+def synthetic_matches(
+    n_matches: int, n_teams: int = 20, missing_rate: float = 0.01, seed: int = 0
+) -> pd.DataFrame:
+    """DataFrame shaped like Preprocessor.read_data() output: matches sorted by
+    date, a few rows with missing stats and the last round without a score"""
+    rng = np.random.default_rng(seed)
+    teams = [f"Team {i}" for i in range(n_teams)]
+    matches_per_day = n_teams // 2
+
+    rows = []
+    for i in range(n_matches):
+        home, away = rng.choice(teams, size=2, replace=False)
+        date = pd.Timestamp("2000-01-01") + pd.Timedelta(days=i // matches_per_day)
+        rows.append(
+            {
+                "season_link": f"https://fbref.com/en/comps/11/{2000 + i // 380}-{2001 + i // 380}/Serie-A-Scores-and-Fixtures",
+                "date": date.strftime("%Y-%m-%d"),
+                "home": home,
+                "away": away,
+                "attendance": float(rng.integers(1_000, 80_000)),
+                "report_link": f"/en/matches/{i:08x}",
+            }
+        )
+    df = pd.DataFrame(rows)
+
+    feature_cols = [
+        col
+        for col in TRANSFORMED_COLUMNS
+        if col not in df.columns and col not in ("home", "away")
+    ]
+    features = rng.integers(0, 100, size=(n_matches, len(feature_cols))).astype(float)
+    features[rng.random(features.shape) < missing_rate / len(feature_cols)] = np.nan
+    df[feature_cols] = features
+
+    # upcoming fixtures: no stats yet
+    df.loc[df.index[-matches_per_day:], feature_cols] = np.nan
+    df["date_added"] = "2000-01-01 00:00:00"
+    df["last_updated"] = "2000-01-01 00:00:00"
+    return df
+
+
+def _scan_last_n_matches(preprocessor: Preprocessor, team_name: str, date):
+    """Original last n matches lookup: a boolean mask over the whole DataFrame"""
+    df = preprocessor.df
+    last_n_mask = (
+        (df["date"] < date)
+        & ((df["home"] == team_name) | (df["away"] == team_name))
+        & (df[preprocessor.feature_cols].notnull().all(axis=1))
+    )
+    return df[last_n_mask].tail(preprocessor.n)
+
+
+def _legacy_fill_temp_df(
+    preprocessor: Preprocessor, last_n_matches: pd.DataFrame, team_name: str
+) -> pd.DataFrame:
+    """Original orientation: iterrows and .loc writes into an object DataFrame"""
+    temp_df = pd.DataFrame(
+        columns=preprocessor.feature_cols, index=range(preprocessor.n)
+    )
+    for i, (_, item) in enumerate(last_n_matches.iterrows()):
+        if item["home"] == team_name:
+            temp_df.loc[i, preprocessor.home_cols] = item[preprocessor.home_cols].values
+            temp_df.loc[i, preprocessor.away_cols] = item[preprocessor.away_cols].values
+        elif item["away"] == team_name:
+            temp_df.loc[i, preprocessor.home_cols] = item[preprocessor.away_cols].values
+            temp_df.loc[i, preprocessor.away_cols] = item[preprocessor.home_cols].values
+    return temp_df
+
+
+def _legacy_windows(preprocessor: Preprocessor, row: pd.Series, team: str):
+    """Window of team before row, built like the original per-match scan"""
+    last_n = _scan_last_n_matches(preprocessor, team, row["date"])
+    if last_n.shape[0] != preprocessor.n:
+        return None
+    temp_df = _legacy_fill_temp_df(preprocessor, last_n, team)
+    if temp_df.isnull().values.any():
+        return None
+    window = tf.convert_to_tensor(temp_df.values, dtype=tf.float32).numpy()
+
+    # the permutation based orientation must give the same bytes
+    oriented = oriented_values(
+        last_n[preprocessor.feature_cols].to_numpy(dtype=np.float64),
+        preprocessor.permutations,
+        preprocessor.neutral,
+    )
+    sides = (last_n["away"].to_numpy() == team).astype(np.intp)
+    if oriented[sides, np.arange(len(last_n))].tobytes() != window.tobytes():
+        logger.error(f"oriented_values differs from the original for {team}")
+    return window
+
+
+def benchmark_window_builder(
+    sizes: list[int] = BENCHMARK_SIZES, n: int = 10, reference_sample: int = 200
+) -> pd.DataFrame:
+    """Time TeamHistoryIndex against the original per-match DataFrame scan.
+
+    The per-match scan is quadratic, so it is only run on reference_sample
+    random matches per size and its full run time is extrapolated. Those
+    matches are also used to check the windows are bit-identical.
+    """
+    results = []
+    for size in sizes:
+        df = synthetic_matches(size)
+        preprocessor = Preprocessor(n=n)
+        preprocessor.df = df
+        preprocessor._get_feature_cols()
+
+        start = time.perf_counter()
+        index = TeamHistoryIndex.from_dataframe(
+            df,
+            preprocessor.feature_cols,
+            preprocessor.home_cols,
+            preprocessor.away_cols,
+        )
+        home_windows, away_windows, available = index.match_windows(
+            df["home"], df["away"], df["date"], n
+        )
+        index_seconds = time.perf_counter() - start
+
+        sample = np.random.default_rng(size).choice(
+            size, size=min(reference_sample, size), replace=False
+        )
+        identical = True
+        start = time.perf_counter()
+        for position in sample:
+            row = df.iloc[position]
+            legacy_home = _legacy_windows(preprocessor, row, row["home"])
+            legacy_away = _legacy_windows(preprocessor, row, row["away"])
+            legacy_available = legacy_home is not None and legacy_away is not None
+            index_available = (
+                available[position]
+                and not np.isnan(home_windows[position]).any()
+                and not np.isnan(away_windows[position]).any()
+            )
+            if legacy_available != index_available:
+                identical = False
+            elif legacy_available:
+                identical &= (
+                    legacy_home.tobytes() == home_windows[position].tobytes()
+                    and legacy_away.tobytes() == away_windows[position].tobytes()
+                )
+        legacy_seconds = (time.perf_counter() - start) / len(sample) * size
+
+        results.append(
+            {
+                "matches": size,
+                "windows": int(available.sum()),
+                "index_seconds": index_seconds,
+                "legacy_seconds_estimated": legacy_seconds,
+                "speedup": legacy_seconds / index_seconds,
+                "identical": identical,
+            }
+        )
+        logger.info(
+            f"{size} matches: index {index_seconds:.3f}s, per-match scan ~{legacy_seconds:.1f}s, identical: {identical}"
+        )
+    return pd.DataFrame(results)
+
+
+def _directory_size(path: Path) -> tuple[int, int]:
+    """(files, bytes) under path"""
+    files = [p for p in path.rglob("*") if p.is_file()]
+    return len(files), sum(p.stat().st_size for p in files)
+
+
+def _write_legacy_tensors(path: Path, match_uuid: str, home, away, target):
+    """Original layout: three serialized tensors in a directory per match"""
+    match_path = path / match_uuid
+    match_path.mkdir(parents=True, exist_ok=True)
+    tf.io.write_file(
+        str(match_path / "home_tensor.ten"), tf.io.serialize_tensor(home[None])
+    )
+    tf.io.write_file(
+        str(match_path / "away_tensor.ten"), tf.io.serialize_tensor(away[None])
+    )
+    tf.io.write_file(
+        str(match_path / "target_tensor.ten"),
+        tf.io.serialize_tensor(tf.constant([target], dtype=tf.int32)),
+    )
+
+
+def _synthetic_windows(size: int, n: int):
+    """Home and away windows and targets of size synthetic matches, built like
+    Preprocessor does, so neighbouring windows share their match rows"""
+    df = synthetic_matches(size + n * 20)
+    # possession is a one decimal percentage
+    possession = np.random.default_rng(size).uniform(20, 80, len(df)).round(1)
+    df["home_possession"] = possession
+    df["away_possession"] = (100 - possession).round(1)
+    index = TeamHistoryIndex.from_dataframe(df)
+    home, away, available = index.match_windows(df["home"], df["away"], df["date"], n)
+    rows = np.flatnonzero(available)[:size]
+    targets = np.random.default_rng(size).integers(0, 3, size=len(rows)).tolist()
+    return home[rows], away[rows], targets
+
+
+def benchmark_tensor_store(
+    sizes: list[int] = TENSOR_STORE_BENCHMARK_SIZES, n: int = 10
+) -> pd.DataFrame:
+    """Write and read times, file count and disk size of the per-uuid tensor
+    directories against the dense and indexed TensorStore layouts, plus
+    migration time"""
+    results = []
+    for size in sizes:
+        home, away, targets = _synthetic_windows(size, n)
+        size = len(targets)
+        uuids = [str(uuid.uuid4()) for _ in range(size)]
+        root = Path(tempfile.mkdtemp())
+        try:
+            legacy_path = root / "legacy"
+            start = time.perf_counter()
+            for i, match_uuid in enumerate(uuids):
+                _write_legacy_tensors(
+                    legacy_path, match_uuid, home[i], away[i], targets[i]
+                )
+            legacy_write = time.perf_counter() - start
+            legacy_files, legacy_bytes = _directory_size(legacy_path)
+
+            start = time.perf_counter()
+            for match_uuid in uuids:
+                load_legacy_tensors(match_uuid, legacy_path)
+            legacy_read = time.perf_counter() - start
+            start = time.perf_counter()
+            read_legacy_tensors(uuids, legacy_path)
+            legacy_parallel_read = time.perf_counter() - start
+            result = {
+                "matches": size,
+                "legacy_files": legacy_files,
+                "legacy_mb": legacy_bytes / 1e6,
+                "legacy_write_seconds": legacy_write,
+                "legacy_read_seconds": legacy_read,
+                "legacy_parallel_read_seconds": legacy_parallel_read,
+            }
+
+            identical = True
+            for layout in ["dense", "indexed"]:
+                store_path = root / layout
+                start = time.perf_counter()
+                TensorStore(store_path, layout).append(uuids, home, away, targets)
+                store_write = time.perf_counter() - start
+                store_files, store_bytes = _directory_size(store_path)
+
+                start = time.perf_counter()
+                store_home, store_away, store_targets, _ = TensorStore(store_path).load(
+                    uuids
+                )
+                store_read = time.perf_counter() - start
+                identical &= (
+                    store_home.tobytes() == home.tobytes()
+                    and store_away.tobytes() == away.tobytes()
+                    and store_targets.tolist() == targets
+                )
+                result.update(
+                    {
+                        f"{layout}_files": store_files,
+                        f"{layout}_mb": store_bytes / 1e6,
+                        f"{layout}_write_seconds": store_write,
+                        f"{layout}_read_seconds": store_read,
+                    }
+                )
+
+            migrated = TensorStore(root / "migrated")
+            start = time.perf_counter()
+            migrated.migrate_legacy(legacy_path)
+            result["migration_seconds"] = time.perf_counter() - start
+            identical &= migrated.load(uuids)[0].tobytes() == home.tobytes()
+            result["identical"] = identical
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+
+        results.append(result)
+        logger.info(
+            f"{size} matches: legacy {result['legacy_mb']:.1f}MB write {legacy_write:.2f}s read {legacy_read:.2f}s, "
+            f"dense {result['dense_mb']:.1f}MB read {result['dense_read_seconds']:.3f}s, "
+            f"indexed {result['indexed_mb']:.1f}MB read {result['indexed_read_seconds']:.3f}s, "
+            f"identical: {identical}"
+        )
+    return pd.DataFrame(results)
+
+
+def benchmark_storage_formats(
+    size: int = 10_000, n: int = 10, batch_size: int = 32
+) -> pd.DataFrame:
+    """On-disk size, write time and read throughput (bulk load and shuffled
+    training batches) of every STORAGE_FORMATS, and the largest difference of
+    the float32 values read back, 0 when the format is lossless"""
+    home, away, targets = _synthetic_windows(size, n)
+    uuids = [str(uuid.uuid4()) for _ in range(len(targets))]
+    results = []
+    root = Path(tempfile.mkdtemp())
+    try:
+        for layout, precision, compression in STORAGE_FORMATS:
+            path = root / f"{layout}-{precision}-{compression}"
+            start = time.perf_counter()
+            TensorStore(path, layout, precision, compression).append(
+                uuids, home, away, targets
+            )
+            write = time.perf_counter() - start
+            files, size_bytes = _directory_size(path)
+
+            # reads follow each shard's manifest entry, not the store settings
+            store = TensorStore(path)
+            start = time.perf_counter()
+            store_home, store_away, _, _ = store.load(uuids)
+            load = time.perf_counter() - start
+
+            # the training input pipeline over the memory-mapped store
+            store = TensorStore(path)
+            batches = window_dataset(
+                *store.open_memmap(uuids)[:3], batch_size=batch_size, shuffle=True
+            )
+            start = time.perf_counter()
+            for _ in batches:
+                pass
+            iterate = time.perf_counter() - start
+
+            results.append(
+                {
+                    "format": f"{layout} {precision}"
+                    + (f" {compression}" if compression else ""),
+                    "stored_as": store.manifest()["shards"][0].get(
+                        "precision", "float32"
+                    ),
+                    "mb": size_bytes / 1e6,
+                    "write_seconds": write,
+                    "load_matches_per_second": len(uuids) / load,
+                    "batch_matches_per_second": len(uuids) / iterate,
+                    "max_abs_error": float(
+                        max(
+                            np.abs(store_home - home).max(),
+                            np.abs(store_away - away).max(),
+                        )
+                    ),
+                }
+            )
+            logger.info(
+                f"{results[-1]['format']}: {results[-1]['mb']:.2f}MB, "
+                f"load {results[-1]['load_matches_per_second']:.0f} matches/s, "
+                f"batches {results[-1]['batch_matches_per_second']:.0f} matches/s, "
+                f"max error {results[-1]['max_abs_error']}"
+            )
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    return pd.DataFrame(results)
+
+
+def _learnable_targets(home: np.ndarray, away: np.ndarray) -> np.ndarray:
+    """Outcomes a model can learn from the windows: home or away win when one
+    team's mean first feature is clearly larger, draw in between, a third of
+    the matches each"""
+    difference = home[:, :, 0].mean(axis=1) - away[:, :, 0].mean(axis=1)
+    low, high = np.quantile(difference, [1 / 3, 2 / 3])
+    return np.where(difference > high, 0, np.where(difference < low, 1, 2))
+
+
+def _benchmark_training(
+    performance: bool,
+    size: int,
+    n: int,
+    epochs: int,
+    batch_size: int,
+    target_accuracy: float,
+) -> dict:
+    """Worker: train on synthetic windows in a fresh process, thread settings
+    only apply before TensorFlow's first op"""
+    if performance:
+        configure_performance_threads()
+    home, away, _ = _synthetic_windows(size, n)
+    targets = _learnable_targets(home, away)
+    split = int(len(targets) * 0.8)
+    model = compiled_model(n, home.shape[2], 3, performance=performance)
+    epoch_ends = []
+    start = time.perf_counter()
+    model.fit(
+        window_dataset(
+            home[:split],
+            away[:split],
+            targets[:split],
+            batch_size=batch_size,
+            shuffle=True,
+        ),
+        validation_data=window_dataset(
+            home[split:], away[split:], targets[split:], batch_size=batch_size
+        ),
+        epochs=epochs,
+        callbacks=[
+            tf.keras.callbacks.LambdaCallback(
+                on_epoch_end=lambda epoch, logs: epoch_ends.append(
+                    (time.perf_counter() - start, logs["val_accuracy"])
+                )
+            )
+        ],
+        verbose=0,
+    )
+    seconds, accuracy = np.array(epoch_ends).T
+    # the first epoch also traces and, in performance mode, XLA compiles
+    steady_seconds = np.diff(seconds)
+    reached = np.flatnonzero(accuracy >= target_accuracy)
+    return {
+        "mode": "performance" if performance else "default",
+        "policy": model.dtype_policy.name,
+        "first_epoch_seconds": seconds[0],
+        "samples_per_second": split * len(steady_seconds) / steady_seconds.sum(),
+        "best_val_accuracy": accuracy.max(),
+        "seconds_to_target": seconds[reached[0]] if len(reached) else np.nan,
+    }
+
+
+def benchmark_training_performance(
+    size: int = 20_000,
+    n: int = 10,
+    epochs: int = 8,
+    batch_size: int = 256,
+    target_accuracy: float = 0.55,
+) -> pd.DataFrame:
+    """Training throughput (samples/s after the first epoch), first epoch
+    time and time to target_accuracy validation accuracy of the default
+    settings against MLTrainer's performance mode, each in its own process"""
+    results = []
+    for performance in [False, True]:
+        with ProcessPoolExecutor(
+            max_workers=1, mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            results.append(
+                executor.submit(
+                    _benchmark_training,
+                    performance,
+                    size,
+                    n,
+                    epochs,
+                    batch_size,
+                    target_accuracy,
+                ).result()
+            )
+        logger.info(
+            f"{results[-1]['mode']} ({results[-1]['policy']}): "
+            f"{results[-1]['samples_per_second']:.0f} samples/s, "
+            f"target accuracy after {results[-1]['seconds_to_target']:.1f}s"
+        )
+    return pd.DataFrame(results)
+
+
+if __name__ == "__main__":
+    BENCHMARK_PATH.mkdir(parents=True, exist_ok=True)
+    results = benchmark_window_builder()
+    results.to_csv(BENCHMARK_PATH / "window_builder.csv", index=False)
+    print(results.to_string(index=False))
+    results = benchmark_tensor_store()
+    results.to_csv(BENCHMARK_PATH / "tensor_store.csv", index=False)
+    print(results.to_string(index=False))
+    results = benchmark_storage_formats()
+    results.to_csv(BENCHMARK_PATH / "storage_formats.csv", index=False)
+    print(results.to_string(index=False))
+    results = benchmark_training_performance()
+    results.to_csv(BENCHMARK_PATH / "training_performance.csv", index=False)
+    print(results.to_string(index=False))
@@ -0,0 +1,252 @@
+import hashlib
+import json
+import os
+import shutil
+from datetime import datetime, timezone
+
+import numpy as np
+
+from src.config import (
+    CHANGE_LOG_OFFSETS_TABLE,
+    DEFAULT_WINDOW_SIZE,
+    FEATURE_CACHE_BUDGET_BYTES,
+    FEATURE_CACHE_PATH,
+    ML_LOGGER_PATH,
+    NORMALIZATION_METHOD,
+    TENSOR_STORE_PATH,
+    TRANSFORMED_COLUMNS,
+)
+from src.data.database import DatabaseManager
+from src.logger import get_logger
+from src.ml.tensor_store import TensorStore
+from src.ml.windows import feature_columns, orientation_permutations
+
+logger = get_logger("MLFeatureCache", ML_LOGGER_PATH)
+
+
+def feature_fingerprint(
+    n: int, features: list[str] = None, standardize: bool = False
+) -> str:
+    """Fingerprint of the windows built with window size n from the selected
+    feature columns (every feature column if None): the columns, their order,
+    how they are oriented for the away team and whether they are standardized"""
+    feature_cols, home_cols, away_cols = feature_columns(TRANSFORMED_COLUMNS, features)
+    permutations, neutral = orientation_permutations(feature_cols, home_cols, away_cols)
+    fields = {
+        "n": n,
+        "feature_cols": feature_cols,
+        "permutations": permutations.tolist(),
+        "neutral": neutral.tolist(),
+    }
+    if standardize:
+        fields["standardize"] = True
+    payload = json.dumps(fields)
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+def normalization_stats(rows: np.ndarray, method: str = NORMALIZATION_METHOD) -> dict:
+    """Per feature center and scale of (rows, features) oriented match rows.
+
+    Rows with a missing feature are ignored, like in windows. Constant and
+    neutral (always NaN) features get center 0 and scale 1.
+    """
+    rows = np.where(np.isnan(rows).all(axis=0), 0, rows)
+    rows = rows[~np.isnan(rows).any(axis=1)].astype(np.float64)
+    if method == "standard":
+        center, scale = rows.mean(axis=0), rows.std(axis=0)
+    elif method == "robust":
+        center = np.median(rows, axis=0)
+        q25, q75 = np.percentile(rows, [25, 75], axis=0)
+        scale = q75 - q25
+    else:
+        raise ValueError(f"Unknown normalization method {method}")
+    scale = np.where(scale > 0, scale, 1.0)
+    return {
+        "method": method,
+        "rows": len(rows),
+        "center": center.tolist(),
+        "scale": scale.tolist(),
+    }
+
+
+def standardize_windows(windows: np.ndarray, stats: dict) -> np.ndarray:
+    """(windows - center) / scale in float32"""
+    center = np.asarray(stats["center"], dtype=np.float32)
+    scale = np.asarray(stats["scale"], dtype=np.float32)
+    return ((windows - center) / scale).astype(np.float32)
+
+
+class FeatureCache:
+    """Versions of the processed tensors, one TensorStore per feature
+    fingerprint in FEATURE_CACHE_PATH/<fingerprint>.
+
+    Window sizes and feature sets coexist, so switching between them only
+    opens another store. Each version keeps its own change log offset and is
+    brought up to date incrementally by the Preprocessor; version.json records
+    its parameters, the last change it includes (its data version) and when it
+    was last used and normalization.json its per feature statistics, which
+    standardized versions apply to their tensors. Least recently used versions
+    are evicted once the cache exceeds its disk budget.
+    """
+
+    def __init__(
+        self, path=FEATURE_CACHE_PATH, budget_bytes: int = FEATURE_CACHE_BUDGET_BYTES
+    ):
+        self.path = path
+        self.budget_bytes = budget_bytes
+        self.db = DatabaseManager()
+
+    @staticmethod
+    def consumer(fingerprint: str) -> str:
+        """Change log consumer of a version. The default version keeps the
+        original preprocessor offset"""
+        if fingerprint == feature_fingerprint(DEFAULT_WINDOW_SIZE):
+            return "preprocessor"
+        return f"preprocessor:{fingerprint}"
+
+    def store(
+        self,
+        n: int = DEFAULT_WINDOW_SIZE,
+        features: list[str] = None,
+        standardize: bool = False,
+    ):
+        """TensorStore of the version built with window size n and the selected
+        feature columns, empty if it was never built"""
+        fingerprint = feature_fingerprint(n, features, standardize)
+        version_path = self.path / fingerprint
+        if (
+            not version_path.exists()
+            and fingerprint == feature_fingerprint(DEFAULT_WINDOW_SIZE)
+            and (TENSOR_STORE_PATH / "MANIFEST.json").exists()
+        ):
+            logger.warning(
+                f"{TENSOR_STORE_PATH} predates feature versions, run `python -m src.ml.tensor_store` to adopt it"
+            )
+        return TensorStore(version_path)
+
+    def adopt_store(self, path=TENSOR_STORE_PATH):
+        """Move a store written before versioning, always built with the
+        defaults, into the default version. A migration step: no process may
+        have the store open.
+
+        Returns:
+            str: fingerprint of the version it became, None if there was none
+        """
+        fingerprint = feature_fingerprint(DEFAULT_WINDOW_SIZE)
+        version_path = self.path / fingerprint
+        if version_path.exists() or not (path / "MANIFEST.json").exists():
+            return None
+        self.path.mkdir(parents=True, exist_ok=True)
+        os.replace(path, version_path)
+        logger.info(f"Moved {path} to feature version {fingerprint}")
+        return fingerprint
+
+    # ------------------------------------------------------------------
+    # Versions
+    # ------------------------------------------------------------------
+    def _version_info(self, fingerprint: str) -> dict:
+        info_path = self.path / fingerprint / "version.json"
+        if not info_path.exists():
+            return {"fingerprint": fingerprint}
+        with open(info_path) as f:
+            return json.load(f)
+
+    def touch(
+        self, n: int, features: list[str] = None, standardize: bool = False, **info
+    ) -> dict:
+        """Mark a version as used now, updating its version.json with info,
+        e.g. change_id, the last change it includes"""
+        fingerprint = feature_fingerprint(n, features, standardize)
+        version_info = self._version_info(fingerprint)
+        version_info.update(
+            {
+                "n": n,
+                "feature_cols": feature_columns(TRANSFORMED_COLUMNS, features)[0],
+                "standardize": standardize,
+                "last_used": datetime.now(timezone.utc).strftime(
+                    "%Y-%m-%d %H:%M:%S.%f"
+                ),
+                **info,
+            }
+        )
+        version_path = self.path / fingerprint
+        version_path.mkdir(parents=True, exist_ok=True)
+        staging = version_path / "version.json.tmp"
+        with open(staging, "w") as f:
+            json.dump(version_info, f, indent=2)
+        os.replace(staging, version_path / "version.json")
+        return version_info
+
+    def normalization(self, fingerprint: str):
+        """Normalization statistics of a version, None if not computed yet"""
+        stats_path = self.path / fingerprint / "normalization.json"
+        if not stats_path.exists():
+            return None
+        with open(stats_path) as f:
+            return json.load(f)
+
+    def save_normalization(self, fingerprint: str, stats: dict):
+        """Store the normalization statistics of a version. They are computed
+        once, standardized tensors of the version all use the same ones"""
+        version_path = self.path / fingerprint
+        version_path.mkdir(parents=True, exist_ok=True)
+        staging = version_path / "normalization.json.tmp"
+        with open(staging, "w") as f:
+            json.dump(stats, f)
+        os.replace(staging, version_path / "normalization.json")
+
+    def versions(self) -> list[dict]:
+        """version.json of every cached version with its size on disk, most
+        recently used first"""
+        if not self.path.exists():
+            return []
+        versions = []
+        for version_path in self.path.iterdir():
+            if not version_path.is_dir():
+                continue
+            version_info = self._version_info(version_path.name)
+            version_info["bytes"] = sum(
+                p.stat().st_size for p in version_path.rglob("*") if p.is_file()
+            )
+            versions.append(version_info)
+        return sorted(versions, key=lambda v: v.get("last_used", ""), reverse=True)
+
+    def evict(self, keep: list[str] = ()) -> list[str]:
+        """Delete least recently used versions until the cache fits its budget.
+
+        Args:
+            keep (list[str], optional): fingerprints never evicted
+
+        Returns:
+            list[str]: fingerprints of the evicted versions
+        """
+        versions = self.versions()
+        total = sum(version["bytes"] for version in versions)
+        evicted = []
+        for version in reversed(versions):
+            if total <= self.budget_bytes:
+                break
+            if version["fingerprint"] in keep:
+                continue
+            shutil.rmtree(self.path / version["fingerprint"], ignore_errors=True)
+            # its offset would otherwise hold back change log pruning
+            self.db.execute_query(
+                f"DELETE FROM {CHANGE_LOG_OFFSETS_TABLE} WHERE consumer = ?",
+                (self.consumer(version["fingerprint"]),),
+            )
+            total -= version["bytes"]
+            evicted.append(version["fingerprint"])
+            logger.info(
+                f"Evicted feature version {version['fingerprint']} ({version['bytes'] / 1e6:.1f}MB)"
+            )
+        return evicted
+
+
+if __name__ == "__main__":
+    for version in FeatureCache().versions():
+        print(
+            f"{version['fingerprint']}  n={version.get('n')}  "
+            f"features={len(version.get('feature_cols', []))}  "
+            f"change_id={version.get('change_id')}  "
+            f"last_used={version.get('last_used')}  {version['bytes'] / 1e6:.1f}MB"
+        )
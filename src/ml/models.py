@@ -5,6 +5,8 @@ from tensorflow import keras
 # from tensorflow import keras
 from tensorflow.keras import layers, Model
 
+from src.ml.runtime import dtype_policy
+
 
 @tf.keras.utils.register_keras_serializable(
     package="CustomModels", name="TransformerBlock"
@@ -40,26 +42,46 @@ class TransformerBlock(layers.Layer):
     package="CustomModels", name="TeamProcessor"
 )
 class TeamProcessor(layers.Layer):
-    """Processes either home or away team data through the same architecture"""
+    """Processes either home or away team data through the same architecture.
+
+    With normalize_inputs=False the inputs are expected standardized already
+    (see Preprocessor(standardize=True)) and the input BatchNormalization is
+    skipped.
+    """
 
-    def __init__(self, num_heads, key_dim, name="team_processor", **kwargs):
+    def __init__(
+        self,
+        num_heads,
+        key_dim,
+        normalize_inputs=True,
+        name="team_processor",
+        **kwargs,
+    ):
         super().__init__(name=name, **kwargs)
         self.num_heads = num_heads
         self.key_dim = key_dim
-        self.batch_norm = layers.BatchNormalization(name=f"{name}_batch_norm")
+        self.normalize_inputs = normalize_inputs
+        if normalize_inputs:
+            self.batch_norm = layers.BatchNormalization(name=f"{name}_batch_norm")
         self.transformer_block = TransformerBlock(
             num_heads, key_dim, name=f"{name}_transformer"
         )
         self.global_pool = layers.GlobalAveragePooling1D(name=f"{name}_global_pool")
 
     def call(self, inputs):
-        x = self.batch_norm(inputs)
+        x = self.batch_norm(inputs) if self.normalize_inputs else inputs
         x = self.transformer_block(x)
         return self.global_pool(x)
 
     def get_config(self):
         config = super().get_config()
-        config.update({"num_heads": self.num_heads, "key_dim": self.key_dim})
+        config.update(
+            {
+                "num_heads": self.num_heads,
+                "key_dim": self.key_dim,
+                "normalize_inputs": self.normalize_inputs,
+            }
+        )
         return config
 
 
@@ -77,6 +99,7 @@ class HybridTransformerModel(keras.Model):
         num_heads=4,
         dense_units=[128, 64],
         dropout_rates=[0.3, 0.2],
+        normalize_inputs=True,
         model_name="hybrid_transformer",
         **kwargs,
     ):
@@ -90,14 +113,19 @@ class HybridTransformerModel(keras.Model):
         self.num_heads = num_heads
         self.dense_units = dense_units
         self.dropout_rates = dropout_rates
+        self.normalize_inputs = normalize_inputs  # False for standardized tensors
         self.model_name = model_name  # Store for serialization
 
         # Calculate key dimension (ensure it's divisible by num_heads)
         key_dim = max(num_features // num_heads, 1)
 
         # Team processors (shared or separate weights - using separate here)
-        self.home_processor = TeamProcessor(num_heads, key_dim, name="home_processor")
-        self.away_processor = TeamProcessor(num_heads, key_dim, name="away_processor")
+        self.home_processor = TeamProcessor(
+            num_heads, key_dim, normalize_inputs, name="home_processor"
+        )
+        self.away_processor = TeamProcessor(
+            num_heads, key_dim, normalize_inputs, name="away_processor"
+        )
 
         # Combination and dense layers
         self.concat = layers.Concatenate()
@@ -111,7 +139,10 @@ class HybridTransformerModel(keras.Model):
             if i < len(dropout_rates):
                 self.dropout_layers.append(layers.Dropout(dropout_rates[i]))
 
-        self.output_layer = layers.Dense(num_classes, activation="softmax")
+        # softmax in float32 also under mixed precision policies
+        self.output_layer = layers.Dense(
+            num_classes, activation="softmax", dtype="float32"
+        )
 
     def call(self, inputs):
         home_input, away_input = inputs
@@ -158,6 +189,7 @@ class HybridTransformerModel(keras.Model):
                 "num_heads": self.num_heads,
                 "dense_units": self.dense_units,
                 "dropout_rates": self.dropout_rates,
+                "normalize_inputs": self.normalize_inputs,
                 "model_name": self.model_name,
             }
         )
@@ -167,7 +199,12 @@ class HybridTransformerModel(keras.Model):
     def from_config(cls, config):
         # Handle the name parameter properly during deserialization
         model_name = config.pop("model_name", "hybrid_transformer")
-        return cls(model_name=model_name, **config)
+        # sublayers are created with the global policy, make it the saved one
+        # so mixed precision models are restored as mixed precision
+        dtype = config.get("dtype")
+        policy = dtype["config"]["name"] if isinstance(dtype, dict) else dtype
+        with dtype_policy(getattr(policy, "name", policy)):
+            return cls(model_name=model_name, **config)
 
 
 # Factory function for backward compatibility
@@ -194,14 +231,20 @@ def create_hybrid_model(sequence_length, num_features, num_classes=3, **kwargs):
     return model
 
 
-def compile_model(model, learning_rate=0.001):
+def compile_model(model, learning_rate=0.001, performance=False):
     """
     Compile the model with appropriate settings
+
+    Args:
+        performance: XLA compile the training and inference steps of float32
+            models. Mixed bfloat16 models are left to TensorFlow's oneDNN
+            kernels, XLA's CPU backend runs them about half as fast
     """
     model.compile(
         optimizer=keras.optimizers.Adam(learning_rate=learning_rate),
         loss="sparse_categorical_crossentropy",
         metrics=["accuracy"],
+        jit_compile=performance and model.compute_dtype == "float32",
     )
     return model
 
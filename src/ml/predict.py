@@ -4,42 +4,83 @@ from src.config import (
     ML_LOGGER_PATH,
     MODEL_ARTIFACTS_PATH,
     PREDICT_METADATA_TABLE,
-    PROCESSED_TENSORS_PATH,
 )
+from src.data.changes import ChangeLog
 from src.data.database import DatabaseManager
 from src.ml.models import HybridTransformerModel
+from src.ml.registry import ModelRegistry
+from src.ml.feature_cache import (
+    FeatureCache,
+    feature_fingerprint,
+    standardize_windows,
+)
+from src.ml.windows import TeamHistoryIndex
 from src.logger import get_logger
 
 logger = get_logger("MLPredictor", ML_LOGGER_PATH)
 
 
 class MatchPredictor:
-    def __init__(self, model_path: str = MODEL_ARTIFACTS_PATH / "best_model.keras"):
-        self.model_path = model_path
+    def __init__(
+        self,
+        model_path: str = None,
+        features: list[str] = None,
+    ):
+        # the current registry version's model, if none was given
+        registry = ModelRegistry()
+        self.model_path = (
+            model_path
+            or registry.artifact("best_model.keras")
+            or MODEL_ARTIFACTS_PATH / "best_model.keras"
+        )
+        self.model_version = registry.version_of(self.model_path)
         self.model = self._load_model()
         self.db = DatabaseManager()
+        self.changes = ChangeLog(self.db, "predictor")
+        self.features = features  # feature columns the model was trained on
+        # the feature version matching the model's window size and inputs
+        self.standardize = not getattr(self.model, "normalize_inputs", True)
+        self.cache = FeatureCache()
+        self.store = self.cache.store(
+            self.model.sequence_length, features, self.standardize
+        )
+        self.history = None  # TeamHistoryIndex, built on the first fixture
 
     def _load_model(self):
         """Load the trained model"""
+        logger.info(f"Loading model {self.model_path} (version {self.model_version})")
         return tf.keras.models.load_model(self.model_path)
 
     def _load_tensors(self, match_uuid: str):
-        """Load tensors from processed_tensors directory"""
-        path = PROCESSED_TENSORS_PATH / match_uuid
-        if path.exists():
-            try:
-                home_serialized = tf.io.read_file(str(path / "home_tensor.ten"))
-                away_serialized = tf.io.read_file(str(path / "away_tensor.ten"))
-                home_tensor = tf.io.parse_tensor(home_serialized, out_type=tf.float32)
-                away_tensor = tf.io.parse_tensor(away_serialized, out_type=tf.float32)
-                return home_tensor, away_tensor
-            except Exception as e:
-                logger.error(f"Error loading tensors for {match_uuid}: {e}")
-                return None, None
-        return None, None
+        """Load tensors from the tensor store, whose shards are memory-mapped"""
+        try:
+            tensors = self.store.get(match_uuid)
+        except Exception as e:
+            logger.error(f"Error loading tensors for {match_uuid}: {e}")
+            return None, None
+        if tensors is None:
+            return None, None
+        home_tensor, away_tensor, _ = tensors
+        return tf.convert_to_tensor(home_tensor), tf.convert_to_tensor(away_tensor)
 
     def _get_all_matches_to_predict(self):
         """Get all matches from predict_metadata_table that need predictions"""
+        if not self.changes.is_bootstrap:
+            # upcoming matches, the ones changed since the last run and the
+            # ones still without predictions, e.g. failed in a previous run
+            changed_keys, params = self.changes.keys_subquery([PREDICT_METADATA_TABLE])
+            query = f"""
+            SELECT match_uuid, season_link, date, home, away, score, winner, type, report_link
+            FROM {PREDICT_METADATA_TABLE}
+            WHERE (season_link, home, away) IN ({changed_keys})
+               OR home_win_pred_prob IS NULL
+               OR draw_pred_prob IS NULL
+               OR away_win_pred_prob IS NULL
+               OR type='prediction'
+            ORDER BY date
+            """
+            return self.db.get_dataframe(query, params=params)
+
         query = f"""
         SELECT match_uuid, season_link, date, home, away, score, winner, type, report_link
         FROM {PREDICT_METADATA_TABLE}
@@ -86,6 +127,7 @@ class MatchPredictor:
         SET home_win_pred_prob = ?,
             draw_pred_prob = ?,
             away_win_pred_prob = ?,
+            model_version = ?,
             last_updated = CURRENT_TIMESTAMP
         WHERE match_uuid = ?
         """
@@ -95,17 +137,55 @@ class MatchPredictor:
                 float(home_win_prob),
                 float(draw_prob),
                 float(away_win_prob),
+                self.model_version,
                 match_uuid,
             ),
         )
 
+    def predict_fixture(self, home_team: str, away_team: str, match_date: str):
+        """Predict any fixture from both teams' last n matches before match_date,
+        whether or not it is in predict metadata. Nothing is saved."""
+        if self.history is None:
+            self.history = TeamHistoryIndex.from_database(self.db, self.features)
+        n = self.model.sequence_length
+        home_window = self.history.window(home_team, match_date, n)
+        away_window = self.history.window(away_team, match_date, n)
+        if home_window is None or away_window is None:
+            logger.error(
+                f"Not enough previous matches to predict {home_team} vs {away_team} on {match_date}"
+            )
+            return None
+        if self.standardize:
+            stats = self.cache.normalization(
+                feature_fingerprint(n, self.features, self.standardize)
+            )
+            home_window = standardize_windows(home_window, stats)
+            away_window = standardize_windows(away_window, stats)
+
+        logger.info(f"Predicting fixture {home_team} vs {away_team} on {match_date}")
+        predictions = self.model.predict(
+            [
+                tf.expand_dims(tf.convert_to_tensor(home_window), axis=0),
+                tf.expand_dims(tf.convert_to_tensor(away_window), axis=0),
+            ]
+        )
+        home_win_prob, draw_prob, away_win_prob = self._extract_probabilities(
+            predictions
+        )
+        logger.info(
+            f"Predictions: Home: {home_win_prob:.3f}, Draw: {draw_prob:.3f}, Away: {away_win_prob:.3f}"
+        )
+        return predictions
+
     def predict_single_match(self, home_team: str, away_team: str, match_date: str):
         """Predict a single match using DataFrame approach"""
         matches_df = self._get_single_match_to_predict(home_team, away_team, match_date)
 
         if matches_df.empty:
-            logger.error(f"Match not found: {home_team} vs {away_team} on {match_date}")
-            return None
+            logger.info(
+                f"Match not found: {home_team} vs {away_team} on {match_date}, predicting as a fixture"
+            )
+            return self.predict_fixture(home_team, away_team, match_date)
 
         match = matches_df.iloc[0]
         match_uuid = match["match_uuid"]
@@ -136,10 +216,12 @@ class MatchPredictor:
 
     def predict_all_matches(self):
         """Predict all matches in the database that don't have predictions yet"""
+        self.changes.begin()
         matches_df = self._get_all_matches_to_predict()
 
         if matches_df.empty:
             logger.info("No matches need predictions")
+            self.changes.commit()
             return
 
         total_matches = len(matches_df)
@@ -147,6 +229,7 @@ class MatchPredictor:
 
         successful_predictions = 0
         failed_predictions = 0
+        failed_keys = set()  # (season_link, home, away) retried next run
 
         for i, (_, match) in enumerate(matches_df.iterrows()):
             match_uuid = match["match_uuid"]
@@ -176,6 +259,7 @@ class MatchPredictor:
             if home_tensor is None or away_tensor is None:
                 logger.warning(f"Skipping {match_uuid}: Tensors not found")
                 failed_predictions += 1
+                failed_keys.add((season_link, home, away))
                 continue
 
             try:
@@ -201,7 +285,9 @@ class MatchPredictor:
             except Exception as e:
                 logger.error(f"Error predicting match {match_uuid}: {e}")
                 failed_predictions += 1
+                failed_keys.add((season_link, home, away))
 
+        self.changes.commit(failed_keys)
         logger.info(
             f"Prediction completed. Successful: {successful_predictions}, Failed: {failed_predictions}"
         )
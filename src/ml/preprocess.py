@@ -2,16 +2,31 @@ import sys
 import traceback
 import numpy as np
 import pandas as pd
-import tensorflow as tf
 from tqdm import tqdm
 from src.config import (
+    DEFAULT_WINDOW_SIZE,
     PREDICT_METADATA_TABLE,
-    PROCESSED_TENSORS_PATH,
     RAW_TABLE,
     TRANSFORMED_TABLE,
     ML_LOGGER_PATH,
 )
+from src.data.changes import ChangeLog
 from src.data.database import DatabaseManager
+from src.data.snapshot import SnapshotManager
+from src.ml.feature_cache import (
+    FeatureCache,
+    feature_fingerprint,
+    normalization_stats,
+    standardize_windows,
+)
+from src.ml.tensor_store import NO_TARGET
+from src.ml.windows import (
+    TeamHistoryIndex,
+    feature_columns,
+    orientation_permutations,
+    oriented_values,
+    parallel_match_windows,
+)
 
 from src.logger import get_logger
 
@@ -22,22 +37,77 @@ logger = get_logger(
 
 
 class Preprocessor:
-    def __init__(self, n: str = 10):
+    def __init__(
+        self,
+        n: int = DEFAULT_WINDOW_SIZE,
+        use_snapshot: bool = False,
+        incremental: bool = True,
+        features: list[str] = None,
+        workers: int = 1,
+        standardize: bool = False,
+    ):
         self.db = DatabaseManager()
         self.n = n  # last n matches
+        self.use_snapshot = use_snapshot  # read history from a fresh parquet snapshot
+        self.incremental = incremental  # only rebuild matches of teams with new data
+        self.features = features  # feature columns to use, None for all of them
+        self.workers = workers  # processes building windows, one league shard each
+        self.standardize = standardize  # store windows standardized per feature
+        self.stats = None  # normalization statistics of the feature version
         self.df = None
+        self.valid = None  # rows of self.df with every feature
+        self.history = None  # TeamHistoryIndex of self.df
+        # tensors of this (n, features) version of the feature cache
+        self.cache = FeatureCache()
+        self.fingerprint = feature_fingerprint(n, features, standardize)
+        self.changes = ChangeLog(self.db, self.cache.consumer(self.fingerprint))
+        self.store = self.cache.store(n, features, standardize)
+
+    @staticmethod
+    def _teams_filter(teams):
+        """SQL condition and params selecting the matches of teams, or an
+        always true condition if teams is None"""
+        if teams is None:
+            return "1 = 1", ()
+        placeholders = ", ".join(["?"] * len(teams))
+        return f"(home IN ({placeholders}) OR away IN ({placeholders}))", (
+            *teams,
+            *teams,
+        )
 
-    def read_data(self):
-        """Get transformed data from database and return as pandas DataFrame"""
+    def read_data(self, teams: list[str] = None):
+        """Get transformed data from database and return as pandas DataFrame
+
+        Args:
+            teams (list[str], optional): Only read the matches of these teams.
+                Their windows are the same as with every match read
+        """
         try:
-            df_transformed = self.db.get_dataframe(
-                f"SELECT * FROM {TRANSFORMED_TABLE} ORDER BY date ASC"
-            )
+            teams_filter, params = self._teams_filter(teams)
+            df_transformed = None
+            if self.use_snapshot:
+                df_transformed = SnapshotManager().read_table(
+                    TRANSFORMED_TABLE,
+                    filters=(
+                        None
+                        if teams is None
+                        else [[("home", "in", teams)], [("away", "in", teams)]]
+                    ),
+                    min_watermark=self.db.table_watermark([TRANSFORMED_TABLE]),
+                )
+            if df_transformed is None:
+                df_transformed = self.db.get_dataframe(
+                    f"SELECT * FROM {TRANSFORMED_TABLE} WHERE {teams_filter} ORDER BY date ASC",
+                    params=params,
+                    include_archives=True,
+                )
             df_raw = self.db.get_dataframe(
-                f"SELECT season_link, date, home, away FROM {RAW_TABLE} WHERE score IS NULL ORDER BY date ASC"
+                f"SELECT season_link, date, home, away FROM {RAW_TABLE} WHERE score IS NULL AND {teams_filter} ORDER BY date ASC",
+                params=params,
             )
             self.df = pd.concat([df_transformed, df_raw], ignore_index=True)
             self.df.sort_values("date", inplace=True, ascending=True)
+            self._encode_columns()
             logger.info(
                 f"Successfully read DataFrame with shape: {self.df.shape}. Rows without score: {self.df[self.df['home_score'].isnull()].shape[0]}"
             )
@@ -45,54 +115,79 @@ class Preprocessor:
             logger.error(f"Error reading data from database: {e}")
         return self.df
 
+    def _encode_columns(self):
+        """Compact, comparison friendly dtypes for self.df: teams and seasons
+        as categoricals (home and away share their categories), dates as
+        datetime64 and features as float32, plus the mask of the rows with
+        every feature (self.valid)"""
+        teams = pd.CategoricalDtype(
+            sorted(pd.unique(pd.concat([self.df["home"], self.df["away"]])))
+        )
+        self.df["home"] = self.df["home"].astype(teams)
+        self.df["away"] = self.df["away"].astype(teams)
+        self.df["season_link"] = self.df["season_link"].astype("category")
+        self.df["date"] = pd.to_datetime(self.df["date"])
+        feature_cols = feature_columns(self.df.columns, self.features)[0]
+        self.df[feature_cols] = self.df[feature_cols].astype(np.float32)
+        self.valid = self.df[feature_cols].notna().all(axis=1).to_numpy()
+
     def _get_feature_cols(self):
         """Get feature columns from DataFrame"""
         try:
-            not_feature_cols = [
-                "date",
-                "home",
-                "away",
-                "attendance",
-                "report_link",
-                "date_added",
-                "last_updated",
-                "season_link",
-            ]
-            self.feature_cols = [
-                col for col in self.df.columns if col not in not_feature_cols
-            ]
-            self.home_cols = [item for item in self.feature_cols if "home" in item]
-            self.away_cols = [item for item in self.feature_cols if "away" in item]
-            self._create_constant_tensors()
+            self.feature_cols, self.home_cols, self.away_cols = feature_columns(
+                self.df.columns, self.features
+            )
+            self.permutations, self.neutral = orientation_permutations(
+                self.feature_cols, self.home_cols, self.away_cols
+            )
         except Exception as e:
             logger.error(f"Error getting feature columns: {e}")
         return self.feature_cols, self.home_cols, self.away_cols
 
-    def _create_constant_tensors(self):
-        # Create empty tensors
-        try:
-            home_tensor = tf.constant(
-                [], dtype=tf.float32, shape=[0, self.n, len(self.feature_cols)]
+    def _normalization(self) -> dict:
+        """Per feature statistics of this feature version, computed once from
+        every completed match as seen by both teams"""
+        stats = self.cache.normalization(self.fingerprint)
+        if stats is None:
+            df = self.db.get_dataframe(
+                f"SELECT {', '.join(self.feature_cols)} FROM {TRANSFORMED_TABLE}",
+                include_archives=True,
             )
-            away_tensor = tf.constant(
-                [], dtype=tf.float32, shape=[0, self.n, len(self.feature_cols)]
+            rows = oriented_values(
+                df.to_numpy(dtype=np.float64), self.permutations, self.neutral
             )
-            target_tensor = tf.constant([], dtype=tf.int32, shape=[0])
-        except Exception as e:
-            logger.error(f"Error creating empty tensors: {e}")
-        return home_tensor, away_tensor, target_tensor
+            stats = normalization_stats(rows.reshape(-1, len(self.feature_cols)))
+            self.cache.save_normalization(self.fingerprint, stats)
+            logger.info(
+                f"Computed {stats['method']} normalization statistics from {stats['rows']} match rows"
+            )
+        return stats
 
-    def _filter_last_n_matches(self, team_name: str, date):
-        """Return last n matches for team_name before date"""
-        try:
-            last_n_mask = (
-                (self.df["date"] < date)
-                & ((self.df["home"] == team_name) | (self.df["away"] == team_name))
-                & (self.df[self.feature_cols].notnull().all(axis=1))
+    def _build_history_index(self):
+        """Index every team's matches of self.df by date"""
+        self.history = TeamHistoryIndex.from_dataframe(
+            self.df, self.feature_cols, self.home_cols, self.away_cols, self.valid
+        )
+        return self.history
+
+    def _match_windows(self, candidates: list[int]):
+        """Home and away windows of the candidate rows of self.df, built by
+        league in a process pool when workers > 1"""
+        if self.workers > 1:
+            return parallel_match_windows(
+                self.df,
+                candidates,
+                self.feature_cols,
+                self.home_cols,
+                self.away_cols,
+                self.n,
+                self.workers,
             )
-        except Exception as e:
-            logger.error(f"Error filtering last n matches: {e}")
-        return self.df[last_n_mask].tail(self.n)
+        self._build_history_index()
+        candidate_df = self.df.iloc[candidates]
+        return self.history.match_windows(
+            candidate_df["home"], candidate_df["away"], candidate_df["date"], self.n
+        )
 
     def _get_target_value(self, home_score: int, away_score: int):
         """
@@ -115,51 +210,76 @@ class Preprocessor:
             logger.error(f"Error getting target value: {e}")
         return target
 
-    def _fill_temp_df(
-        self, last_n_matches: pd.DataFrame, team_name: str, temp_df: pd.DataFrame
-    ):
-        """Fill temp dataframe with last n matches for team_name"""
-        try:
-            for i, (_, item) in enumerate(last_n_matches.iterrows()):
-                if item["home"] == team_name:
-                    temp_df.loc[i, self.home_cols] = item[self.home_cols].values
-                    temp_df.loc[i, self.away_cols] = item[self.away_cols].values
-                elif item["away"] == team_name:
-                    temp_df.loc[i, self.home_cols] = item[self.away_cols].values
-                    temp_df.loc[i, self.away_cols] = item[self.home_cols].values
-        except Exception as e:
-            logger.error(f"Error filling temp dataframe: {e}")
-        return temp_df
+    def _get_processed_matches(self) -> set:
+        """(season_link, home, away) of every match already processed with its
+        result, in this version's store. Upcoming fixtures are not, their
+        windows are rebuilt on every full run so they never keep a stale history.
+        A match only counts once its stored target is a result too"""
+        rows = self.db.execute_query(
+            f"SELECT season_link, home, away, match_uuid FROM {PREDICT_METADATA_TABLE} WHERE type = 'training'"
+        )
+        rows = [row for row in rows if row[3] in self.store]
+        if not rows:
+            return set()
+        _, _, targets, _ = self.store.open_memmap([row[3] for row in rows])
+        has_result = np.asarray(targets) != NO_TARGET
+        return {tuple(row[:3]) for row, stored in zip(rows, has_result) if stored}
 
-    def _process_tensors(self, home_df, away_df, target):
-        """Convert dataframes to tensors and add to existing tensors"""
-        try:
-            # Conver to tensors
-            home_tensor = tf.convert_to_tensor(home_df.values, dtype=tf.float32)
-            away_tensor = tf.convert_to_tensor(away_df.values, dtype=tf.float32)
-            if target is None:
-                target_tensor = tf.convert_to_tensor([], dtype=tf.int32)
-            else:
-                target_tensor = tf.convert_to_tensor([target], dtype=tf.int32)
-            # Add batch dimension
-            home_tensor = tf.expand_dims(home_tensor, axis=0)
-            away_tensor = tf.expand_dims(away_tensor, axis=0)
+    def _get_changed_matches(self):
+        """Matches changed since the last run, or None to consider every match,
+        e.g. when the version's store is new or not migrated yet"""
+        if not self.incremental or self.changes.is_bootstrap or not len(self.store):
+            return None
+        return self.changes.changed_keys([TRANSFORMED_TABLE, RAW_TABLE])
 
-        except Exception as e:
-            logger.error(f"Error processing tensors: {e}")
-        return home_tensor, away_tensor, target_tensor
+    def _get_dirty_teams(self) -> dict:
+        """{team: earliest date of its results changed since the last run}.
 
-    def _save_match_metadata_in_db(
-        self,
-        season_link: str,
-        date: str,
-        home_team: str,
-        away_team: str,
-        score: str,
-        target_value,
-        report_link: str,
-    ):
-        self.db.execute_query(
+        Every window of a dirty team built for a later match may include one of
+        those results, new fixtures alone do not change any history.
+        """
+        query, params = self.changes.keys_subquery([TRANSFORMED_TABLE])
+        rows = self.db.execute_query(
+            f"""
+            SELECT team, MIN(date) FROM (
+                SELECT t.home AS team, t.date FROM {TRANSFORMED_TABLE} t
+                JOIN ({query}) c USING (season_link, home, away)
+                UNION ALL
+                SELECT t.away AS team, t.date FROM {TRANSFORMED_TABLE} t
+                JOIN ({query}) c USING (season_link, home, away)
+            )
+            GROUP BY team
+            """,
+            (*params, *params),
+        )
+        return {team: date for team, date in rows}
+
+    def _get_affected_matches(self, dirty_teams: dict) -> set:
+        """(season_link, home, away) of the matches played after a result of
+        one of their teams changed, their windows must be rebuilt"""
+        if not dirty_teams:
+            return set()
+        teams_filter, params = self._teams_filter(list(dirty_teams))
+        df = self.db.get_dataframe(
+            f"""
+            SELECT season_link, date, home, away FROM {TRANSFORMED_TABLE} WHERE {teams_filter}
+            UNION ALL
+            SELECT season_link, date, home, away FROM {RAW_TABLE} WHERE score IS NULL AND {teams_filter}
+            """,
+            params=(*params, *params),
+        )
+        # dates are ISO strings, teams without changes compare as never dirty
+        never = "9999-12-31"
+        affected = (df["date"] > df["home"].map(dirty_teams).fillna(never)) | (
+            df["date"] > df["away"].map(dirty_teams).fillna(never)
+        )
+        df = df[affected]
+        return set(zip(df["season_link"], df["home"], df["away"]))
+
+    def _save_match_metadata_in_db(self, conn, metadata: list[tuple]):
+        """Upsert the (season_link, date, home, away, score, target value,
+        report_link) of the saved matches on conn, without committing"""
+        conn.executemany(
             f"""
             INSERT INTO {PREDICT_METADATA_TABLE} 
                 (season_link, date, home, away, score, winner, type, report_link)
@@ -171,57 +291,125 @@ class Preprocessor:
                 type = excluded.type,
                 last_updated = CURRENT_TIMESTAMP
             """,
-            params=(
-                season_link,
-                date,
-                home_team,
-                away_team,
-                score,
-                target_value,
-                "training" if score is not None else "prediction",
-                report_link,
-            ),
+            [
+                (
+                    season_link,
+                    date,
+                    home_team,
+                    away_team,
+                    score,
+                    target_value,
+                    "training" if score is not None else "prediction",
+                    report_link,
+                )
+                for (
+                    season_link,
+                    date,
+                    home_team,
+                    away_team,
+                    score,
+                    target_value,
+                    report_link,
+                ) in metadata
+            ],
         )
 
-    def _save_current_match_tensors(
-        self, season_link, home_team, away_team, home_tensor, away_tensor, target_tensor
-    ):
-        match = self.db.execute_query(
-            f"SELECT match_uuid FROM {PREDICT_METADATA_TABLE} WHERE season_link = ? AND home = ? AND away = ?",
-            params=(season_link, home_team, away_team),
-        )
-        match_uuid = match[0][0]
-        # Create directory if it doesn't exist
-        path = PROCESSED_TENSORS_PATH / match_uuid
-        path.mkdir(parents=True, exist_ok=True)
-        # Save tensors using tf.io.write_file or convert to numpy and save
-        tf.io.write_file(
-            str(path / "home_tensor.ten"), tf.io.serialize_tensor(home_tensor)
-        )
-        tf.io.write_file(
-            str(path / "away_tensor.ten"), tf.io.serialize_tensor(away_tensor)
-        )
-        tf.io.write_file(
-            str(path / "target_tensor.ten"),
-            tf.io.serialize_tensor(target_tensor),
-        )
+    def _get_match_uuids(self, conn) -> dict:
+        """{(season_link, home, away): match_uuid} of predict metadata"""
+        rows = conn.execute(
+            f"SELECT season_link, home, away, match_uuid FROM {PREDICT_METADATA_TABLE}"
+        ).fetchall()
+        return {(row[0], row[1], row[2]): row[3] for row in rows}
+
+    def _save_tensors(self, metadata: list[tuple], home_windows, away_windows, targets):
+        """Commit the saved matches: their predict metadata and their windows
+        in the tensor store, in one transaction. The metadata is upserted
+        first, since it assigns the match uuids, and only committed once the
+        shard is, so a failed append never marks a match as processed"""
+        if self.standardize:
+            home_windows = standardize_windows(home_windows, self.stats)
+            away_windows = standardize_windows(away_windows, self.stats)
+        with self.db.get_connection() as conn:
+            self._save_match_metadata_in_db(conn, metadata)
+            match_uuids = self._get_match_uuids(conn)
+            uuids = [match_uuids[row[0], row[2], row[3]] for row in metadata]
+            self.store.append(uuids, home_windows, away_windows, targets)
+            conn.commit()
 
     def preprocess(self):
         """Preprocess data and save processed tensors"""
         try:
-            self.data = self.read_data()
+            # fix the change window before reading so no change is skipped
+            self.changes.begin()
+            changed_matches = self._get_changed_matches()
+            if changed_matches is None:
+                # full run: every match not processed with its result yet, or
+                # every match if changes since this version's last run are lost
+                self.data = self.read_data()
+                processed_matches = (
+                    set() if self.changes.expired else self._get_processed_matches()
+                )
+                is_candidate = lambda match_key: match_key not in processed_matches
+            else:
+                # incremental run: changed matches and every later match of the
+                # teams whose results changed, processed or not, so upcoming
+                # fixtures get windows with the new results. Only the history
+                # of their teams is read.
+                dirty_teams = self._get_dirty_teams()
+                rebuild = changed_matches | self._get_affected_matches(dirty_teams)
+                logger.info(
+                    f"{len(dirty_teams)} teams with new results, {len(rebuild)} matches to rebuild"
+                )
+                self.data = self.read_data(
+                    sorted({team for key in rebuild for team in key[1:]})
+                )
+                is_candidate = lambda match_key: match_key in rebuild
             self._get_feature_cols()
+            # only standardized versions use their statistics
+            if self.standardize:
+                self.stats = self._normalization()
+
+            current_match = None
+            archived_seasons = self.db.archived_season_links()
+            keys = zip(self.df["season_link"], self.df["home"], self.df["away"])
+            candidates = [
+                position
+                for position, match_key in enumerate(keys)
+                # archived seasons are only history
+                if match_key[0] not in archived_seasons and is_candidate(match_key)
+            ]
 
-            logger.info(f"Preprocessing {self.df.shape[0]} matches...")
-            for i, row in self.df.iterrows():
-                # get useful information from row
-                temp_date = row["date"]
-                home_team = row["home"]
-                away_team = row["away"]
-                home_score = row["home_score"]
-                away_score = row["away_score"]
-                season_link = row["season_link"]
-                report_link = row["report_link"]
+            # last n matches windows of both teams, for every candidate at once
+            candidate_df = self.df.iloc[candidates]
+            home_windows, away_windows, available = self._match_windows(candidates)
+
+            complete = ~(
+                np.isnan(home_windows).any(axis=(1, 2))
+                | np.isnan(away_windows).any(axis=(1, 2))
+            )
+
+            logger.info(f"Preprocessing {len(candidates)} matches...")
+            saved, targets, metadata = [], [], []
+            for i, (
+                season_link,
+                temp_date,
+                home_team,
+                away_team,
+                home_score,
+                away_score,
+                report_link,
+            ) in enumerate(
+                zip(
+                    candidate_df["season_link"],
+                    candidate_df["date"],
+                    candidate_df["home"],
+                    candidate_df["away"],
+                    candidate_df["home_score"],
+                    candidate_df["away_score"],
+                    candidate_df["report_link"],
+                )
+            ):
+                temp_date = temp_date.strftime("%Y-%m-%d")
                 current_match = (
                     f"{season_link} - {temp_date} - {home_team} - {away_team}"
                 )
@@ -230,73 +418,48 @@ class Preprocessor:
                     if pd.notna(home_score) and pd.notna(away_score)
                     else None
                 )
-                # continue if match has already been processed
-                processed_match = self.db.execute_query(
-                    f"SELECT match_uuid FROM {PREDICT_METADATA_TABLE} WHERE season_link = ? AND home = ? AND away = ?",
-                    params=(season_link, home_team, away_team),
-                )
-                if processed_match:
-                    continue
-
-                # filters home and away last n matches
-                home_last_n = self._filter_last_n_matches(home_team, temp_date)
-                away_last_n = self._filter_last_n_matches(away_team, temp_date)
 
                 # only create row if both home and away last n matches are available
-                if home_last_n.shape[0] == self.n and away_last_n.shape[0] == self.n:
+                if available[i]:
                     target_value = self._get_target_value(home_score, away_score)
 
-                    # create temp dataframes
-                    home_temp_df = pd.DataFrame(
-                        columns=self.feature_cols, index=range(self.n)
-                    )
-                    away_temp_df = pd.DataFrame(
-                        columns=self.feature_cols, index=range(self.n)
-                    )
-
-                    # fill temp dataframes
-                    home_temp_df = self._fill_temp_df(
-                        home_last_n, home_team, home_temp_df
-                    )
-                    away_temp_df = self._fill_temp_df(
-                        away_last_n, away_team, away_temp_df
-                    )
-
-                    # convert to tensor
-                    if (
-                        not home_temp_df.isnull().values.any()
-                        and not away_temp_df.isnull().values.any()
-                    ):
-                        home_tensor, away_tensor, target_tensor = self._process_tensors(
-                            home_temp_df, away_temp_df, target_value
-                        )
-
-                        self._save_match_metadata_in_db(
-                            season_link,
-                            temp_date,
-                            home_team,
-                            away_team,
-                            score,
-                            target_value,
-                            report_link,
-                        )
-
-                        self._save_current_match_tensors(
-                            season_link,
-                            home_team,
-                            away_team,
-                            home_tensor,
-                            away_tensor,
-                            target_tensor,
+                    if complete[i]:
+                        metadata.append(
+                            (
+                                season_link,
+                                temp_date,
+                                home_team,
+                                away_team,
+                                score,
+                                target_value,
+                                report_link,
+                            )
                         )
+                        saved.append(i)
+                        targets.append(target_value)
                     else:
                         logger.info(
                             f"At least one of {self.n} previous matches used to build tensor for match {current_match} is missing data. Skipping..."
                         )
                 if i % 100 == 0:
                     logger.info(
-                        f"Processed {i}/{self.df.shape[0]} matches - {i/self.df.shape[0]:.0%}."
+                        f"Processed {i}/{len(candidates)} matches - {i/len(candidates):.0%}."
                     )
+
+            # commit the windows of every saved match in one shard
+            current_match = None
+            self._save_tensors(
+                metadata,
+                home_windows[saved],
+                away_windows[saved],
+                targets,
+            )
+            logger.info(f"Saved tensors of {len(saved)} matches")
+            self.changes.commit()
+            self.cache.touch(
+                self.n, self.features, self.standardize, change_id=self.changes.end
+            )
+            self.cache.evict(keep=[self.fingerprint])
         except Exception as e:
             logger.error(
                 f"Error preprocessing {current_match}: {e}\n{traceback.format_exc()}"
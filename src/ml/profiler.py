@@ -0,0 +1,170 @@
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+
+from src.config import (
+    ML_LOGGER_PATH,
+    TRAINING_PROFILE_PATH,
+    TRAINING_PROFILE_PROBE_STEPS,
+    TRAINING_TRACE_PATH,
+)
+from src.logger import get_logger
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+logger = get_logger("MLProfiler", ML_LOGGER_PATH)
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process since it started, in MB"""
+    if resource is None:
+        return np.nan
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 1024**2 if sys.platform == "darwin" else peak / 1024
+
+
+class TrainingProfiler(tf.keras.callbacks.Callback):
+    """Per epoch performance of a training run.
+
+    Records the epoch wall time split into training steps, validation and the
+    time between steps (callbacks and Python overhead), training samples per
+    second, the process peak RSS and the peak memory of TensorFlow's
+    allocator during the epoch.
+
+    Keras fetches batches inside its compiled train step, so the wait for the
+    input pipeline cannot be timed from a callback. When dataset is given, the
+    pipeline alone is timed on probe_steps batches as training begins:
+    input_seconds is the time the epoch's steps would take to get their
+    batches without overlap, next to the step_seconds they took. An
+    input_ratio near or above 1 means training is input bound.
+
+    profile_steps (first, last), global training steps counted from 0, are
+    captured as a tf.profiler trace in trace_path for the exact split.
+    """
+
+    def __init__(
+        self,
+        samples: int,
+        dataset: tf.data.Dataset = None,
+        probe_steps: int = TRAINING_PROFILE_PROBE_STEPS,
+        profile_steps: tuple[int, int] = None,
+        trace_path=TRAINING_TRACE_PATH,
+    ):
+        super().__init__()
+        self.samples = samples
+        self.dataset = dataset
+        self.probe_steps = probe_steps
+        self.profile_steps = profile_steps
+        self.trace_path = trace_path
+        self.device = "GPU:0" if tf.config.list_physical_devices("GPU") else "CPU:0"
+        self.input_step_seconds = np.nan
+        self.tracing = False
+        self.step = 0
+        self.epochs = []
+
+    def _probe_input(self):
+        """Seconds per batch of the input pipeline alone"""
+        batches = 0
+        start = time.perf_counter()
+        for _ in self.dataset.take(self.probe_steps):
+            batches += 1
+        if batches:
+            self.input_step_seconds = (time.perf_counter() - start) / batches
+
+    def _allocator_peak_mb(self) -> float:
+        try:
+            return tf.config.experimental.get_memory_info(self.device)["peak"] / 1024**2
+        except (ValueError, RuntimeError):
+            return np.nan
+
+    def _reset_allocator_peak(self):
+        try:
+            tf.config.experimental.reset_memory_stats(self.device)
+        except (ValueError, RuntimeError):
+            pass
+
+    def _stop_trace(self):
+        if self.tracing:
+            tf.profiler.experimental.stop()
+            self.tracing = False
+            logger.info(f"Profiler trace saved to {self.trace_path}")
+
+    def on_train_begin(self, logs=None):
+        self.step = 0
+        self.epochs = []
+        if self.dataset is not None:
+            self._probe_input()
+            logger.info(
+                f"Input pipeline: {self.input_step_seconds * 1000:.1f} ms per batch"
+            )
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._reset_allocator_peak()
+        self.epoch_start = time.perf_counter()
+        self.step_seconds = 0.0
+        self.validation_seconds = 0.0
+        self.steps = 0
+
+    def on_train_batch_begin(self, batch, logs=None):
+        if self.profile_steps and self.step == self.profile_steps[0]:
+            try:
+                tf.profiler.experimental.start(str(self.trace_path))
+                self.tracing = True
+            except Exception as e:
+                logger.warning(f"Profiler trace could not be started: {e}")
+        self.step_start = time.perf_counter()
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.step_seconds += time.perf_counter() - self.step_start
+        self.steps += 1
+        if self.profile_steps and self.step == self.profile_steps[1]:
+            self._stop_trace()
+        self.step += 1
+
+    def on_test_begin(self, logs=None):
+        self.validation_start = time.perf_counter()
+
+    def on_test_end(self, logs=None):
+        self.validation_seconds += time.perf_counter() - self.validation_start
+
+    def on_epoch_end(self, epoch, logs=None):
+        epoch_seconds = time.perf_counter() - self.epoch_start
+        input_seconds = self.input_step_seconds * self.steps
+        self.epochs.append(
+            {
+                "epoch": epoch + 1,
+                "epoch_seconds": epoch_seconds,
+                "step_seconds": self.step_seconds,
+                "validation_seconds": self.validation_seconds,
+                "host_seconds": epoch_seconds
+                - self.step_seconds
+                - self.validation_seconds,
+                "samples_per_second": self.samples / self.step_seconds,
+                "input_seconds": input_seconds,
+                "input_ratio": input_seconds / self.step_seconds,
+                "peak_rss_mb": peak_rss_mb(),
+                "tf_peak_mb": self._allocator_peak_mb(),
+            }
+        )
+
+    def on_train_end(self, logs=None):
+        self._stop_trace()
+
+    @property
+    def results(self) -> pd.DataFrame:
+        """One row per epoch"""
+        return pd.DataFrame(self.epochs)
+
+    def save(self, path=TRAINING_PROFILE_PATH) -> pd.DataFrame:
+        """Per epoch performance to CSV"""
+        results = self.results
+        results.to_csv(path, index=False)
+        logger.info(f"Training profile saved to {path}")
+        return results
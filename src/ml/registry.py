@@ -0,0 +1,190 @@
+import hashlib
+import json
+import os
+import shutil
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+
+from src import config
+from src.config import ML_LOGGER_PATH, MODEL_REGISTRY_PATH
+from src.logger import get_logger
+
+logger = get_logger("MLRegistry", ML_LOGGER_PATH)
+
+# modules that build, fit and feed the model: changing them makes a new model
+# version. Tools around training (benchmarks, tuning, validation, profiling,
+# this registry) are left out, so editing them does not retrain
+CODE_FILES = [
+    Path(__file__).parent / name
+    for name in ("models.py", "runtime.py", "tensor_store.py", "train.py")
+]
+# configuration read while training; the window size and features are part of
+# the feature version, the store settings are lossless
+CONFIG_KEYS = [
+    "INCREMENTAL_LEARNING_RATE",
+    "INCREMENTAL_REPLAY_RATIO",
+    "INCREMENTAL_HOLDOUT_SHARE",
+    "INCREMENTAL_MAX_REGRESSION",
+]
+
+
+def code_version() -> str:
+    """Hash of the training code and configuration"""
+    digest = hashlib.sha256()
+    for path in sorted(CODE_FILES):
+        digest.update(path.name.encode())
+        digest.update(path.read_bytes())
+    digest.update(
+        json.dumps({key: repr(getattr(config, key)) for key in CONFIG_KEYS}).encode()
+    )
+    return digest.hexdigest()[:16]
+
+
+def data_version(uuids: list[str], targets, change_id=None) -> str:
+    """Hash of the training matches, in order, with their targets and the
+    change log position of the tensors they were read from"""
+    digest = hashlib.sha256()
+    digest.update("\n".join(uuids).encode())
+    digest.update(np.asarray(targets, dtype=np.int64).tobytes())
+    digest.update(str(change_id).encode())
+    return digest.hexdigest()[:16]
+
+
+def training_fingerprint(
+    data: str, feature_version: str, config: dict, code: str = None
+) -> tuple[str, dict]:
+    """Fingerprint of a training run and its components: the training data,
+    the feature version, the training configuration and the code version"""
+    components = {
+        "data": data,
+        "feature_version": feature_version,
+        "config": config,
+        "code": code or code_version(),
+    }
+    payload = json.dumps(components, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()[:16], components
+
+
+class ModelRegistry:
+    """Versioned model artifacts in MODEL_REGISTRY_PATH/<version>.
+
+    Each version holds a copy of a training run's artifacts (models, history,
+    charts, training state) and a metadata.json with the fingerprint of what
+    it was trained on. CURRENT names the version in use; it is replaced
+    atomically, so readers always see a complete version.
+    """
+
+    def __init__(self, path=MODEL_REGISTRY_PATH):
+        self.path = Path(path)
+
+    def versions(self) -> list[dict]:
+        """metadata.json of every version, oldest first"""
+        if not self.path.exists():
+            return []
+        versions = []
+        for version_path in sorted(self.path.iterdir()):
+            metadata_path = version_path / "metadata.json"
+            if metadata_path.exists():
+                with open(metadata_path) as f:
+                    versions.append(json.load(f))
+        return versions
+
+    def find(self, fingerprint: str):
+        """Version trained with fingerprint, None if there is none"""
+        for version in self.versions():
+            if version["fingerprint"] == fingerprint:
+                return version["version"]
+        return None
+
+    def current(self):
+        """Version in use, None if nothing was registered yet"""
+        pointer = self.path / "CURRENT"
+        if not pointer.exists():
+            return None
+        return pointer.read_text().strip()
+
+    def set_current(self, version: str):
+        """Point CURRENT to version atomically"""
+        if not (self.path / version / "metadata.json").exists():
+            raise ValueError(f"Unknown model version {version}")
+        staging = self.path / "CURRENT.tmp"
+        staging.write_text(version)
+        os.replace(staging, self.path / "CURRENT")
+        logger.info(f"Current model version: {version}")
+
+    def artifact(self, name: str, version: str = None):
+        """Path of an artifact of version (the current one if None), None if
+        there is no such version"""
+        version = version or self.current()
+        if version is None:
+            return None
+        return self.path / version / name
+
+    def version_of(self, path):
+        """Version of an artifact path, None if it is not in the registry"""
+        path = Path(path).resolve()
+        if path.parent.parent != self.path.resolve():
+            return None
+        return path.parent.name
+
+    def register(
+        self,
+        fingerprint: str,
+        components: dict,
+        files: list,
+        info: dict = None,
+        make_current: bool = True,
+    ) -> str:
+        """Copy a training run's artifacts into a new version.
+
+        Args:
+            files (list): artifact files and directories, copied by name
+            info (dict, optional): extra metadata, e.g. holdout metrics
+
+        Returns:
+            str: the new version, v<number>-<fingerprint>
+        """
+        self.path.mkdir(parents=True, exist_ok=True)
+        number = len([p for p in self.path.iterdir() if p.name.startswith("v")]) + 1
+        version = f"v{number:04d}-{fingerprint[:8]}"
+        # copied next to the registry, then renamed into it in one step
+        staging = self.path / f".{version}.tmp"
+        shutil.rmtree(staging, ignore_errors=True)
+        staging.mkdir()
+        for file in map(Path, files):
+            if file.is_dir():
+                shutil.copytree(file, staging / file.name)
+            elif file.exists():
+                shutil.copy2(file, staging / file.name)
+        with open(staging / "metadata.json", "w") as f:
+            json.dump(
+                {
+                    "version": version,
+                    "fingerprint": fingerprint,
+                    "created": datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
+                    "components": components,
+                    **(info or {}),
+                },
+                f,
+                indent=2,
+            )
+        os.replace(staging, self.path / version)
+        logger.info(f"Registered model version {version}")
+        if make_current:
+            self.set_current(version)
+        return version
+
+
+if __name__ == "__main__":
+    registry = ModelRegistry()
+    current = registry.current()
+    for version in registry.versions():
+        marker = "*" if version["version"] == current else " "
+        print(
+            f"{marker} {version['version']}  {version['created']}  "
+            f"data={version['components']['data']}  "
+            f"features={version['components']['feature_version']}  "
+            f"code={version['components']['code']}"
+        )
@@ -0,0 +1,95 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+import tensorflow as tf
+
+from src.config import ML_LOGGER_PATH
+from src.logger import get_logger
+
+logger = get_logger("MLRuntime", ML_LOGGER_PATH)
+
+# CPU flags of native bfloat16 instructions, without them bfloat16 is emulated
+# and slower than float32
+BFLOAT16_CPU_FLAGS = {"avx512_bf16", "amx_bf16"}
+
+
+def limit_threads(threads: int):
+    """Cap the TensorFlow and OpenMP threads of this process.
+
+    Must run before TensorFlow executes its first op, e.g. as a process pool
+    initializer, otherwise TensorFlow keeps its default thread pools.
+    """
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(threads)
+    except RuntimeError as e:
+        logger.warning(f"TensorFlow threads could not be limited to {threads}: {e}")
+
+
+def configure_performance_threads() -> bool:
+    """One intra-op thread per core and two inter-op threads, for a single
+    training using the whole machine. Like limit_threads, only effective
+    before TensorFlow executes its first op.
+
+    Returns:
+        bool: whether TensorFlow uses them
+    """
+    threads = os.cpu_count() or 1
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(min(2, threads))
+    except RuntimeError as e:
+        logger.warning(f"TensorFlow threads could not be configured: {e}")
+        return False
+    logger.info(f"TensorFlow using {threads} intra-op threads")
+    return True
+
+
+def bfloat16_supported() -> bool:
+    """Whether the CPU has native bfloat16 instructions (Linux /proc/cpuinfo)"""
+    try:
+        with open("/proc/cpuinfo") as f:
+            flags = {
+                flag
+                for line in f
+                if line.startswith("flags")
+                for flag in line.split(":", 1)[1].split()
+            }
+    except OSError:
+        return False
+    return bool(flags & BFLOAT16_CPU_FLAGS)
+
+
+@contextmanager
+def dtype_policy(policy: str = None):
+    """Keras global dtype policy of the layers created inside the block (the
+    current one if None), the previous policy is restored afterwards"""
+    previous = tf.keras.mixed_precision.global_policy()
+    if policy:
+        tf.keras.mixed_precision.set_global_policy(policy)
+    try:
+        yield
+    finally:
+        tf.keras.mixed_precision.set_global_policy(previous)
+
+
+def worker_pool(workers: int, threads: int = None) -> ProcessPoolExecutor:
+    """Process pool for TensorFlow work, each worker limited to threads threads
+    (the CPUs divided between the workers if None) so parallel trainings do not
+    oversubscribe the machine.
+
+    Workers are spawned, not forked: a forked child would inherit the parent's
+    already initialized TensorFlow runtime.
+    """
+    workers = max(1, workers)
+    threads = threads or max(1, (os.cpu_count() or 1) // workers)
+    logger.debug(f"Starting {workers} workers with {threads} threads each")
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=limit_threads,
+        initargs=(threads,),
+    )
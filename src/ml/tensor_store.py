@@ -0,0 +1,885 @@
+import json
+import math
+import os
+import shutil
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import tensorflow as tf
+import zstandard
+
+try:
+    import fcntl
+except ImportError:  # Windows: readers are not tracked
+    fcntl = None
+
+from src.config import (
+    ML_LOGGER_PATH,
+    PROCESSED_TENSORS_PATH,
+    TENSOR_STORE_BLOCK_ROWS,
+    TENSOR_STORE_COMPRESSION,
+    TENSOR_STORE_LAYOUT,
+    TENSOR_STORE_MAX_SHARDS,
+    TENSOR_STORE_MAX_SUPERSEDED,
+    TENSOR_STORE_PATH,
+    TENSOR_STORE_PRECISION,
+    TENSOR_STORE_SHARD_SIZE,
+)
+from src.logger import get_logger
+
+logger = get_logger("MLTensorStore", ML_LOGGER_PATH)
+
+NO_TARGET = -1  # target of matches without a result yet
+SHARD_ARRAYS = {
+    "dense": ["home", "away", "target", "uuid"],
+    "indexed": ["rows", "home", "away", "target", "uuid"],
+}
+# arrays holding feature values, the ones encoded and compressed
+FEATURE_ARRAYS = {"dense": ["home", "away"], "indexed": ["rows"]}
+INT16_DECIMALS = [0, 1, 2]
+
+
+def encode_features(values: list[np.ndarray], precision: str):
+    """Encode float32 feature arrays (..., features) with precision.
+
+    int16 stores round(value * scale) with a per feature scale of 1, 10 or 100,
+    the smallest that represents every value of the feature.
+
+    Returns:
+        tuple: (encoded arrays, scale) or None if a value would not decode to
+            exactly the same float32
+    """
+    if precision == "float32":
+        return values, None
+    if precision == "float16":
+        encoded = [array.astype(np.float16) for array in values]
+        scale = None
+    elif precision == "int16":
+        features = values[0].shape[-1]
+        flat = np.concatenate([array.reshape(-1, features) for array in values])
+        scale = np.zeros(features, dtype=np.float32)
+        for decimals in reversed(INT16_DECIMALS):
+            factor = np.float32(10**decimals)
+            scaled = np.round(flat * factor)
+            fits = (
+                (np.abs(scaled) <= np.iinfo(np.int16).max)
+                & (scaled.astype(np.float32) / factor == flat)
+            ).all(axis=0)
+            scale[fits] = factor
+        if not scale.all():
+            return None
+        encoded = [np.round(array * scale).astype(np.int16) for array in values]
+    else:
+        raise ValueError(f"Unknown tensor store precision {precision}")
+    for array, encoded_array in zip(values, encoded):
+        if decode_features(encoded_array, scale).tobytes() != array.tobytes():
+            return None
+    return encoded, scale
+
+
+def decode_features(encoded: np.ndarray, scale) -> np.ndarray:
+    """float32 values of encode_features output"""
+    values = np.asarray(encoded).astype(np.float32)
+    if scale is not None:
+        values /= np.asarray(scale, dtype=np.float32)
+    return values
+
+
+def load_legacy_tensors(match_uuid: str, path=PROCESSED_TENSORS_PATH):
+    """Read the home, away and target tensors of a per-uuid legacy directory.
+
+    Returns:
+        tuple: (home (n, features), away (n, features), target) numpy arrays,
+            target is NO_TARGET for matches without a result
+    """
+    match_path = path / match_uuid
+    home = tf.io.parse_tensor(
+        tf.io.read_file(str(match_path / "home_tensor.ten")), out_type=tf.float32
+    )
+    away = tf.io.parse_tensor(
+        tf.io.read_file(str(match_path / "away_tensor.ten")), out_type=tf.float32
+    )
+    target = tf.io.parse_tensor(
+        tf.io.read_file(str(match_path / "target_tensor.ten")), out_type=tf.int32
+    ).numpy()
+    return (
+        home.numpy()[0],
+        away.numpy()[0],
+        int(target[0]) if target.size else NO_TARGET,
+    )
+
+
+def read_legacy_tensors(
+    match_uuids: list[str], path=PROCESSED_TENSORS_PATH, workers: int = None
+):
+    """Read many per-uuid legacy directories with a thread pool.
+
+    Tensors are parsed in worker threads (TensorFlow file reads and parsing
+    release the GIL) and written straight into preallocated arrays. Missing or
+    unreadable directories are left out and reported together instead of one
+    log line each.
+
+    Args:
+        workers (int, optional): reader threads, ThreadPoolExecutor's default
+            if None
+
+    Returns:
+        tuple: (read uuids, home (matches, n, features), away, targets, failed),
+            failed maps each unreadable uuid to its error
+    """
+
+    def read(match_uuid):
+        try:
+            return load_legacy_tensors(match_uuid, path)
+        except Exception as e:
+            return e
+
+    read_uuids, targets, failed = [], [], {}
+    home = away = None
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # map yields results in match_uuids order
+        for match_uuid, result in zip(match_uuids, executor.map(read, match_uuids)):
+            if isinstance(result, Exception):
+                failed[match_uuid] = f"{type(result).__name__}: {result}"
+                continue
+            match_home, match_away, target = result
+            if home is None:
+                home = np.empty((len(match_uuids), *match_home.shape), np.float32)
+                away = np.empty_like(home)
+            if match_home.shape != home.shape[1:] or match_away.shape != home.shape[1:]:
+                failed[match_uuid] = f"ValueError: window shape {match_home.shape}"
+                continue
+            home[len(read_uuids)] = match_home
+            away[len(read_uuids)] = match_away
+            read_uuids.append(match_uuid)
+            targets.append(None if target == NO_TARGET else target)
+
+    if failed:
+        reasons = Counter(error.split(":")[0] for error in failed.values())
+        logger.error(
+            f"{len(failed)}/{len(match_uuids)} legacy tensor directories could not be read "
+            f"({', '.join(f'{count} {reason}' for reason, count in reasons.items())}): "
+            f"{', '.join(list(failed)[:10])}{' ...' if len(failed) > 10 else ''}"
+        )
+    if home is None:
+        return read_uuids, None, None, targets, failed
+    return read_uuids, home[: len(read_uuids)], away[: len(read_uuids)], targets, failed
+
+
+class DecodedArray:
+    """Read-only float32 view of an int16/float16 encoded feature array,
+    decoded on access. Slicing returns another view."""
+
+    def __init__(self, data, scale=None):
+        self.data = data
+        self.scale = scale
+        self.dtype = np.dtype(np.float32)
+        self.ndim = data.ndim
+
+    @property
+    def shape(self) -> tuple:
+        return self.data.shape
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return DecodedArray(self.data[key], self.scale)
+        return decode_features(self.data[key], self.scale)
+
+    def __array__(self, dtype=None, copy=None):
+        values = decode_features(self.data[:], self.scale)
+        return values if dtype is None else values.astype(dtype)
+
+
+class CompressedArray:
+    """Read-only array stored as zstd compressed blocks of block_rows rows.
+
+    Only the blocks holding the requested rows are decompressed, the last
+    ones read are kept in memory. Slicing returns another view.
+    """
+
+    cached_blocks = 8
+
+    def __init__(
+        self, path, shape, dtype, block_rows: int, start: int = 0, stop: int = None
+    ):
+        self.path = path
+        self.full_shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.ndim = len(shape)
+        self.block_rows = block_rows
+        self.start = start
+        self.stop = shape[0] if stop is None else stop
+        self.offsets = np.load(path.with_suffix(".blocks.npy"))
+        self.blob = np.memmap(path, dtype=np.uint8, mode="r")
+        self._blocks = {}
+        self._decompressor = zstandard.ZstdDecompressor()
+        # input pipelines read from several threads
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def write(path, array: np.ndarray, block_rows: int = TENSOR_STORE_BLOCK_ROWS):
+        """Compress array in blocks of rows to path, offsets to .blocks.npy"""
+        compressor = zstandard.ZstdCompressor()
+        offsets = [0]
+        with open(path, "wb") as f:
+            for start in range(0, len(array), block_rows):
+                block = np.ascontiguousarray(array[start : start + block_rows])
+                offsets.append(offsets[-1] + f.write(compressor.compress(block)))
+        np.save(path.with_suffix(".blocks.npy"), np.array(offsets, dtype=np.int64))
+
+    @property
+    def shape(self) -> tuple:
+        return (self.stop - self.start, *self.full_shape[1:])
+
+    def __len__(self) -> int:
+        return self.stop - self.start
+
+    def _block(self, block: int) -> np.ndarray:
+        with self._lock:
+            if block not in self._blocks:
+                if len(self._blocks) >= self.cached_blocks:
+                    self._blocks.pop(next(iter(self._blocks)))
+                data = self._decompressor.decompress(
+                    self.blob[self.offsets[block] : self.offsets[block + 1]].tobytes()
+                )
+                self._blocks[block] = np.frombuffer(data, dtype=self.dtype).reshape(
+                    -1, *self.full_shape[1:]
+                )
+            return self._blocks[block]
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step != 1:
+                raise IndexError("CompressedArray slices must have step 1")
+            return CompressedArray(
+                self.path,
+                self.full_shape,
+                self.dtype,
+                self.block_rows,
+                self.start + start,
+                self.start + max(start, stop),
+            )
+        rows = np.asarray(key)
+        rows = np.where(rows < 0, rows + len(self), rows) + self.start
+        flat = rows.reshape(-1)
+        values = np.empty((len(flat), *self.full_shape[1:]), dtype=self.dtype)
+        blocks = flat // self.block_rows
+        for block in np.unique(blocks):
+            in_block = blocks == block
+            values[in_block] = self._block(block)[
+                flat[in_block] - block * self.block_rows
+            ]
+        return values.reshape(*rows.shape, *self.full_shape[1:])
+
+    def __array__(self, dtype=None, copy=None):
+        values = self[np.arange(len(self))]
+        return values if dtype is None else values.astype(dtype)
+
+
+class IndexedWindows:
+    """Read-only (examples, n, features) view of windows stored as int32 row
+    indices into a shared feature matrix. Slicing returns another view;
+    any other indexing gathers the selected windows into a float32 array."""
+
+    def __init__(self, rows: np.ndarray, indices: np.ndarray):
+        self.rows = rows
+        self.indices = indices
+        self.dtype = rows.dtype
+        self.ndim = 3
+
+    @property
+    def shape(self) -> tuple:
+        return (*self.indices.shape, self.rows.shape[1])
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return IndexedWindows(self.rows, self.indices[key])
+        return self.rows[self.indices[key]]
+
+    def __array__(self, dtype=None, copy=None):
+        windows = self.rows[self.indices]
+        return windows if dtype is None else windows.astype(dtype)
+
+
+class GatheredArray:
+    """Read-only view of rows spread over the arrays of several shards, row i
+    being arrays[shards[i]][rows[i]]. Slicing returns another view; any other
+    indexing gathers the selected rows, shard by shard in row order."""
+
+    def __init__(self, arrays: list, shards: np.ndarray, rows: np.ndarray):
+        self.arrays = arrays
+        self.shards = shards
+        self.rows = rows
+        self.dtype = np.dtype(arrays[0].dtype)
+        self.ndim = arrays[0].ndim
+
+    @property
+    def shape(self) -> tuple:
+        return (len(self.rows), *self.arrays[0].shape[1:])
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return GatheredArray(self.arrays, self.shards[key], self.rows[key])
+        shards = np.asarray(self.shards[key])
+        rows = np.asarray(self.rows[key])
+        flat_shards, flat_rows = shards.reshape(-1), rows.reshape(-1)
+        values = np.empty((len(flat_rows), *self.shape[1:]), dtype=self.dtype)
+        for shard in np.unique(flat_shards):
+            positions = np.flatnonzero(flat_shards == shard)
+            order = np.argsort(flat_rows[positions], kind="stable")
+            values[positions[order]] = self.arrays[shard][flat_rows[positions[order]]]
+        return values.reshape(*rows.shape, *self.shape[1:])
+
+    def __array__(self, dtype=None, copy=None):
+        values = self[np.arange(len(self))]
+        return values if dtype is None else values.astype(dtype)
+
+
+class TensorStore:
+    """Consolidated storage of the processed match tensors.
+
+    Every append commits one shard: a directory with home.npy and away.npy
+    (float32, shape (rows, n, features)), target.npy (int32, NO_TARGET for
+    upcoming matches) and uuid.npy. MANIFEST.json lists the committed shards.
+    A shard is written to a temporary directory and renamed, then the manifest
+    is replaced atomically, so readers only see complete commits and a crash
+    leaves at most an orphan directory that the next append removes.
+
+    With the indexed layout, home.npy and away.npy hold (rows, n) int32 indices
+    into rows.npy, the shard's distinct oriented match rows, instead of the
+    windows themselves. Neighbouring windows share most of their matches, so
+    this is roughly an order of magnitude smaller; windows are gathered only
+    when read (see IndexedWindows). Both layouts can coexist in a store.
+
+    Feature arrays (FEATURE_ARRAYS) can be stored as float16 or fixed point
+    int16 when every value round-trips exactly, and compressed in blocks of
+    rows (<key>.zst). The manifest records each shard's encoding; reads decode
+    to float32 on access (see DecodedArray and CompressedArray).
+
+    The uuid -> (shard, row) index is built from the uuid arrays; when a match
+    appears in several shards the latest one wins. Shards are read through
+    np.load(mmap_mode="r"), so only the requested rows are paged in.
+
+    There must be a single writer at a time. An instance that read the store
+    holds a shared lock on its directory until close(), so maybe_compact does
+    not remove shards another process still maps.
+    """
+
+    def __init__(
+        self,
+        path=TENSOR_STORE_PATH,
+        layout: str = TENSOR_STORE_LAYOUT,
+        precision: str = TENSOR_STORE_PRECISION,
+        compression: str = TENSOR_STORE_COMPRESSION,
+    ):
+        if layout not in SHARD_ARRAYS:
+            raise ValueError(f"Unknown tensor store layout {layout}")
+        if compression not in (None, "zstd"):
+            raise ValueError(f"Unknown tensor store compression {compression}")
+        self.path = path
+        self.layout = layout
+        self.precision = precision
+        self.compression = compression
+        self._index = None
+        self._shards = {}
+        self._reader_lock = None
+
+    # ------------------------------------------------------------------
+    # Readers
+    # ------------------------------------------------------------------
+    def _register_reader(self):
+        """Hold a shared lock on the store directory, waiting for a running
+        maybe_compact to finish"""
+        if fcntl is None or self._reader_lock is not None or not self.path.exists():
+            return
+        self._reader_lock = os.open(self.path, os.O_RDONLY)
+        fcntl.flock(self._reader_lock, fcntl.LOCK_SH)
+
+    def close(self):
+        """Release the reader lock, arrays already mapped stay readable"""
+        if self._reader_lock is not None:
+            os.close(self._reader_lock)
+            self._reader_lock = None
+
+    def __del__(self):
+        self.close()
+
+    # ------------------------------------------------------------------
+    # Manifest
+    # ------------------------------------------------------------------
+    def manifest(self) -> dict:
+        """Committed shards of the store"""
+        manifest_path = self.path / "MANIFEST.json"
+        if not manifest_path.exists():
+            return {"shards": [], "next_shard": 0}
+        with open(manifest_path) as f:
+            return json.load(f)
+
+    def _commit_manifest(self, manifest: dict):
+        self.path.mkdir(parents=True, exist_ok=True)
+        staging = self.path / "MANIFEST.json.tmp"
+        with open(staging, "w") as f:
+            json.dump(manifest, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(staging, self.path / "MANIFEST.json")
+        self._index = None
+        self._shards = {}
+
+    def _remove_orphans(self, manifest: dict):
+        """Delete shard directories left by an interrupted commit"""
+        if not self.path.exists():
+            return
+        committed = {shard["name"] for shard in manifest["shards"]}
+        for path in self.path.iterdir():
+            if path.is_dir() and path.name not in committed:
+                logger.warning(f"Removing uncommitted shard {path.name}")
+                shutil.rmtree(path, ignore_errors=True)
+
+    # ------------------------------------------------------------------
+    # Writes
+    # ------------------------------------------------------------------
+    def _write_shard(self, manifest: dict, arrays: dict) -> dict:
+        name = f"shard-{manifest['next_shard']:06d}"
+        shard = {"name": name, "rows": len(arrays["uuid"]), "layout": self.layout}
+        feature_keys = FEATURE_ARRAYS[self.layout]
+        encoded = encode_features([arrays[key] for key in feature_keys], self.precision)
+        if encoded is None:
+            logger.warning(
+                f"Features of {name} do not round-trip as {self.precision}, stored as float32"
+            )
+        else:
+            arrays.update(zip(feature_keys, encoded[0]))
+            shard["precision"] = self.precision
+            if encoded[1] is not None:
+                shard["scale"] = encoded[1].tolist()
+
+        staging = self.path / f".{name}.tmp"
+        staging.mkdir(parents=True)
+        for key in SHARD_ARRAYS[self.layout]:
+            if self.compression == "zstd" and key in feature_keys:
+                CompressedArray.write(staging / f"{key}.zst", arrays[key])
+                shard.setdefault("compressed", {})[key] = {
+                    "shape": list(arrays[key].shape),
+                    "dtype": arrays[key].dtype.str,
+                    "block_rows": TENSOR_STORE_BLOCK_ROWS,
+                }
+            else:
+                np.save(staging / f"{key}.npy", arrays[key])
+        os.replace(staging, self.path / name)
+        manifest["next_shard"] += 1
+        return shard
+
+    @staticmethod
+    def _index_windows(home: np.ndarray, away: np.ndarray):
+        """Distinct rows of the home and away windows, and the windows as
+        int32 indices into them. Rows are compared bytewise, so gathering
+        the indices gives back exactly the same windows"""
+        examples, n, features = home.shape
+        stacked = np.ascontiguousarray(
+            np.concatenate([home, away]).reshape(-1, features)
+        )
+        row_bytes = stacked.view(np.dtype((np.void, stacked.dtype.itemsize * features)))
+        _, first, inverse = np.unique(
+            row_bytes.ravel(), return_index=True, return_inverse=True
+        )
+        indices = inverse.reshape(2, examples, n).astype(np.int32)
+        return stacked[first], indices[0], indices[1]
+
+    def _shard_arrays(self, uuids, home, away, targets) -> dict:
+        arrays = {
+            "home": np.asarray(home, dtype=np.float32),
+            "away": np.asarray(away, dtype=np.float32),
+            "target": np.array(
+                [NO_TARGET if target is None else target for target in targets],
+                dtype=np.int32,
+            ),
+            "uuid": np.asarray(uuids, dtype=str),
+        }
+        if self.layout == "indexed":
+            arrays["rows"], arrays["home"], arrays["away"] = self._index_windows(
+                arrays["home"], arrays["away"]
+            )
+        return arrays
+
+    def append(self, uuids, home, away, targets):
+        """Commit the tensors of the given matches as a new shard.
+
+        Args:
+            uuids (list[str]): match_uuid of every row
+            home (np.ndarray): (rows, n, features) home team windows
+            away (np.ndarray): (rows, n, features) away team windows
+            targets (list): target of every row, None for upcoming matches
+
+        Returns:
+            str: name of the committed shard, None if there was nothing to write
+        """
+        if len(uuids) == 0:
+            return None
+        manifest = self.manifest()
+        self._remove_orphans(manifest)
+        shard = self._write_shard(
+            manifest, self._shard_arrays(uuids, home, away, targets)
+        )
+        manifest["shards"].append(shard)
+        self._commit_manifest(manifest)
+        logger.info(f"Committed {shard['rows']} matches to {shard['name']}")
+        return shard["name"]
+
+    def compact(self, order: list[str] = None):
+        """Rewrite every shard into a single one, dropping superseded rows.
+
+        Args:
+            order (list[str], optional): uuids to lay out first, in this order
+        """
+        manifest = self.manifest()
+        rows = sum(shard["rows"] for shard in manifest["shards"])
+        if order is None and len(manifest["shards"]) <= 1 and rows == len(self):
+            return
+        index = self._load_index()
+        uuids = [uuid for uuid in order or [] if uuid in index]
+        first = set(uuids)
+        uuids += [uuid for uuid in index if uuid not in first]
+        home, away, targets, _ = self.load(uuids)
+        old_shards = [shard["name"] for shard in manifest["shards"]]
+        shard = self._write_shard(
+            manifest, self._shard_arrays(uuids, home, away, targets)
+        )
+        manifest["shards"] = [shard]
+        self._commit_manifest(manifest)
+        # processes still mapping the old files keep reading them until closed
+        for name in old_shards:
+            shutil.rmtree(self.path / name, ignore_errors=True)
+        logger.info(f"Compacted {len(old_shards)} shards into {shard['name']}")
+
+    def maybe_compact(
+        self,
+        max_shards: int = TENSOR_STORE_MAX_SHARDS,
+        max_superseded: float = TENSOR_STORE_MAX_SUPERSEDED,
+    ) -> bool:
+        """Compact the store once it has more than max_shards shards or a
+        larger share of superseded rows than max_superseded, unless another
+        process reads it.
+
+        Every incremental preprocessing run appends a shard and supersedes the
+        rows it rebuilds, so reads spread over more and more files. Compacting
+        only past a threshold rewrites the live rows once every few runs
+        instead of on every one. Readers are tracked on POSIX systems only,
+        elsewhere the caller must make sure none is running.
+
+        Returns:
+            bool: whether the store was compacted
+        """
+        manifest = self.manifest()
+        rows = sum(shard["rows"] for shard in manifest["shards"])
+        if rows == 0:
+            return False
+        superseded = 1 - len(self) / rows
+        if len(manifest["shards"]) <= max_shards and superseded <= max_superseded:
+            return False
+        if fcntl is not None:
+            self.close()
+            self._reader_lock = os.open(self.path, os.O_RDONLY)
+            try:
+                fcntl.flock(self._reader_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                self.close()
+                logger.info(f"{self.path} is being read, compaction postponed")
+                return False
+        try:
+            self.compact()
+        finally:
+            if fcntl is not None:
+                fcntl.flock(self._reader_lock, fcntl.LOCK_SH)
+        return True
+
+    # ------------------------------------------------------------------
+    # Reads
+    # ------------------------------------------------------------------
+    def _load_array(self, shard: dict, key: str):
+        """Array key of a shard, decoded and decompressed on access if needed"""
+        path = self.path / shard["name"]
+        if key in shard.get("compressed", {}):
+            array = CompressedArray(path / f"{key}.zst", **shard["compressed"][key])
+        else:
+            array = np.load(path / f"{key}.npy", mmap_mode="r")
+        if key in FEATURE_ARRAYS[shard.get("layout", "dense")] and shard.get(
+            "precision", "float32"
+        ) not in ("float32", None):
+            array = DecodedArray(array, shard.get("scale"))
+        return array
+
+    def _shard(self, name: str) -> dict:
+        if name not in self._shards:
+            shard = next(
+                shard for shard in self.manifest()["shards"] if shard["name"] == name
+            )
+            layout = shard.get("layout", "dense")
+            arrays = {
+                key: self._load_array(shard, key)
+                for key in SHARD_ARRAYS[layout]
+                if key != "uuid"
+            }
+            if layout == "indexed":
+                rows = arrays.pop("rows")
+                arrays["home"] = IndexedWindows(rows, arrays["home"])
+                arrays["away"] = IndexedWindows(rows, arrays["away"])
+            self._shards[name] = arrays
+        return self._shards[name]
+
+    def _load_index(self) -> dict:
+        """uuid -> (shard, row), later shards overriding earlier ones"""
+        if self._index is None:
+            self._register_reader()
+            index = {}
+            for shard in self.manifest()["shards"]:
+                uuids = np.load(self.path / shard["name"] / "uuid.npy")
+                index.update(
+                    {uuid: (shard["name"], row) for row, uuid in enumerate(uuids)}
+                )
+            self._index = index
+        return self._index
+
+    def __contains__(self, match_uuid: str) -> bool:
+        return match_uuid in self._load_index()
+
+    def __len__(self) -> int:
+        return len(self._load_index())
+
+    def uuids(self) -> list[str]:
+        return list(self._load_index())
+
+    def get(self, match_uuid: str):
+        """(home (1, n, features), away (1, n, features), target) of a match,
+        or None if it is not in the store"""
+        location = self._load_index().get(match_uuid)
+        if location is None:
+            return None
+        shard = self._shard(location[0])
+        row = location[1]
+        return (
+            np.array(shard["home"][row : row + 1]),
+            np.array(shard["away"][row : row + 1]),
+            int(shard["target"][row]),
+        )
+
+    def load(self, uuids):
+        """Tensors of many matches, in the order of uuids.
+
+        Returns:
+            tuple: (home, away, targets, missing). Arrays only hold the matches
+                found in the store; missing lists the uuids that are not
+        """
+        index = self._load_index()
+        found = [uuid for uuid in uuids if uuid in index]
+        missing = [uuid for uuid in uuids if uuid not in index]
+        if not found:
+            return None, None, None, missing
+
+        locations = [index[uuid] for uuid in found]
+        first = self._shard(locations[0][0])
+        home = np.empty((len(found), *first["home"].shape[1:]), dtype=np.float32)
+        away = np.empty_like(home)
+        targets = np.empty(len(found), dtype=np.int32)
+
+        by_shard = {}
+        for position, (name, row) in enumerate(locations):
+            by_shard.setdefault(name, ([], []))
+            by_shard[name][0].append(position)
+            by_shard[name][1].append(row)
+        for name, (positions, rows) in by_shard.items():
+            shard = self._shard(name)
+            # read each shard in row order, then scatter to the output order
+            order = np.argsort(rows)
+            positions = np.asarray(positions)[order]
+            rows = np.asarray(rows)[order]
+            home[positions] = shard["home"][rows]
+            away[positions] = shard["away"][rows]
+            targets[positions] = shard["target"][rows]
+        return home, away, targets, missing
+
+    def open_memmap(self, uuids: list[str]):
+        """Memory-map the tensors of uuids as (N, n, features) arrays.
+
+        The returned arrays are read-only views of the shard files, the store
+        is never rewritten: opening them only builds the uuid index, pages are
+        loaded on access and every process mapping the store shares one copy
+        in the page cache. When uuids are consecutive rows of one shard, e.g.
+        after compact(order=uuids), they are plain slices of its arrays;
+        otherwise they are GatheredArray views over every shard holding them,
+        gathered batch by batch. With the indexed layout, windows are
+        IndexedWindows over the mapped files.
+
+        Returns:
+            tuple: (home, away, targets, missing), arrays only hold the matches
+                found in the store, in the order of uuids
+        """
+        index = self._load_index()
+        found = [uuid for uuid in uuids if uuid in index]
+        missing = [uuid for uuid in uuids if uuid not in index]
+        if not found:
+            return None, None, None, missing
+
+        names = sorted({index[uuid][0] for uuid in found})
+        shards = np.array([names.index(index[uuid][0]) for uuid in found])
+        rows = np.array([index[uuid][1] for uuid in found])
+        if len(names) == 1 and np.all(rows == rows[0] + np.arange(len(rows))):
+            shard = self._shard(names[0])
+            block = slice(rows[0], rows[0] + len(rows))
+            return (
+                shard["home"][block],
+                shard["away"][block],
+                shard["target"][block],
+                missing,
+            )
+        arrays = [self._shard(name) for name in names]
+        return (
+            GatheredArray([shard["home"] for shard in arrays], shards, rows),
+            GatheredArray([shard["away"] for shard in arrays], shards, rows),
+            GatheredArray([shard["target"] for shard in arrays], shards, rows),
+            missing,
+        )
+
+    # ------------------------------------------------------------------
+    # Migration
+    # ------------------------------------------------------------------
+    @staticmethod
+    def legacy_uuids(legacy_path=PROCESSED_TENSORS_PATH) -> list[str]:
+        """match_uuid of every per-uuid tensor directory"""
+        if not legacy_path.exists():
+            return []
+        return sorted(
+            path.name
+            for path in legacy_path.iterdir()
+            if path.is_dir() and (path / "home_tensor.ten").exists()
+        )
+
+    def migrate_legacy(
+        self,
+        legacy_path=PROCESSED_TENSORS_PATH,
+        shard_size: int = TENSOR_STORE_SHARD_SIZE,
+        remove: bool = False,
+        workers: int = None,
+    ) -> dict:
+        """Move the per-uuid tensor directories into the store.
+
+        Matches already in the store are skipped. Every chunk of shard_size
+        matches is read in parallel by read_legacy_tensors and is one commit,
+        so an interrupted migration resumes where it stopped. With remove=True,
+        legacy directories are deleted once their chunk is committed;
+        unreadable ones are kept.
+
+        Returns:
+            dict: number of migrated matches and uuids that could not be read
+        """
+        pending = [uuid for uuid in self.legacy_uuids(legacy_path) if uuid not in self]
+        migrated, failed = 0, []
+        for start in range(0, len(pending), shard_size):
+            chunk, home, away, targets, chunk_failed = read_legacy_tensors(
+                pending[start : start + shard_size], legacy_path, workers
+            )
+            failed.extend(chunk_failed)
+            if chunk:
+                self.append(chunk, home, away, targets)
+                migrated += len(chunk)
+            if remove:
+                for match_uuid in chunk:
+                    shutil.rmtree(legacy_path / match_uuid, ignore_errors=True)
+            logger.info(f"Migrated {migrated}/{len(pending)} legacy tensor directories")
+
+        if failed:
+            logger.error(
+                f"{len(failed)} legacy tensor directories could not be migrated"
+            )
+        return {"migrated": migrated, "failed": failed}
+
+
+def window_dataset(
+    home,
+    away,
+    targets,
+    batch_size: int = 32,
+    shuffle: bool = False,
+    cache=False,
+    block_rows: int = 1024,
+    shuffle_buffer: int = 10_000,
+) -> tf.data.Dataset:
+    """tf.data pipeline of ((home, away), target) batches over store arrays
+    (memory maps, IndexedWindows or decoded views).
+
+    Blocks of block_rows consecutive rows are read in parallel
+    (map(num_parallel_calls=AUTOTUNE), in order unless shuffled) and split into
+    examples, then optionally cached, shuffled within these arrays only,
+    batched and prefetched. Without cache at most a
+    few blocks and the shuffle buffer are in memory at once.
+
+    Args:
+        shuffle (bool): Shuffle the block order and, through a buffer of
+            shuffle_buffer examples, the examples every epoch
+        cache (bool or str): Cache the decoded examples after the first epoch,
+            in memory (True) or in files with this prefix (str)
+    """
+    rows = len(targets)
+    sequence_length, features = home.shape[1:]
+
+    def read_block(block):
+        block_slice = slice(block * block_rows, min((block + 1) * block_rows, rows))
+        return (
+            np.asarray(home[block_slice], dtype=np.float32),
+            np.asarray(away[block_slice], dtype=np.float32),
+            np.asarray(targets[block_slice], dtype=np.int32),
+        )
+
+    def block_examples(block):
+        block_home, block_away, block_targets = tf.numpy_function(
+            read_block, [block], [tf.float32, tf.float32, tf.int32]
+        )
+        block_home.set_shape([None, sequence_length, features])
+        block_away.set_shape([None, sequence_length, features])
+        block_targets.set_shape([None])
+        return (block_home, block_away), block_targets
+
+    blocks = tf.data.Dataset.range(math.ceil(rows / block_rows))
+    if shuffle and not cache:
+        # a cached pipeline must produce the same examples every epoch
+        blocks = blocks.shuffle(math.ceil(rows / block_rows))
+    dataset = blocks.map(
+        block_examples,
+        num_parallel_calls=tf.data.AUTOTUNE,
+        deterministic=not shuffle or bool(cache),
+    ).unbatch()
+    # known length, so Keras shows progress and does not warn at epoch end
+    dataset = dataset.apply(tf.data.experimental.assert_cardinality(rows))
+    if cache:
+        dataset = dataset.cache("" if cache is True else cache)
+    if shuffle:
+        dataset = dataset.shuffle(min(shuffle_buffer, rows))
+    return dataset.batch(batch_size).prefetch(tf.data.AUTOTUNE)
+
+
+if __name__ == "__main__":
+    import sys
+
+    from src.ml.feature_cache import FeatureCache
+
+    # adopt the store written before feature versions and move the per-uuid
+    # tensor directories of older versions into the default feature version,
+    # deleting them only with --remove, then rewrite it with the configured
+    # layout and encoding
+    cache = FeatureCache()
+    cache.adopt_store()
+    store = cache.store()
+    store.migrate_legacy(remove="--remove" in sys.argv)
+    store.compact(order=store.uuids())
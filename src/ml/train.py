@@ -1,66 +1,137 @@
+import json
+import os
+from datetime import datetime, timezone
+
 import matplotlib.pyplot as plt
 import seaborn as sns
+import numpy as np
 import pandas as pd
 import tensorflow as tf
 from src.data.database import DatabaseManager
 from src.logger import get_logger
 from src.config import (
+    DEFAULT_WINDOW_SIZE,
+    INCREMENTAL_EPOCHS,
+    INCREMENTAL_HOLDOUT_SHARE,
+    INCREMENTAL_LEARNING_RATE,
+    INCREMENTAL_MAX_REGRESSION,
+    INCREMENTAL_REPLAY_RATIO,
     ML_LOGGER_PATH,
+    TRAINING_PROFILE_PATH,
+    TRAINING_STATE_PATH,
     PREDICT_METADATA_TABLE,
-    PROCESSED_TENSORS_PATH,
-    MODEL_ARTIFACTS_PATH,
     MODEL_ARTIFACTS_PATH,
 )
-from src.ml.models import HybridTransformerModel
+from src.ml.models import HybridTransformerModel, compile_model
+from src.ml.feature_cache import FeatureCache
+from src.ml.profiler import TrainingProfiler
+from src.ml.registry import ModelRegistry, data_version, training_fingerprint
+from src.ml.runtime import (
+    bfloat16_supported,
+    configure_performance_threads,
+    dtype_policy,
+)
+from src.ml.tensor_store import window_dataset
 
 logger = get_logger("MLTrainer", ML_LOGGER_PATH)
 
+# files of a training run copied into its registry version
+MODEL_ARTIFACTS = [
+    MODEL_ARTIFACTS_PATH / "best_model.keras",
+    MODEL_ARTIFACTS_PATH / "final_model.keras",
+    MODEL_ARTIFACTS_PATH / "model_architecture.json",
+    MODEL_ARTIFACTS_PATH / "model_architecture.png",
+    MODEL_ARTIFACTS_PATH / "model_summary.txt",
+    MODEL_ARTIFACTS_PATH / "training_history.csv",
+    TRAINING_PROFILE_PATH,
+    MODEL_ARTIFACTS_PATH / "charts",
+    TRAINING_STATE_PATH,
+]
+
+
+def compiled_model(
+    sequence_length: int,
+    num_features: int,
+    num_classes: int,
+    normalize_inputs: bool = True,
+    learning_rate: float = 0.001,
+    performance: bool = False,
+    **hyperparameters,
+) -> HybridTransformerModel:
+    """HybridTransformerModel compiled for match outcome classification.
+    hyperparameters are HybridTransformerModel arguments (num_heads,
+    dense_units, dropout_rates), its defaults if not given.
+
+    With performance=True the model is built with the mixed_bfloat16 policy
+    (bfloat16 computations, float32 weights and softmax output) on CPUs with
+    native bfloat16 instructions, and XLA compiled otherwise.
+    """
+    policy = "mixed_bfloat16" if performance and bfloat16_supported() else None
+    with dtype_policy(policy):
+        model = HybridTransformerModel(
+            sequence_length=sequence_length,
+            num_features=num_features,
+            num_classes=num_classes,
+            normalize_inputs=normalize_inputs,
+            **hyperparameters,
+        )
+    if policy:
+        # probabilities in bfloat16 would round to ~3 significant digits
+        outputs = model(
+            [tf.zeros((1, sequence_length, num_features), dtype=tf.float32)] * 2
+        )
+        if outputs.dtype != tf.float32:
+            raise TypeError(f"{policy} model outputs {outputs.dtype}, not float32")
+        logger.info(f"Model built with the {policy} policy")
+    return compile_model(model, learning_rate, performance)
+
 
 class MLTrainer:
-    def __init__(self):
+    def __init__(
+        self,
+        n: int = DEFAULT_WINDOW_SIZE,
+        features: list[str] = None,
+        standardize: bool = False,
+    ):
         self.db = DatabaseManager()
+        self.n = n  # window size of the feature version to train on
+        self.features = features  # its feature columns, None for all of them
+        self.standardize = standardize  # its tensors are standardized
+        self.cache = FeatureCache()
+        self.store = self.cache.store(n, features, standardize)
+        self.registry = ModelRegistry()
 
     def load_data(self):
-        """Load tensors from processed_tensors directory"""
+        """Memory-map the training tensors of the tensor store"""
         # TODO: add parameter to load model based on dates
         try:
             match_uuid_df = self.db.get_dataframe(
-                f"SELECT match_uuid FROM {PREDICT_METADATA_TABLE} WHERE type = 'training'"
+                f"SELECT match_uuid FROM {PREDICT_METADATA_TABLE} WHERE type = 'training' ORDER BY date ASC",
+                include_archives=True,
+            )
+            # read-only memory maps of the store, shared with other processes
+            home, away, target, missing = self.store.open_memmap(
+                match_uuid_df["match_uuid"].tolist()
             )
-            home_tensors = []
-            away_tensors = []
-            target_tensors = []
-            for match_uuid in match_uuid_df["match_uuid"]:
-                path = PROCESSED_TENSORS_PATH / match_uuid
-                if path.exists():
-                    home_serialized = tf.io.read_file(
-                        str(PROCESSED_TENSORS_PATH / match_uuid / "home_tensor.ten")
-                    )
-                    away_serialized = tf.io.read_file(
-                        str(PROCESSED_TENSORS_PATH / match_uuid / "away_tensor.ten")
-                    )
-                    target_serialized = tf.io.read_file(
-                        str(PROCESSED_TENSORS_PATH / match_uuid / "target_tensor.ten")
-                    )
-                    home_tensor_temp = tf.io.parse_tensor(
-                        home_serialized, out_type=tf.float32
-                    )
-                    away_tensor_temp = tf.io.parse_tensor(
-                        away_serialized, out_type=tf.float32
-                    )
-                    target_tensor_temp = tf.io.parse_tensor(
-                        target_serialized, out_type=tf.int32
-                    )
-
-                    home_tensors.append(home_tensor_temp)
-                    away_tensors.append(away_tensor_temp)
-                    target_tensors.append(target_tensor_temp)
-
-            # Concatenate all collected tensors
-            if home_tensors:
-                self.home_tensor = tf.concat(home_tensors, axis=0)
-                self.away_tensor = tf.concat(away_tensors, axis=0)
-                self.target_tensor = tf.concat(target_tensors, axis=0)
+            # version.json of the feature version: fingerprint and change_id
+            self.feature_version = self.cache.touch(
+                self.n, self.features, self.standardize
+            )
+            # uuids of the loaded rows, in order
+            missing_uuids = set(missing)
+            self.match_uuids = [
+                uuid
+                for uuid in match_uuid_df["match_uuid"]
+                if uuid not in missing_uuids
+            ]
+            if missing:
+                logger.warning(
+                    f"{len(missing)} training matches have no tensors in the store"
+                )
+            if home is not None:
+                self.home_tensor = home
+                self.away_tensor = away
+                self.target_tensor = target
             logger.info(
                 f"Tensors loaded successfully:\nhome: {self.home_tensor.shape}\naway:{self.away_tensor.shape}\ntarget {self.target_tensor.shape}"
             )
@@ -73,6 +144,7 @@ class MLTrainer:
             total_samples = self.home_tensor.shape[0]
             # Calculate test split indice
             test_split_idx = int(total_samples * (1 - test_size))
+            self.test_split_idx = test_split_idx
 
             # Split data
             self.home_tensor_train = self.home_tensor[:test_split_idx]
@@ -90,43 +162,76 @@ class MLTrainer:
         except Exception as e:
             logger.error(f"Error splitting data: {e}")
 
-    def train_model(self, epochs: int = 30, batch_size: int = 32):
-        """Train model"""
+    def train_model(
+        self,
+        epochs: int = 30,
+        batch_size: int = 32,
+        hyperparameters: dict = None,
+        performance: bool = False,
+        profile_steps: tuple[int, int] = None,
+    ):
+        """Train model
+
+        Args:
+            hyperparameters (dict, optional): model hyperparameters and
+                learning_rate, e.g. the best configuration of a search
+            performance (bool, optional): CPU performance mode, XLA and
+                bfloat16 mixed precision where supported. Threads for every
+                core are configured by training_pipeline, before the first op
+            profile_steps (tuple, optional): first and last training steps
+                captured as a tf.profiler trace
+        """
         # TODO: add boolean argument to train saved or new model
-        # Create model
-        self.model = HybridTransformerModel(
+        # Create and compile model
+        self.model = compiled_model(
             sequence_length=self.home_tensor.shape[1],
             num_features=self.home_tensor.shape[2],
-            num_classes=len(tf.unique(self.target_tensor).y),
+            num_classes=len(np.unique(self.target_tensor)),
+            # standardized tensors need no input batch normalization
+            normalize_inputs=not self.standardize,
+            performance=performance,
+            **(hyperparameters or {}),
         )
+        logger.info("Model compiled successfully")
 
         # Save model architecture image (this should be in MLTrainer)
         architecture_path = MODEL_ARTIFACTS_PATH / "model_architecture.png"
         self._save_model_architecture_image(self.model.build_model(), architecture_path)
         logger.info(f"Model architecture saved to {architecture_path}")
-        # Compile model
-        self.model.compile(
-            optimizer="adam",
-            loss="sparse_categorical_crossentropy",
-            metrics=["accuracy"],
-        )
-        logger.info("Model compiled successfully")
 
         # Train the model
         logger.info("Starting model training...")
-        self.history = self.model.fit(
-            [self.home_tensor_train, self.away_tensor_train],
-            self.target_tensor_train,
+        # last 20% of the training data for validation, like validation_split
+        val_split_idx = int(self.home_tensor_train.shape[0] * 0.8)
+        train_dataset = window_dataset(
+            self.home_tensor_train[:val_split_idx],
+            self.away_tensor_train[:val_split_idx],
+            self.target_tensor_train[:val_split_idx],
             batch_size=batch_size,
+            shuffle=True,
+        )
+        val_dataset = window_dataset(
+            self.home_tensor_train[val_split_idx:],
+            self.away_tensor_train[val_split_idx:],
+            self.target_tensor_train[val_split_idx:],
+            batch_size=batch_size,
+            cache=True,
+        )
+        self.history = self.model.fit(
+            train_dataset,
+            validation_data=val_dataset,
             epochs=epochs,
-            validation_split=0.2,
-            callbacks=self._callbacks(),
+            callbacks=self._callbacks(train_dataset, val_split_idx, profile_steps),
             verbose=1,
         )
 
-    def _callbacks(self):
+    def _callbacks(self, train_dataset=None, samples=0, profile_steps=None):
         # Define callbacks
+        self.profiler = TrainingProfiler(
+            samples, train_dataset, profile_steps=profile_steps
+        )
         self.callbacks = [
+            self.profiler,
             tf.keras.callbacks.EarlyStopping(
                 monitor="val_loss", patience=10, restore_best_weights=True, verbose=1
             ),
@@ -195,8 +300,12 @@ class MLTrainer:
             history_df.to_csv(history_csv_path, index=False)
             logger.info(f"Training history CSV saved to {history_csv_path}")
 
+            # Save per epoch performance of the training run
+            profile_df = self.profiler.save()
+
             # Create and save charts from training history
             self._save_charts_from_history(history_df)
+            self._create_performance_chart(profile_df)
 
         except Exception as e:
             logger.error(f"Error saving metrics: {e}")
@@ -245,6 +354,68 @@ class MLTrainer:
         except Exception as e:
             logger.error(f"Error creating charts: {e}")
 
+    def _create_performance_chart(
+        self, profile_df, chart_dir=MODEL_ARTIFACTS_PATH / "charts"
+    ):
+        """Create an overview chart of the training run's performance: epoch
+        time split, throughput, input pipeline ratio and memory"""
+        try:
+            import matplotlib.pyplot as plt
+
+            if profile_df.empty:
+                return
+            chart_dir.mkdir(parents=True, exist_ok=True)
+            fig, axes = plt.subplots(2, 2, figsize=(10, 8))
+            axes = axes.flatten()
+            epoch = profile_df["epoch"]
+
+            # Epoch wall time, stacked by where it was spent
+            axes[0].stackplot(
+                epoch,
+                profile_df["step_seconds"],
+                profile_df["validation_seconds"],
+                profile_df["host_seconds"],
+                labels=["Train steps", "Validation", "Host"],
+                alpha=0.8,
+            )
+            axes[0].set_title("Epoch Time", fontweight="bold")
+            axes[0].set_ylabel("Seconds")
+
+            axes[1].plot(epoch, profile_df["samples_per_second"], linewidth=2)
+            axes[1].set_title("Throughput", fontweight="bold")
+            axes[1].set_ylabel("Samples / Second")
+
+            axes[2].plot(epoch, profile_df["input_ratio"], linewidth=2)
+            axes[2].axhline(1, color="grey", linestyle="--", alpha=0.6)
+            axes[2].set_title("Input Pipeline / Step Time", fontweight="bold")
+            axes[2].set_ylabel("Ratio")
+
+            axes[3].plot(
+                epoch, profile_df["peak_rss_mb"], label="Peak RSS", linewidth=2
+            )
+            axes[3].plot(
+                epoch, profile_df["tf_peak_mb"], label="TF allocator peak", linewidth=2
+            )
+            axes[3].set_title("Memory", fontweight="bold")
+            axes[3].set_ylabel("MB")
+
+            for ax in axes:
+                ax.set_xlabel("Epoch")
+                ax.grid(True, alpha=0.3)
+            axes[0].legend()
+            axes[3].legend()
+            plt.tight_layout()
+
+            performance_path = chart_dir / "training_performance_overview.png"
+            plt.savefig(
+                performance_path, dpi=300, bbox_inches="tight", facecolor="white"
+            )
+            plt.close()
+            logger.info(f"Performance overview saved to {performance_path}")
+
+        except Exception as e:
+            logger.error(f"Error creating performance chart: {e}")
+
     def _create_single_metric_chart(self, melted_df, metric_name, chart_dir):
         """Create a single chart for a specific metric"""
         import matplotlib.pyplot as plt
@@ -379,12 +550,270 @@ class MLTrainer:
             plt.close()
             logger.info(f"Learning rate chart saved to {lr_path}")
 
-    def training_pipeline(self, epochs: int = 30, batch_size: int = 32):
+    def evaluate(self, model, rows, batch_size: int = 32) -> dict:
+        """Loss and accuracy of model on the loaded rows at positions rows"""
+        rows = np.sort(np.asarray(rows, dtype=np.intp))
+        loss, accuracy = model.evaluate(
+            window_dataset(
+                self.home_tensor[rows],
+                self.away_tensor[rows],
+                self.target_tensor[rows],
+                batch_size=batch_size,
+            ),
+            verbose=0,
+        )
+        return {"loss": float(loss), "accuracy": float(accuracy)}
+
+    def save_training_state(
+        self,
+        trained: list[str],
+        holdout: list[str],
+        metrics: dict,
+        path=TRAINING_STATE_PATH,
+    ):
+        """Record the matches the served model was trained on and its holdout
+        matches with their metrics, the watermark of incremental training"""
+        state = {
+            "updated": datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
+            "n": self.n,
+            "features": self.features,
+            "standardize": self.standardize,
+            "holdout_metrics": metrics,
+            "trained": trained,
+            "holdout": holdout,
+        }
+        staging = path.with_suffix(".tmp")
+        with open(staging, "w") as f:
+            json.dump(state, f)
+        os.replace(staging, path)
+        logger.info(
+            f"Training state saved to {path}: {len(trained)} trained, {len(holdout)} holdout matches"
+        )
+
+    def load_training_state(self, path=TRAINING_STATE_PATH):
+        """Training state of the served model, None if there is none for this
+        feature version"""
+        if not path.exists():
+            return None
+        with open(path) as f:
+            state = json.load(f)
+        if (state["n"], state["features"], state["standardize"]) != (
+            self.n,
+            self.features,
+            self.standardize,
+        ):
+            return None
+        return state
+
+    def training_fingerprint(self, config: dict) -> tuple[str, dict]:
+        """Fingerprint of a training run on the loaded data with config, and
+        its components"""
+        return training_fingerprint(
+            data_version(
+                self.match_uuids,
+                self.target_tensor,
+                self.feature_version.get("change_id"),
+            ),
+            self.feature_version["fingerprint"],
+            config,
+        )
+
+    def training_pipeline(
+        self,
+        epochs: int = 30,
+        batch_size: int = 32,
+        hyperparameters: dict = None,
+        performance: bool = False,
+        profile_steps: tuple[int, int] = None,
+    ):
+        """Train a model on every training match and register it as the current
+        model version. Skipped when a version was already trained on the same
+        data, feature version, configuration and code; that version is made
+        current instead. profile_steps are captured as a tf.profiler trace,
+        see TrainingProfiler. With performance=True, TensorFlow threads are
+        configured first, they cannot change once it executed an op.
+
+        Returns:
+            str: the model version
+        """
+        if performance:
+            configure_performance_threads()
         self.load_data()
+        fingerprint, components = self.training_fingerprint(
+            {
+                "epochs": epochs,
+                "batch_size": batch_size,
+                "hyperparameters": hyperparameters,
+                "performance": performance,
+            }
+        )
+        version = self.registry.find(fingerprint)
+        if version is not None:
+            logger.info(
+                f"Model version {version} has the same training fingerprint {fingerprint}, training skipped"
+            )
+            # e.g. an incremental version was promoted over it since
+            if self.registry.current() != version:
+                self.registry.set_current(version)
+            return version
         self.train_test_split()
-        self.train_model(epochs, batch_size)
+        self.train_model(
+            epochs, batch_size, hyperparameters, performance, profile_steps
+        )
         self.save_model()
         self.save_metrics()
+        # the served model is the checkpoint, the test split is its holdout
+        served = tf.keras.models.load_model(MODEL_ARTIFACTS_PATH / "best_model.keras")
+        metrics = self.evaluate(
+            served, np.arange(self.test_split_idx, len(self.match_uuids))
+        )
+        self.save_training_state(
+            self.match_uuids[: self.test_split_idx],
+            self.match_uuids[self.test_split_idx :],
+            metrics,
+        )
+        return self.registry.register(
+            fingerprint,
+            components,
+            MODEL_ARTIFACTS,
+            {"matches": len(self.match_uuids), "holdout_metrics": metrics},
+        )
+
+    @staticmethod
+    def roll_holdout(new: list[int], holdout: list[int]):
+        """Move the holdout forward: the newest INCREMENTAL_HOLDOUT_SHARE of the
+        new rows join it and as many of its oldest rows leave it for training,
+        so it keeps its size and always covers the latest matches.
+
+        Args:
+            new (list[int]): rows not seen yet, in date order
+            holdout (list[int]): rows of the previous holdout, in date order
+
+        Returns:
+            tuple: (rows to train on, holdout rows)
+        """
+        split = len(new) - int(len(new) * INCREMENTAL_HOLDOUT_SHARE)
+        rolled = holdout + new[split:]
+        released = len(rolled) - len(holdout)
+        return new[:split] + rolled[:released], rolled[released:]
+
+    def incremental_pipeline(
+        self,
+        epochs: int = INCREMENTAL_EPOCHS,
+        batch_size: int = 32,
+        model_path=None,
+    ) -> bool:
+        """Fine-tune the served model on the training matches added since its
+        training state, instead of training a new one on every match.
+
+        The newest new matches join the holdout and its oldest ones are trained
+        on instead (see roll_holdout), so the models are compared on recent
+        matches rather than on the first training's test split forever. The
+        matches to train on are mixed with a replay sample of
+        INCREMENTAL_REPLAY_RATIO older training matches each, so the model
+        does not forget them. The fine-tuned model replaces the served one only if its holdout loss and
+        accuracy do not regress by more than INCREMENTAL_MAX_REGRESSION;
+        otherwise the new matches are kept for the next run. Without a
+        training state or model, trains from scratch.
+
+        The model and training state are the current registry version's
+        (model_path overrides the model), a promoted model is registered as a
+        new version.
+
+        Returns:
+            bool: whether a new model was saved
+        """
+        parent = self.registry.current()
+        if parent is not None:
+            state = self.load_training_state(
+                self.registry.artifact("training_state.json")
+            )
+            model_path = model_path or self.registry.artifact("best_model.keras")
+        else:
+            state = self.load_training_state()
+            model_path = model_path or MODEL_ARTIFACTS_PATH / "best_model.keras"
+        if state is None or not model_path.exists():
+            logger.info("No training state for this feature version, full training")
+            self.training_pipeline(batch_size=batch_size)
+            return True
+        try:
+            self.load_data()
+            positions = {uuid: i for i, uuid in enumerate(self.match_uuids)}
+            seen = set(state["trained"]) | set(state["holdout"])
+            new = [i for i, uuid in enumerate(self.match_uuids) if uuid not in seen]
+            trained = [
+                positions[uuid] for uuid in state["trained"] if uuid in positions
+            ]
+            holdout = [
+                positions[uuid] for uuid in state["holdout"] if uuid in positions
+            ]
+            if not new:
+                logger.info("No new training matches since the last training")
+                return False
+            new, holdout = self.roll_holdout(new, holdout)
+            if not holdout:
+                logger.error("No holdout matches left to compare the models on")
+                return False
+
+            replay = np.random.default_rng().choice(
+                trained,
+                size=min(len(trained), INCREMENTAL_REPLAY_RATIO * len(new)),
+                replace=False,
+            )
+            rows = np.sort(np.concatenate([new, replay]).astype(np.intp))
+            logger.info(
+                f"Fine-tuning on {len(new)} new and {len(replay)} replayed matches"
+            )
+
+            baseline = self.evaluate(tf.keras.models.load_model(model_path), holdout)
+            self.model = tf.keras.models.load_model(model_path)
+            self.model.optimizer.learning_rate = INCREMENTAL_LEARNING_RATE
+            self.history = self.model.fit(
+                window_dataset(
+                    self.home_tensor[rows],
+                    self.away_tensor[rows],
+                    self.target_tensor[rows],
+                    batch_size=batch_size,
+                    shuffle=True,
+                ),
+                epochs=epochs,
+                verbose=1,
+            )
+            candidate = self.evaluate(self.model, holdout)
+            promoted = (
+                candidate["loss"] <= baseline["loss"] + INCREMENTAL_MAX_REGRESSION
+                and candidate["accuracy"]
+                >= baseline["accuracy"] - INCREMENTAL_MAX_REGRESSION
+            )
+            logger.info(
+                f"Holdout loss {baseline['loss']:.4f} -> {candidate['loss']:.4f}, "
+                f"accuracy {baseline['accuracy']:.4f} -> {candidate['accuracy']:.4f}: "
+                f"{'promoted' if promoted else 'kept the previous model'}"
+            )
+            if promoted:
+                self.model.save(MODEL_ARTIFACTS_PATH / "best_model.keras")
+                self.save_training_state(
+                    state["trained"] + [self.match_uuids[i] for i in new],
+                    [self.match_uuids[i] for i in holdout],
+                    candidate,
+                )
+                fingerprint, components = self.training_fingerprint(
+                    {
+                        "incremental_from": parent,
+                        "epochs": epochs,
+                        "batch_size": batch_size,
+                    }
+                )
+                self.registry.register(
+                    fingerprint,
+                    components,
+                    [MODEL_ARTIFACTS_PATH / "best_model.keras", TRAINING_STATE_PATH],
+                    {"matches": len(self.match_uuids), "holdout_metrics": candidate},
+                )
+            return promoted
+        except Exception as e:
+            logger.error(f"Error in incremental training: {e}")
+            raise
 
 
 if __name__ == "__main__":
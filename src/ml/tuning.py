@@ -0,0 +1,255 @@
+import itertools
+import json
+import math
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+
+from src.config import (
+    DEFAULT_WINDOW_SIZE,
+    ML_LOGGER_PATH,
+    TUNING_MAX_EPOCHS,
+    TUNING_MIN_EPOCHS,
+    TUNING_PATH,
+    TUNING_REDUCTION_FACTOR,
+    TUNING_SEARCH_SPACE,
+    TUNING_TRIALS,
+    TUNING_WORKERS,
+)
+from src.logger import get_logger
+from src.ml.runtime import worker_pool
+from src.ml.tensor_store import TensorStore, window_dataset
+from src.ml.train import MLTrainer, compiled_model
+
+logger = get_logger("MLTuning", ML_LOGGER_PATH)
+
+
+def sample_configs(
+    space: dict = TUNING_SEARCH_SPACE, trials: int = TUNING_TRIALS, seed: int = 0
+) -> list[dict]:
+    """trials distinct configurations drawn from the grid of space, every one
+    of them if the grid is smaller"""
+    grid = list(itertools.product(*space.values()))
+    picks = np.random.default_rng(seed).permutation(len(grid))[:trials]
+    return [dict(zip(space, grid[pick])) for pick in picks]
+
+
+def load_best_config(path=TUNING_PATH / "best_config.json") -> dict:
+    """Hyperparameters of the winning trial of the last search, for
+    MLTrainer.train_model"""
+    with open(path) as f:
+        return json.load(f)["config"]
+
+
+def _run_trial(
+    trial: int,
+    config: dict,
+    checkpoint: str,
+    store_path,
+    uuids: list[str],
+    train_rows: int,
+    num_classes: int,
+    normalize_inputs: bool,
+    initial_epoch: int,
+    epochs: int,
+    batch_size: int,
+) -> dict:
+    """Worker: train a trial from initial_epoch to epochs and checkpoint it.
+
+    Its first rung builds the model from config, later rungs resume the
+    checkpoint (weights and optimizer state) of the previous one.
+    """
+    start = time.perf_counter()
+    # every trial maps the same store files, shared in the page cache
+    home, away, targets, _ = TensorStore(store_path).open_memmap(uuids)
+    val_start = int(train_rows * 0.8)
+    if initial_epoch:
+        model = tf.keras.models.load_model(checkpoint)
+    else:
+        model = compiled_model(
+            sequence_length=home.shape[1],
+            num_features=home.shape[2],
+            num_classes=num_classes,
+            normalize_inputs=normalize_inputs,
+            **config,
+        )
+    history = model.fit(
+        window_dataset(
+            home[:val_start],
+            away[:val_start],
+            targets[:val_start],
+            batch_size=batch_size,
+            shuffle=True,
+        ),
+        validation_data=window_dataset(
+            home[val_start:train_rows],
+            away[val_start:train_rows],
+            targets[val_start:train_rows],
+            batch_size=batch_size,
+            cache=True,
+        ),
+        initial_epoch=initial_epoch,
+        epochs=epochs,
+        verbose=0,
+    )
+    model.save(checkpoint)
+    best = int(np.argmin(history.history["val_loss"]))
+    return {
+        "trial": trial,
+        "epochs": epochs,
+        "val_loss": history.history["val_loss"][best],
+        "val_accuracy": history.history["val_accuracy"][best],
+        "seconds": time.perf_counter() - start,
+    }
+
+
+class HyperparameterSearch:
+    """Successive halving search over HybridTransformerModel hyperparameters.
+
+    Every sampled configuration is trained for min_epochs epochs; the best
+    1/reduction_factor of them by validation loss are promoted and trained
+    reduction_factor times longer, resuming from their checkpoint, until one
+    trial is left or max_epochs is reached. Trials of a rung run in parallel
+    worker processes with capped TensorFlow threads, all mapping the same
+    memory-mapped training tensors. Only the training split of MLTrainer is
+    used: its first 80% to fit, the rest for the validation loss.
+
+    Every (trial, rung) is recorded in TUNING_PATH/trials.csv and the winning
+    configuration is exported to TUNING_PATH/best_config.json.
+    """
+
+    def __init__(
+        self,
+        n: int = DEFAULT_WINDOW_SIZE,
+        features: list[str] = None,
+        standardize: bool = False,
+        space: dict = TUNING_SEARCH_SPACE,
+        trials: int = TUNING_TRIALS,
+        min_epochs: int = TUNING_MIN_EPOCHS,
+        max_epochs: int = TUNING_MAX_EPOCHS,
+        reduction_factor: int = TUNING_REDUCTION_FACTOR,
+        workers: int = TUNING_WORKERS,
+        path=TUNING_PATH,
+        seed: int = 0,
+    ):
+        self.trainer = MLTrainer(n, features, standardize)
+        self.configs = sample_configs(space, trials, seed)
+        self.min_epochs = min_epochs
+        self.max_epochs = max_epochs
+        self.reduction_factor = reduction_factor
+        self.workers = workers
+        self.path = Path(path)
+
+    def run(self, batch_size: int = 32) -> pd.DataFrame:
+        """Run the search and export its results.
+
+        Returns:
+            pd.DataFrame: one row per trial and rung
+        """
+        try:
+            self.trainer.load_data()
+            self.trainer.train_test_split()
+            uuids = self.trainer.match_uuids
+            train_rows = len(self.trainer.target_tensor_train)
+            num_classes = len(np.unique(self.trainer.target_tensor))
+            checkpoints = Path(tempfile.mkdtemp(prefix="tuning-"))
+
+            results = []
+            best_loss = {}
+            alive = list(range(len(self.configs)))
+            done_epochs, epochs = 0, self.min_epochs
+            try:
+                with worker_pool(self.workers) as executor:
+                    while True:
+                        logger.info(
+                            f"Training {len(alive)} trials to {epochs} epochs with {self.workers} workers"
+                        )
+                        futures = [
+                            executor.submit(
+                                _run_trial,
+                                trial,
+                                self.configs[trial],
+                                str(checkpoints / f"trial_{trial}.keras"),
+                                self.trainer.store.path,
+                                uuids,
+                                train_rows,
+                                num_classes,
+                                not self.trainer.standardize,
+                                done_epochs,
+                                epochs,
+                                batch_size,
+                            )
+                            for trial in alive
+                        ]
+                        rung = [future.result() for future in futures]
+                        for result in rung:
+                            best_loss[result["trial"]] = min(
+                                result["val_loss"],
+                                best_loss.get(result["trial"], math.inf),
+                            )
+                        alive = sorted(alive, key=best_loss.get)
+                        keep = max(1, len(alive) // self.reduction_factor)
+                        last_rung = keep == len(alive) or epochs >= self.max_epochs
+                        for result in rung:
+                            promoted = result["trial"] in alive[:keep]
+                            results.append(
+                                {
+                                    **result,
+                                    **self.configs[result["trial"]],
+                                    "best_val_loss": best_loss[result["trial"]],
+                                    "status": (
+                                        "pruned"
+                                        if not promoted
+                                        else "final" if last_rung else "promoted"
+                                    ),
+                                }
+                            )
+                        logger.info(
+                            f"Rung of {epochs} epochs: best trial {alive[0]}, val_loss {best_loss[alive[0]]:.4f}"
+                        )
+                        if last_rung:
+                            break
+                        alive = alive[:keep]
+                        done_epochs = epochs
+                        epochs = min(epochs * self.reduction_factor, self.max_epochs)
+            finally:
+                shutil.rmtree(checkpoints, ignore_errors=True)
+
+            results = pd.DataFrame(results)
+            self.save_results(results, alive[0])
+            return results
+        except Exception as e:
+            logger.error(f"Error in hyperparameter search: {e}")
+            raise
+
+    def save_results(self, results: pd.DataFrame, best_trial: int):
+        """Every trial to trials.csv, the winner to best_config.json"""
+        self.path.mkdir(parents=True, exist_ok=True)
+        results.to_csv(self.path / "trials.csv", index=False)
+        best = results[results["trial"] == best_trial].iloc[-1]
+        with open(self.path / "best_config.json", "w") as f:
+            json.dump(
+                {
+                    "trial": best_trial,
+                    "config": self.configs[best_trial],
+                    "epochs": int(best["epochs"]),
+                    "val_loss": float(best["best_val_loss"]),
+                    "val_accuracy": float(best["val_accuracy"]),
+                },
+                f,
+                indent=2,
+            )
+        logger.info(
+            f"Best trial {best_trial} {self.configs[best_trial]} saved to {self.path / 'best_config.json'}"
+        )
+
+
+if __name__ == "__main__":
+    results = HyperparameterSearch().run()
+    print(results.to_string())
+    print(f"Best configuration: {load_best_config()}")
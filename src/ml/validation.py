@@ -0,0 +1,240 @@
+import time
+
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+
+from src.config import (
+    DEFAULT_WINDOW_SIZE,
+    ML_LOGGER_PATH,
+    MODEL_ARTIFACTS_PATH,
+    PREDICT_METADATA_TABLE,
+    WALK_FORWARD_BLOCK_DAYS,
+    WALK_FORWARD_FOLDS,
+    WALK_FORWARD_MIN_TRAIN_SEASONS,
+    WALK_FORWARD_WORKERS,
+)
+from src.data.database import DatabaseManager
+from src.logger import get_logger
+from src.ml.feature_cache import FeatureCache
+from src.ml.runtime import worker_pool
+from src.ml.tensor_store import TensorStore, window_dataset
+from src.ml.train import compiled_model
+
+logger = get_logger("MLValidation", ML_LOGGER_PATH)
+
+
+def _run_fold(
+    fold: dict,
+    store_path,
+    uuids: list[str],
+    num_classes: int,
+    normalize_inputs: bool,
+    epochs: int,
+    batch_size: int,
+) -> dict:
+    """Worker: train a new model on the fold's training rows and evaluate it on
+    its test block. Rows are positions in uuids"""
+    start = time.perf_counter()
+    home, away, targets, _ = TensorStore(store_path).open_memmap(uuids)
+    # last 20% of the training rows for early stopping, like MLTrainer
+    val_start = int(fold["train_matches"] * 0.8)
+    model = compiled_model(
+        sequence_length=home.shape[1],
+        num_features=home.shape[2],
+        num_classes=num_classes,
+        normalize_inputs=normalize_inputs,
+    )
+    history = model.fit(
+        window_dataset(
+            home[:val_start],
+            away[:val_start],
+            targets[:val_start],
+            batch_size=batch_size,
+            shuffle=True,
+        ),
+        validation_data=window_dataset(
+            home[val_start : fold["train_matches"]],
+            away[val_start : fold["train_matches"]],
+            targets[val_start : fold["train_matches"]],
+            batch_size=batch_size,
+            cache=True,
+        ),
+        epochs=epochs,
+        callbacks=[
+            tf.keras.callbacks.EarlyStopping(
+                monitor="val_loss", patience=10, restore_best_weights=True
+            )
+        ],
+        verbose=0,
+    )
+    test = slice(fold["test_start"], fold["test_end"])
+    loss, accuracy = model.evaluate(
+        window_dataset(home[test], away[test], targets[test], batch_size=batch_size),
+        verbose=0,
+    )
+    return {
+        **fold,
+        "epochs": len(history.history["loss"]),
+        "loss": loss,
+        "accuracy": accuracy,
+        "seconds": time.perf_counter() - start,
+    }
+
+
+class WalkForwardValidator:
+    """Walk-forward evaluation of the model on a feature version.
+
+    Matches are ordered by date and split into blocks of block_days days,
+    starting with the first season after the min_train_seasons oldest ones.
+    Each fold trains a new model on every match before one of these blocks
+    (an expanding window of seasons) and tests it on the block; the tested
+    blocks are spread evenly over the later seasons. Folds are trained in
+    parallel worker processes, each with its share of the CPU threads.
+    """
+
+    def __init__(
+        self,
+        n: int = DEFAULT_WINDOW_SIZE,
+        features: list[str] = None,
+        standardize: bool = False,
+        min_train_seasons: int = WALK_FORWARD_MIN_TRAIN_SEASONS,
+        block_days: int = WALK_FORWARD_BLOCK_DAYS,
+        folds: int = WALK_FORWARD_FOLDS,
+        workers: int = WALK_FORWARD_WORKERS,
+    ):
+        self.db = DatabaseManager()
+        self.standardize = standardize
+        self.min_train_seasons = min_train_seasons
+        self.block_days = block_days
+        self.folds = folds
+        self.workers = workers
+        self.store = FeatureCache().store(n, features, standardize)
+
+    def load_matches(self) -> pd.DataFrame:
+        """Training matches with tensors in the store, oldest first"""
+        matches = self.db.get_dataframe(
+            f"SELECT match_uuid, season_link, date FROM {PREDICT_METADATA_TABLE} WHERE type = 'training'",
+            include_archives=True,
+        )
+        matches = matches[[uuid in self.store for uuid in matches["match_uuid"]]].copy()
+        matches["date"] = pd.to_datetime(matches["date"])
+        matches["season"] = matches["season_link"].map(DatabaseManager._season_label)
+        # explicit order, folds are row ranges of this order
+        return matches.sort_values(["date", "match_uuid"], kind="stable").reset_index(
+            drop=True
+        )
+
+    def make_folds(self, matches: pd.DataFrame) -> list[dict]:
+        """Train and test row ranges of the date ordered matches.
+
+        Returns:
+            list[dict]: per fold, train rows [0, train_matches), test rows
+                [test_start, test_end) and the test block dates
+        """
+        seasons = sorted(matches["season"].unique())
+        if len(seasons) <= self.min_train_seasons:
+            raise ValueError(
+                f"Walk-forward validation needs more than {self.min_train_seasons} seasons, found {len(seasons)}"
+            )
+        first_test = matches.loc[
+            matches["season"] == seasons[self.min_train_seasons], "date"
+        ].min()
+        blocks = ((matches["date"] - first_test).dt.days // self.block_days).to_numpy()
+        test_blocks = np.unique(blocks[blocks >= 0])
+        picks = np.unique(
+            np.linspace(0, len(test_blocks) - 1, self.folds).round().astype(int)
+        )
+
+        folds = []
+        for fold, block in enumerate(test_blocks[picks]):
+            rows = np.flatnonzero(blocks == block)
+            folds.append(
+                {
+                    "fold": fold,
+                    "test_start": int(rows[0]),
+                    "test_end": int(rows[-1]) + 1,
+                    "train_matches": int(rows[0]),
+                    "test_matches": len(rows),
+                    "test_from": str(matches["date"].iloc[rows[0]].date()),
+                    "test_to": str(matches["date"].iloc[rows[-1]].date()),
+                }
+            )
+        return folds
+
+    def run(self, epochs: int = 30, batch_size: int = 32) -> pd.DataFrame:
+        """Train and evaluate every fold.
+
+        Returns:
+            pd.DataFrame: one row of metrics per fold
+        """
+        try:
+            matches = self.load_matches()
+            folds = self.make_folds(matches)
+            uuids = matches["match_uuid"].tolist()
+            _, _, targets, _ = self.store.open_memmap(uuids)
+            num_classes = len(np.unique(targets))
+            logger.info(
+                f"Walk-forward validation of {len(folds)} folds over {len(uuids)} matches with {self.workers} workers"
+            )
+
+            results = []
+            with worker_pool(self.workers) as executor:
+                futures = [
+                    executor.submit(
+                        _run_fold,
+                        fold,
+                        self.store.path,
+                        uuids,
+                        num_classes,
+                        not self.standardize,
+                        epochs,
+                        batch_size,
+                    )
+                    for fold in folds
+                ]
+                for future in futures:
+                    result = future.result()
+                    logger.info(
+                        f"Fold {result['fold']} ({result['test_from']} to {result['test_to']}, "
+                        f"{result['train_matches']} train / {result['test_matches']} test matches): "
+                        f"accuracy {result['accuracy']:.3f}, loss {result['loss']:.3f}"
+                    )
+                    results.append(result)
+            return pd.DataFrame(results)
+        except Exception as e:
+            logger.error(f"Error in walk-forward validation: {e}")
+            raise
+
+    @staticmethod
+    def summarize(results: pd.DataFrame) -> dict:
+        """Mean and standard deviation of the fold metrics, and the accuracy
+        and loss over every test match (folds weighted by their size)"""
+        weights = results["test_matches"]
+        return {
+            "folds": len(results),
+            "test_matches": int(weights.sum()),
+            "accuracy_mean": float(results["accuracy"].mean()),
+            "accuracy_std": float(results["accuracy"].std()),
+            "accuracy_weighted": float(
+                np.average(results["accuracy"], weights=weights)
+            ),
+            "loss_mean": float(results["loss"].mean()),
+            "loss_std": float(results["loss"].std()),
+            "loss_weighted": float(np.average(results["loss"], weights=weights)),
+        }
+
+    def save_results(
+        self, results: pd.DataFrame, path=MODEL_ARTIFACTS_PATH / "walk_forward.csv"
+    ):
+        """Per fold metrics to CSV"""
+        results.to_csv(path, index=False)
+        logger.info(f"Walk-forward results saved to {path}")
+
+
+if __name__ == "__main__":
+    validator = WalkForwardValidator()
+    results = validator.run()
+    validator.save_results(results)
+    for metric, value in validator.summarize(results).items():
+        print(f"{metric}: {value}")
@@ -0,0 +1,328 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from src.config import ML_LOGGER_PATH, NOT_FEATURE_COLUMNS, TRANSFORMED_TABLE
+from src.logger import get_logger
+
+logger = get_logger(
+    "MLPreprocessor",
+    ML_LOGGER_PATH,
+)
+
+
+def feature_columns(
+    columns, selected: list[str] = None
+) -> tuple[list[str], list[str], list[str]]:
+    """Feature, home and away columns of a matches DataFrame, optionally only
+    the selected ones. Home and away columns must be selected in pairs"""
+    feature_cols = [
+        col
+        for col in columns
+        if col not in NOT_FEATURE_COLUMNS and (selected is None or col in selected)
+    ]
+    home_cols = [col for col in feature_cols if "home" in col]
+    away_cols = [col for col in feature_cols if "away" in col]
+    if [col.replace("home", "away") for col in home_cols] != away_cols:
+        raise ValueError(f"Unpaired home and away feature columns in {feature_cols}")
+    return feature_cols, home_cols, away_cols
+
+
+def orientation_permutations(
+    feature_cols: list[str], home_cols: list[str], away_cols: list[str]
+) -> tuple[np.ndarray, np.ndarray]:
+    """Column permutations giving a match's features as seen by its home team
+    (row 0, unchanged) and by its away team (row 1, every home_k column swapped
+    with away_k), and the mask of columns that are neither home nor away"""
+    col_index = {col: i for i, col in enumerate(feature_cols)}
+    permutations = np.tile(np.arange(len(feature_cols)), (2, 1))
+    for home_col, away_col in zip(home_cols, away_cols):
+        permutations[1, col_index[home_col]] = col_index[away_col]
+        permutations[1, col_index[away_col]] = col_index[home_col]
+    neutral = np.ones(len(feature_cols), dtype=bool)
+    neutral[[col_index[col] for col in home_cols + away_cols]] = False
+    return permutations, neutral
+
+
+def oriented_values(
+    values: np.ndarray, permutations: np.ndarray, neutral: np.ndarray
+) -> np.ndarray:
+    """(2, rows, features) float32 values of matches as seen by the home and by
+    the away team. Columns that are neither home nor away are left NaN, so
+    windows using them are invalid"""
+    oriented = np.stack([values[:, perm] for perm in permutations]).astype(np.float32)
+    oriented[:, :, neutral] = np.nan
+    return oriented
+
+
+def _datetimes(dates) -> np.ndarray:
+    """datetime64[ns] array of dates given as strings, Timestamps or datetimes"""
+    return np.asarray(pd.to_datetime(dates), dtype="datetime64[ns]")
+
+
+class TeamHistoryIndex:
+    """Per-team, date-sorted index of the matches with every feature present.
+
+    Each indexed match is stored once as two oriented feature rows: as seen by
+    its home team (side 0) and by its away team (side 1, home/away columns
+    swapped). Every team maps to the dates, row positions and sides of its
+    matches, so the last n matches of a team before a date are a binary search
+    plus a slice instead of a scan of the whole table.
+
+    Windows are identical to the original Preprocessor last n matches scan:
+    same rows, same orientation, same float32 values.
+    """
+
+    def __init__(
+        self, feature_cols: list[str], home_cols: list[str], away_cols: list[str]
+    ):
+        self.feature_cols = feature_cols
+        self.home_cols = home_cols
+        self.away_cols = away_cols
+        self.permutations, self.neutral = orientation_permutations(
+            feature_cols, home_cols, away_cols
+        )
+        # (side, position, feature)
+        self.oriented = np.empty((2, 0, len(feature_cols)), dtype=np.float32)
+        # team -> (dates, positions, sides)
+        self.history = {}
+
+    @classmethod
+    def from_dataframe(
+        cls,
+        df: pd.DataFrame,
+        feature_cols: list[str] = None,
+        home_cols: list[str] = None,
+        away_cols: list[str] = None,
+        valid: np.ndarray = None,
+    ):
+        """Build the index in one pass; row positions are df's positions"""
+        if feature_cols is None:
+            feature_cols, home_cols, away_cols = feature_columns(df.columns)
+        index = cls(feature_cols, home_cols, away_cols)
+        index.add_matches(df, valid)
+        return index
+
+    @classmethod
+    def from_database(cls, db, selected: list[str] = None):
+        """Build the index from transformed matches, archived seasons included"""
+        df = db.get_dataframe(
+            f"SELECT * FROM {TRANSFORMED_TABLE} ORDER BY date ASC",
+            include_archives=True,
+        )
+        return cls.from_dataframe(df, *feature_columns(df.columns, selected))
+
+    @property
+    def size(self) -> int:
+        return self.oriented.shape[1]
+
+    def add_matches(self, df: pd.DataFrame, valid: np.ndarray = None) -> np.ndarray:
+        """Index new matches and return their row positions.
+
+        Matches without every feature (valid, computed if not given) are given
+        a position but are not part of any team history. Matches older than a
+        team's latest one are inserted in date order.
+        """
+        values = df[self.feature_cols].to_numpy(dtype=np.float32)
+        positions = np.arange(self.size, self.size + len(df))
+        self.oriented = np.concatenate(
+            [self.oriented, oriented_values(values, self.permutations, self.neutral)],
+            axis=1,
+        )
+
+        if valid is None:
+            valid = ~np.isnan(values).any(axis=1)
+        teams = np.concatenate(
+            [df["home"].to_numpy()[valid], df["away"].to_numpy()[valid]]
+        )
+        dates = np.concatenate([_datetimes(df["date"])[valid]] * 2)
+        entry_positions = np.concatenate([positions[valid]] * 2)
+        sides = np.repeat(np.array([0, 1], dtype=np.int8), valid.sum())
+
+        # group entries by team, keeping row order within each team
+        team_codes, team_names = pd.factorize(teams)
+        order = np.lexsort((entry_positions, team_codes))
+        groups = np.split(order, np.flatnonzero(np.diff(team_codes[order])) + 1)
+        for group in groups:
+            if len(group):
+                self._insert(
+                    team_names[team_codes[group[0]]],
+                    dates[group],
+                    entry_positions[group],
+                    sides[group],
+                )
+        logger.debug(
+            f"Indexed {valid.sum()}/{len(df)} matches, {len(self.history)} teams"
+        )
+        return positions
+
+    def _insert(self, team, dates, positions, sides):
+        order = np.argsort(dates, kind="stable")
+        dates, positions, sides = dates[order], positions[order], sides[order]
+        if team not in self.history:
+            self.history[team] = (dates, positions, sides)
+            return
+        team_dates, team_positions, team_sides = self.history[team]
+        at = np.searchsorted(team_dates, dates, side="right")
+        self.history[team] = (
+            np.insert(team_dates, at, dates),
+            np.insert(team_positions, at, positions),
+            np.insert(team_sides, at, sides),
+        )
+
+    def last_n(self, team: str, before_date, n: int):
+        """Row positions and sides of team's last n matches strictly before
+        before_date, or None if it has fewer than n"""
+        if team not in self.history:
+            return None
+        dates, positions, sides = self.history[team]
+        end = np.searchsorted(dates, _datetimes([before_date])[0], side="left")
+        if end < n:
+            return None
+        return positions[end - n : end], sides[end - n : end]
+
+    def window(self, team: str, before_date, n: int):
+        """(n, features) float32 window of team before before_date, or None"""
+        last_n = self.last_n(team, before_date, n)
+        if last_n is None:
+            return None
+        positions, sides = last_n
+        return self.oriented[sides, positions]
+
+    def windows(self, teams, dates, n: int):
+        """Windows of many (team, date) pairs at once.
+
+        Returns:
+            tuple: (windows, available). windows is a float32 array of shape
+                (len(teams), n, features), NaN where available is False
+        """
+        teams = np.asarray(teams, dtype=object)
+        dates = _datetimes(dates)
+        windows = np.full(
+            (len(teams), n, len(self.feature_cols)), np.nan, dtype=np.float32
+        )
+        available = np.zeros(len(teams), dtype=bool)
+
+        team_codes, team_names = pd.factorize(teams)
+        order = np.argsort(team_codes, kind="stable")
+        groups = np.split(order, np.flatnonzero(np.diff(team_codes[order])) + 1)
+        for rows in groups:
+            if not len(rows) or team_names[team_codes[rows[0]]] not in self.history:
+                continue
+            team_dates, team_positions, team_sides = self.history[
+                team_names[team_codes[rows[0]]]
+            ]
+            end = np.searchsorted(team_dates, dates[rows], side="left")
+            rows, end = rows[end >= n], end[end >= n]
+            idx = end[:, None] - n + np.arange(n)
+            windows[rows] = self.oriented[team_sides[idx], team_positions[idx]]
+            available[rows] = True
+        return windows, available
+
+    def match_windows(self, home_teams, away_teams, dates, n: int):
+        """Home and away team windows of many matches.
+
+        Returns:
+            tuple: (home_windows, away_windows, available), available is True
+                where both teams have n previous matches
+        """
+        home_windows, home_available = self.windows(home_teams, dates, n)
+        away_windows, away_available = self.windows(away_teams, dates, n)
+        return home_windows, away_windows, home_available & away_available
+
+
+def league_shards(df: pd.DataFrame) -> list[np.ndarray]:
+    """Row positions of df split into shards that share no team: one per league
+    (season_link prefix), leagues sharing a team are kept together"""
+    leagues = df["season_link"].str.extract(r"(\w+-\w+)(?=-Scores)")[0].fillna("")
+    # union of leagues connected by a team
+    parent = {league: league for league in leagues.unique()}
+
+    def root(league):
+        while parent[league] != league:
+            league = parent[league]
+        return league
+
+    team_leagues = pd.concat(
+        [
+            pd.DataFrame({"team": df["home"], "league": leagues}),
+            pd.DataFrame({"team": df["away"], "league": leagues}),
+        ]
+    ).drop_duplicates()
+    for _, group in team_leagues.groupby("team", observed=True)["league"]:
+        first = root(group.iloc[0])
+        for league in group.iloc[1:]:
+            parent[root(league)] = first
+
+    shard_of = leagues.map(root).to_numpy()
+    return [np.flatnonzero(shard_of == shard) for shard in sorted(set(shard_of))]
+
+
+def _shard_match_windows(
+    df: pd.DataFrame, candidates: np.ndarray, feature_cols, home_cols, away_cols, n
+):
+    """Worker: match windows of the candidate rows of one shard"""
+    index = TeamHistoryIndex.from_dataframe(df, feature_cols, home_cols, away_cols)
+    candidate_df = df.iloc[candidates]
+    return index.match_windows(
+        candidate_df["home"], candidate_df["away"], candidate_df["date"], n
+    )
+
+
+def parallel_match_windows(
+    df: pd.DataFrame,
+    candidates,
+    feature_cols: list[str],
+    home_cols: list[str],
+    away_cols: list[str],
+    n: int,
+    workers: int,
+):
+    """TeamHistoryIndex.match_windows of the candidate rows of df, with the
+    league shards built in a process pool.
+
+    Teams never cross shards, so every window is the same as with one index
+    over df. Results are returned in candidates order whatever the order in
+    which shards complete. Workers are spawned, not forked: the preprocessor
+    runs in processes that already initialized TensorFlow, e.g. training.
+
+    Returns:
+        tuple: (home_windows, away_windows, available)
+    """
+    candidates = np.asarray(candidates, dtype=np.intp)
+    home_windows = np.full((len(candidates), n, len(feature_cols)), np.nan, np.float32)
+    away_windows = np.full_like(home_windows, np.nan)
+    available = np.zeros(len(candidates), dtype=bool)
+
+    # candidates are positions in df order, give each shard its own
+    order = np.argsort(candidates, kind="stable")
+    sorted_candidates = candidates[order]
+    jobs = []
+    for shard in league_shards(df):
+        in_shard = np.isin(sorted_candidates, shard)
+        if in_shard.any():
+            shard_candidates = np.searchsorted(shard, sorted_candidates[in_shard])
+            jobs.append((shard, shard_candidates, order[in_shard]))
+
+    with ProcessPoolExecutor(
+        max_workers=max(1, min(workers, len(jobs))),
+        mp_context=multiprocessing.get_context("spawn"),
+    ) as executor:
+        futures = [
+            executor.submit(
+                _shard_match_windows,
+                df.iloc[shard],
+                shard_candidates,
+                feature_cols,
+                home_cols,
+                away_cols,
+                n,
+            )
+            for shard, shard_candidates, _ in jobs
+        ]
+        for (_, _, rows), future in zip(jobs, futures):
+            home_windows[rows], away_windows[rows], available[rows] = future.result()
+    logger.debug(f"Built windows of {len(candidates)} matches in {len(jobs)} shards")
+    return home_windows, away_windows, available
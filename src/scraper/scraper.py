@@ -5,6 +5,7 @@ from bs4 import BeautifulSoup
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.ui import WebDriverWait
+from src.data.blobs import BlobStore
 from src.data.database import DatabaseManager
 from src.scraper.webdriver import ChromeDriverWrapper
 from src.logger import get_logger
@@ -19,11 +20,15 @@ class SerieAScraper:
     def __init__(self, driver: ChromeDriverWrapper):
         self.driver = driver
         self.db = DatabaseManager()
+        self.blobs = BlobStore(self.db)
         self.url = None
 
     def scrape_basic_match_data(self, url: str):
         """Scrape and save to database"""
         try:
+            if url in self.db.archived_season_links():
+                logger.info(f"Season {url} is archived, skipping")
+                return
             soup = self._get_page(url)
             rows = soup.select(
                 "table.stats_table tbody tr[data-row]:not(.spacer.partial_table.result_all, .thead)"
@@ -129,7 +134,7 @@ class SerieAScraper:
     def scrape_match_reports(self, year: Optional[int] = None):
         """Scrape match reports and save to database"""
         try:
-            query = f"SELECT * FROM {RAW_TABLE} WHERE report_link IS NOT NULL AND team_stats IS NULL AND extra_stats IS NULL"
+            query = f"SELECT home, score, away, report_link FROM {RAW_TABLE} WHERE report_link IS NOT NULL AND team_stats_id IS NULL AND extra_stats_id IS NULL"
             if year:
                 query += f" AND date LIKE '{year}%'"
             matches = self.db.execute_query(query)
@@ -139,14 +144,25 @@ class SerieAScraper:
                 team_stats = self._extract_team_stats(soup)
                 extra_stats = self._extract_extra_stats(soup)
 
-                self.db.execute_query(
-                    f"UPDATE {RAW_TABLE} SET team_stats = ?, extra_stats = ?, last_updated = CURRENT_TIMESTAMP WHERE report_link = ?",
-                    (team_stats, extra_stats, match["report_link"]),
-                )
+                # Blobs and their references in one transaction, so a failed
+                # update never leaves unreferenced blobs behind
+                with self.db.get_connection() as conn:
+                    conn.execute(
+                        f"UPDATE {RAW_TABLE} SET team_stats_id = ?, extra_stats_id = ?, last_updated = CURRENT_TIMESTAMP WHERE report_link = ?",
+                        (
+                            self.blobs.put(team_stats, conn=conn),
+                            self.blobs.put(extra_stats, conn=conn),
+                            match["report_link"],
+                        ),
+                    )
+                    conn.commit()
 
                 logger.info(
                     f"Match {i+1}/{len(matches)} - Saved team stats and extra stats - {match['home']} {match['score']} {match['away']} - {match['report_link']}"
                 )
 
+            # Train the shared compression dictionary once there are enough pages
+            self.blobs.ensure_dictionary()
+
         except Exception as e:
             logger.error(f"Error while scraping match reports: {e}")
@@ -3,6 +3,8 @@ import re
 import sqlite3
 
 from bs4 import BeautifulSoup
+from src.data.blobs import BlobStore
+from src.data.changes import ChangeLog
 from src.data.database import DatabaseManager
 from src.config import (
     RAW_TABLE,
@@ -26,27 +28,62 @@ logger = get_logger(
 class DataTransformer:
     def __init__(self):
         self.db = DatabaseManager()
+        self.blobs = BlobStore(self.db)
+        self.changes = ChangeLog(self.db, "transformer")
+        self.table_filter_params = ()
         self.table_filter = f"""
                 FROM {RAW_TABLE}
                 WHERE 
-                report_link NOT IN (SELECT report_link FROM {TRANSFORMED_TABLE})
+                NOT EXISTS (SELECT 1 FROM {TRANSFORMED_TABLE} t WHERE t.report_link = {RAW_TABLE}.report_link)
                 AND date IS NOT NULL
                 AND home IS NOT NULL
                 AND away IS NOT NULL
                 AND score IS NOT NULL
                 AND report_link IS NOT NULL
-                AND team_stats IS NOT NULL
-                AND extra_stats IS NOT NULL
+                AND team_stats_id IS NOT NULL
+                AND extra_stats_id IS NOT NULL
             """
 
-    def _raw_match_generator(self):
-        """Generator method for raw match data"""
+    def _use_changed_matches_filter(self):
+        """Only transform raw matches changed since the last run, and the ones
+        never transformed, e.g. failed in a previous run"""
+        changed_keys, self.table_filter_params = self.changes.keys_subquery([RAW_TABLE])
+        self.table_filter = f"""
+                FROM {RAW_TABLE}
+                WHERE 
+                ((season_link, home, away) IN ({changed_keys})
+                 OR NOT EXISTS (SELECT 1 FROM {TRANSFORMED_TABLE} t WHERE t.report_link = {RAW_TABLE}.report_link))
+                AND date IS NOT NULL
+                AND home IS NOT NULL
+                AND away IS NOT NULL
+                AND score IS NOT NULL
+                AND report_link IS NOT NULL
+                AND team_stats_id IS NOT NULL
+                AND extra_stats_id IS NOT NULL
+            """
+
+    def _raw_match_generator(self, chunk_size: int = 250):
+        """Generator method for raw match data, the html of each chunk of
+        chunk_size matches read in one blob query"""
         try:
-            raw_matches = self.db.execute_query(f"SELECT * {self.table_filter}")
-            for match in raw_matches:
-                yield match
+            raw_matches = self.db.execute_query(
+                f"SELECT * {self.table_filter}", self.table_filter_params
+            )
+            for start in range(0, len(raw_matches), chunk_size):
+                chunk = raw_matches[start : start + chunk_size]
+                pages = self.blobs.get_many(
+                    [match["team_stats_id"] for match in chunk]
+                    + [match["extra_stats_id"] for match in chunk]
+                )
+                for match in chunk:
+                    yield {
+                        **dict(match),
+                        "team_stats": pages.get(match["team_stats_id"]),
+                        "extra_stats": pages.get(match["extra_stats_id"]),
+                    }
         except Exception as e:
             logger.error(f"Error while generating raw match data: {e}")
+            raise
 
     def _extract_basic_match_data(self, raw_match: sqlite3.Row) -> TransformedMatch:
         """Extract basic match data from raw table"""
@@ -200,7 +237,9 @@ class DataTransformer:
     def _count_matches_to_transform(self) -> int:
         """Count the number of matches to transform"""
         try:
-            return self.db.execute_query(f"SELECT COUNT(*) {self.table_filter}")[0][0]
+            return self.db.execute_query(
+                f"SELECT COUNT(*) {self.table_filter}", self.table_filter_params
+            )[0][0]
         except Exception as e:
             logger.error(f"Error while counting matches to transform: {e}")
             return 0
@@ -208,9 +247,12 @@ class DataTransformer:
     def transform(self) -> None:
         """Transform raw match data into transformed match data"""
         try:
+            if not self.changes.begin().is_bootstrap:
+                self._use_changed_matches_filter()
             total_matches_transform = self._count_matches_to_transform()
             raw_matches = self._raw_match_generator()
             logger.info(f"Transforming {total_matches_transform} matches...")
+            failed_keys = set()  # (season_link, home, away) retried next run
             for i, raw_match in enumerate(raw_matches):
                 try:
                     match = self._extract_basic_match_data(raw_match)
@@ -224,8 +266,12 @@ class DataTransformer:
                         )
                 except Exception as e:
                     logger.error(
-                        f"Error while transforming match {match.report_link}: {e}"
+                        f"Error while transforming match {raw_match['report_link']}: {e}"
+                    )
+                    failed_keys.add(
+                        (raw_match["season_link"], raw_match["home"], raw_match["away"])
                     )
+            self.changes.commit(failed_keys)
             logger.info(f"Transformation completed!")
         except Exception as e:
             logger.error(f"Error in transformation process: {e}")
@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src import config
+from src.data import database
+from src.data.database import DatabaseManager
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """Initialized SQLite database in tmp_path, with its archives there too"""
+    monkeypatch.setitem(config.DATABASE_CONFIG, "engine", "sqlite")
+    monkeypatch.setitem(config.DATABASE_CONFIG, "sqlite_path", tmp_path / "matches.db")
+    monkeypatch.setattr(database, "DATABASE_PATH", tmp_path)
+    monkeypatch.setattr(database, "ARCHIVE_PATH", tmp_path / "archive")
+    db = DatabaseManager()
+    db.initialize_db()
+    return db
+
+
+@pytest.fixture
+def matches() -> pd.DataFrame:
+    """Two double round robin seasons of a six team league with random
+    statistics, one matchday per week"""
+    rng = np.random.default_rng(0)
+    teams = [f"Team {i}" for i in range(6)]
+    feature_cols = [
+        col
+        for col in config.TRANSFORMED_COLUMNS
+        if col not in config.NOT_FEATURE_COLUMNS
+    ]
+    rows = []
+    for season in (2000, 2001):
+        # circle method: the first team stays, the others rotate
+        rotation, matchdays = list(teams), []
+        for _ in range(len(teams) - 1):
+            matchdays.append(
+                [(rotation[i], rotation[-1 - i]) for i in range(len(teams) // 2)]
+            )
+            rotation = [rotation[0], rotation[-1], *rotation[1:-1]]
+        matchdays += [[(away, home) for home, away in day] for day in matchdays]
+        for week, fixtures in enumerate(matchdays):
+            date = pd.Timestamp(f"{season}-08-01") + pd.Timedelta(weeks=week)
+            for home, away in fixtures:
+                row = {
+                    "season_link": f"https://fbref.com/en/comps/11/{season}/Serie-A-Stats",
+                    "date": date.strftime("%Y-%m-%d"),
+                    "home": home,
+                    "away": away,
+                    "attendance": "20000",
+                    "report_link": f"/en/matches/{len(rows):08d}",
+                }
+                row.update({col: float(rng.integers(0, 100)) for col in feature_cols})
+                rows.append(row)
+    return pd.DataFrame(rows)
@@ -0,0 +1,82 @@
+import pytest
+
+from src.config import PREDICT_METADATA_TABLE
+from src.data import snapshot
+from src.data.snapshot import SnapshotManager
+
+duckdb = pytest.importorskip("duckdb")
+from src.data import analytics
+
+SEASON = "https://fbref.com/en/comps/11/2000/schedule/2000-Serie-A-Scores-and-Fixtures"
+# winner, home, draw and away probabilities
+PREDICTIONS = [
+    (0, 0.7, 0.2, 0.1),  # confident and correct
+    (1, 0.5, 0.1, 0.4),  # wrong, confident below 0.5
+    (2, None, None, None),  # never predicted
+    (1, 0.1, 0.1, 0.8),  # confident and correct
+]
+
+
+@pytest.fixture
+def db(db, tmp_path, monkeypatch):
+    """Database with scored predictions, snapshots and DuckDB extensions in
+    tmp_path"""
+    monkeypatch.setattr(
+        snapshot.SnapshotManager.__init__, "__defaults__", (tmp_path / "snapshots",)
+    )
+    connect = duckdb.connect
+    monkeypatch.setattr(
+        duckdb,
+        "connect",
+        lambda config: connect(
+            config={**config, "extension_directory": str(tmp_path / "extensions")}
+        ),
+    )
+    rows = [
+        (SEASON, f"2000-08-0{i + 1}", f"Team {i}", f"Team {i + 4}", "1–0", *row)
+        for i, row in enumerate(PREDICTIONS)
+    ]
+    rows.append((SEASON, "2000-09-01", "Team 0", "Team 1", None, None, 0.6, 0.2, 0.2))
+    for row in rows:
+        db.execute_query(
+            f"""
+            INSERT INTO {PREDICT_METADATA_TABLE}
+            (season_link, date, home, away, score, winner, home_win_pred_prob,
+             draw_pred_prob, away_win_pred_prob, type, last_updated)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, '2000-01-01 00:00:00')
+            """,
+            (*row, "training" if row[4] else "prediction"),
+        )
+    return db
+
+
+def test_without_the_sqlite_extension_nothing_is_downloaded(db):
+    # no snapshot and no provisioned extension: pandas fallback
+    assert db.analytics_engine() is None
+
+
+def test_aggregates_from_a_fresh_snapshot(db):
+    SnapshotManager().export()
+    engine = db.analytics_engine()
+    assert engine.source == "snapshot"
+
+    assert engine.summary(0.6) == {
+        "total_matches": 4,
+        "confident_predictions": 2,
+        "correct_predictions": 2,
+        "accuracy": 100,
+        "coverage": 50,
+    }
+    assert engine.summary(0)["confident_predictions"] == 3
+    assert engine.class_metrics(0) == {
+        "Home": (50, 100),
+        "Away": (100, 50),
+        "Draw": (0, 0),
+    }
+    confusion = engine.confusion_matrix(0)
+    assert confusion.loc["Away", "Home"] == 1 and confusion.to_numpy().sum() == 3
+
+    page = engine.predictions(0.6, limit=2, offset=1)
+    assert list(page["date"]) == ["2000-08-03", "2000-08-02"]
+    assert list(page["Predicted"]) == ["No Prediction", "No Prediction"]
+    assert list(page["Max Probability %"]) == ["N/A %", "50 %"]
@@ -0,0 +1,70 @@
+import sqlite3
+
+import pytest
+
+from src.config import TRANSFORMED_TABLE
+
+
+def insert(db, matches):
+    with db.get_connection() as conn:
+        matches.to_sql(TRANSFORMED_TABLE, conn, if_exists="append", index=False)
+        conn.commit()
+
+
+def report_links(db, include_archives: bool) -> list:
+    df = db.get_dataframe(
+        f"SELECT report_link FROM {TRANSFORMED_TABLE} ORDER BY report_link",
+        include_archives=include_archives,
+    )
+    return list(df["report_link"])
+
+
+def test_archived_season_reads_through_the_union_view(db, matches):
+    insert(db, matches)
+    first_season = matches["season_link"].iloc[0]
+    db.archive_season(first_season)
+
+    archived = matches["season_link"] == first_season
+    assert db.archived_season_links() == {first_season}
+    assert report_links(db, include_archives=False) == sorted(
+        matches.loc[~archived, "report_link"]
+    )
+    assert report_links(db, include_archives=True) == sorted(matches["report_link"])
+    assert len(db.list_archives()) == 1 and db.list_archives()[0].exists()
+
+
+def test_archives_are_read_only(db, matches):
+    insert(db, matches)
+    db.archive_season(matches["season_link"].iloc[0])
+    with db.get_connection(include_archives=True) as conn:
+        with pytest.raises(sqlite3.OperationalError):
+            conn.execute(f"DELETE FROM archive_0.{TRANSFORMED_TABLE}")
+
+
+def test_columns_added_after_archiving_read_as_null(db, matches):
+    insert(db, matches)
+    first_season = matches["season_link"].iloc[0]
+    db.archive_season(first_season)
+    db.execute_query(f"ALTER TABLE {TRANSFORMED_TABLE} ADD COLUMN new_feature REAL")
+    db.execute_query(f"UPDATE {TRANSFORMED_TABLE} SET new_feature = 1")
+
+    df = db.get_dataframe(
+        f"SELECT season_link, new_feature FROM {TRANSFORMED_TABLE}",
+        include_archives=True,
+    )
+    assert len(df) == len(matches)
+    archived = df["season_link"] == first_season
+    assert df.loc[archived, "new_feature"].isna().all()
+    assert (df.loc[~archived, "new_feature"] == 1).all()
+
+
+def test_compact_archives_keeps_every_season(db, matches):
+    insert(db, matches)
+    for season_link in matches["season_link"].unique():
+        db.archive_season(season_link)
+    assert len(db.list_archives()) == 2
+
+    db.compact_archives(max_archives=1)
+    assert len(db.list_archives()) == 1
+    assert report_links(db, include_archives=False) == []
+    assert report_links(db, include_archives=True) == sorted(matches["report_link"])
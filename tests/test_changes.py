@@ -0,0 +1,120 @@
+from src.config import (
+    CHANGE_LOG_CONSUMERS,
+    CHANGE_LOG_OFFSETS_TABLE,
+    CHANGE_LOG_RETENTION_DAYS,
+    CHANGE_LOG_TABLE,
+    TRANSFORMED_TABLE,
+)
+from src.data.changes import ChangeLog
+
+
+def insert(db, matches):
+    with db.get_connection() as conn:
+        matches.to_sql(TRANSFORMED_TABLE, conn, if_exists="append", index=False)
+        conn.commit()
+
+
+def keys(matches) -> set:
+    return set(zip(matches["season_link"], matches["home"], matches["away"]))
+
+
+def change_ids(db) -> list:
+    rows = db.execute_query(f"SELECT change_id FROM {CHANGE_LOG_TABLE}")
+    return sorted(row[0] for row in rows)
+
+
+def test_bootstrap_then_delta(db, matches):
+    insert(db, matches.iloc[:10])
+    changes = ChangeLog(db, "transformer").begin()
+    assert changes.is_bootstrap
+    changes.commit()
+
+    changes = ChangeLog(db, "transformer").begin()
+    assert not changes.is_bootstrap
+    assert changes.changed_keys([TRANSFORMED_TABLE]) == set()
+
+    insert(db, matches.iloc[10:15])
+    changes = ChangeLog(db, "transformer").begin()
+    assert changes.changed_keys([TRANSFORMED_TABLE]) == keys(matches.iloc[10:15])
+
+
+def test_changes_after_begin_wait_for_next_run(db, matches):
+    insert(db, matches.iloc[:10])
+    changes = ChangeLog(db, "transformer").begin()
+    insert(db, matches.iloc[10:15])
+    assert changes.changed_keys([TRANSFORMED_TABLE]) == keys(matches.iloc[:10])
+    changes.commit()
+
+    changes = ChangeLog(db, "transformer").begin()
+    assert changes.changed_keys([TRANSFORMED_TABLE]) == keys(matches.iloc[10:15])
+
+
+def test_failed_keys_are_consumed_again(db, matches):
+    ChangeLog(db, "transformer").begin().commit()
+    insert(db, matches.iloc[:10])
+    first_ids = change_ids(db)
+    failed = keys(matches.iloc[[3, 7]])
+
+    changes = ChangeLog(db, "transformer").begin()
+    assert changes.first_change(failed) == first_ids[3]
+    changes.commit(failed_keys=failed)
+
+    # the offset stops before the first failed change, later successes are
+    # consumed again too
+    changes = ChangeLog(db, "transformer").begin()
+    assert changes.start == first_ids[3] - 1
+    assert changes.changed_keys([TRANSFORMED_TABLE]) == keys(matches.iloc[3:10])
+
+    changes.commit()
+    assert ChangeLog(db, "transformer").begin().start == first_ids[-1]
+
+
+def test_failed_keys_outside_the_window_are_ignored(db, matches):
+    insert(db, matches.iloc[:10])
+    changes = ChangeLog(db, "transformer").begin()
+    assert changes.first_change({("season", "home", "away")}) is None
+    changes.commit(failed_keys={("season", "home", "away")})
+    assert ChangeLog(db, "transformer").begin().start == changes.end
+
+
+def test_prune_waits_for_every_consumer(db, matches):
+    insert(db, matches.iloc[:10])
+    ids = change_ids(db)
+    for consumer in CHANGE_LOG_CONSUMERS[:-1]:
+        ChangeLog(db, consumer).begin().commit()
+    assert change_ids(db) == ids
+
+    # the slowest offset of a stage with several versions counts
+    ChangeLog(db, f"{CHANGE_LOG_CONSUMERS[-1]}:v1").begin().commit()
+    insert(db, matches.iloc[10:15])
+    ChangeLog(db, f"{CHANGE_LOG_CONSUMERS[-1]}:v2").begin().commit()
+    for consumer in CHANGE_LOG_CONSUMERS[:-1]:
+        ChangeLog(db, consumer).begin().commit()
+    remaining = change_ids(db)
+    assert len(remaining) == 5 and min(remaining) > ids[-1]
+
+
+def test_idle_versions_do_not_hold_pruning_back(db, matches):
+    insert(db, matches.iloc[:10])
+    ChangeLog(db, f"{CHANGE_LOG_CONSUMERS[-1]}:idle").begin().commit()
+    insert(db, matches.iloc[10:15])
+    db.execute_query(
+        f"""
+        UPDATE {CHANGE_LOG_OFFSETS_TABLE} SET last_updated = datetime('now', ?)
+        WHERE consumer = ?
+        """,
+        (
+            f"-{CHANGE_LOG_RETENTION_DAYS + 1} days",
+            f"{CHANGE_LOG_CONSUMERS[-1]}:idle",
+        ),
+    )
+    for consumer in CHANGE_LOG_CONSUMERS:
+        ChangeLog(db, consumer).begin().commit()
+    assert change_ids(db) == []
+
+    # the idle version lost its delta and scans everything again
+    changes = ChangeLog(db, f"{CHANGE_LOG_CONSUMERS[-1]}:idle").begin()
+    assert changes.expired and changes.is_bootstrap
+    changes.commit()
+    changes = ChangeLog(db, f"{CHANGE_LOG_CONSUMERS[-1]}:idle").begin()
+    assert not changes.expired and not changes.is_bootstrap
@@ -0,0 +1,78 @@
+import time
+
+import numpy as np
+import pytest
+
+from src.config import CHANGE_LOG_OFFSETS_TABLE, DEFAULT_WINDOW_SIZE
+from src.data.changes import ChangeLog
+from src.ml import feature_cache
+from src.ml.feature_cache import FeatureCache, feature_fingerprint
+
+
+@pytest.fixture
+def cache(db, tmp_path):
+    return FeatureCache(tmp_path / "versions", budget_bytes=10_000)
+
+
+def build(cache, n: int, size: int):
+    """Touch the version of window size n and give it size bytes of tensors"""
+    cache.touch(n)
+    fingerprint = feature_fingerprint(n)
+    (cache.path / fingerprint / "tensors.npy").write_bytes(b"\0" * size)
+    ChangeLog(cache.db, cache.consumer(fingerprint)).begin().commit()
+    # last_used is ordered to the microsecond
+    time.sleep(0.001)
+    return fingerprint
+
+
+def consumers(cache) -> set:
+    rows = cache.db.execute_query(f"SELECT consumer FROM {CHANGE_LOG_OFFSETS_TABLE}")
+    return {row[0] for row in rows}
+
+
+def test_evict_least_recently_used_versions(cache):
+    oldest, old, recent = (build(cache, n, 3_000) for n in (3, 5, 7))
+    assert [v["fingerprint"] for v in cache.versions()] == [recent, old, oldest]
+
+    # using a version makes it recent again
+    cache.touch(3)
+    assert cache.evict() == [old]
+    assert not (cache.path / old).exists()
+    assert cache.consumer(old) not in consumers(cache)
+    assert {cache.consumer(oldest), cache.consumer(recent)} <= consumers(cache)
+    assert cache.evict() == []
+
+
+def test_evict_keeps_the_versions_in_use(cache):
+    oldest, recent = build(cache, 3, 8_000), build(cache, 5, 8_000)
+    assert cache.evict(keep=[oldest]) == [recent]
+    assert (cache.path / oldest).exists()
+
+
+def test_store_has_no_side_effects(cache, tmp_path, monkeypatch):
+    unversioned = tmp_path / "store"
+    unversioned.mkdir()
+    (unversioned / "MANIFEST.json").write_text('{"shards": [], "next_shard": 0}')
+    monkeypatch.setattr(feature_cache, "TENSOR_STORE_PATH", unversioned)
+
+    store = cache.store(DEFAULT_WINDOW_SIZE)
+    assert unversioned.exists() and not store.path.exists()
+
+    assert cache.adopt_store(unversioned) == feature_fingerprint(DEFAULT_WINDOW_SIZE)
+    assert not unversioned.exists()
+    assert (store.path / "MANIFEST.json").exists()
+    assert cache.adopt_store(unversioned) is None
+
+
+def test_normalization_round_trip(cache):
+    fingerprint = feature_fingerprint(3)
+    assert cache.normalization(fingerprint) is None
+    stats = feature_cache.normalization_stats(
+        np.array([[1.0, 5.0, np.nan], [3.0, 5.0, np.nan], [np.nan, 1.0, np.nan]])
+    )
+    # rows with a missing feature are ignored, constant and neutral features
+    # are left unscaled
+    assert stats["center"] == [2.0, 5.0, 0.0]
+    assert stats["scale"] == [1.0, 1.0, 1.0]
+    cache.save_normalization(fingerprint, stats)
+    assert cache.normalization(fingerprint) == stats
@@ -0,0 +1,180 @@
+import numpy as np
+
+from src.config import (
+    PREDICT_METADATA_TABLE,
+    RAW_TABLE,
+    TRANSFORMED_COLUMNS,
+    TRANSFORMED_TABLE,
+)
+from src.ml.feature_cache import FeatureCache, standardize_windows
+from src.ml.preprocess import Preprocessor
+
+WINDOW_SIZE = 3
+
+
+def preprocessor(path, **kwargs) -> Preprocessor:
+    """Preprocessor whose feature cache is in path"""
+    preprocessor = Preprocessor(n=WINDOW_SIZE, **kwargs)
+    preprocessor.cache = FeatureCache(path)
+    preprocessor.store = preprocessor.cache.store(
+        preprocessor.n, preprocessor.features, preprocessor.standardize
+    )
+    return preprocessor
+
+
+def insert_results(db, matches):
+    """Played matches, as the scraper and the transformer store them"""
+    with db.get_connection() as conn:
+        matches[TRANSFORMED_COLUMNS].to_sql(
+            TRANSFORMED_TABLE, conn, if_exists="append", index=False
+        )
+        conn.executemany(
+            f"""
+            INSERT INTO {RAW_TABLE} (season_link, date, home, away, score, report_link)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(season_link, home, away) DO UPDATE SET
+                score = excluded.score,
+                report_link = excluded.report_link
+            """,
+            [
+                (
+                    match.season_link,
+                    match.date,
+                    match.home,
+                    match.away,
+                    f"{match.home_score:.0f}–{match.away_score:.0f}",
+                    match.report_link,
+                )
+                for match in matches.itertuples()
+            ],
+        )
+        conn.commit()
+
+
+def insert_fixtures(db, matches):
+    """Upcoming matches, scraped without a score"""
+    with db.get_connection() as conn:
+        conn.executemany(
+            f"INSERT INTO {RAW_TABLE} (season_link, date, home, away) VALUES (?, ?, ?, ?)",
+            [
+                (match.season_link, match.date, match.home, match.away)
+                for match in matches.itertuples()
+            ],
+        )
+        conn.commit()
+
+
+def test_incremental_preprocess_matches_full_rebuild(db, matches, tmp_path):
+    played, fixtures = matches.iloc[:-6], matches.iloc[-6:]
+    insert_results(db, played)
+    insert_fixtures(db, fixtures)
+    preprocessor(tmp_path / "incremental").preprocess()
+
+    # a matchday is played and an older result is corrected
+    insert_results(db, fixtures.iloc[:3])
+    corrected = played.iloc[40]
+    db.execute_query(
+        f"UPDATE {TRANSFORMED_TABLE} SET home_fouls = home_fouls + 1 WHERE report_link = ?",
+        (corrected.report_link,),
+    )
+    incremental = preprocessor(tmp_path / "incremental")
+    incremental.preprocess()
+    assert not incremental.changes.is_bootstrap
+    # only the later matches of the teams involved were rebuilt
+    rebuilt = incremental.store.manifest()["shards"][-1]["rows"]
+    assert 0 < rebuilt < len(incremental.store)
+
+    full = preprocessor(tmp_path / "full", incremental=False)
+    full.preprocess()
+
+    uuids = full.store.uuids()
+    assert len(uuids) > 0
+    assert sorted(incremental.store.uuids()) == sorted(uuids)
+    for incremental_array, full_array in zip(
+        incremental.store.load(uuids)[:3], full.store.load(uuids)[:3]
+    ):
+        np.testing.assert_array_equal(incremental_array, full_array)
+
+
+def test_preprocess_without_changes_writes_nothing(db, matches, tmp_path):
+    insert_results(db, matches.iloc[:-6])
+    insert_fixtures(db, matches.iloc[-6:])
+    preprocessor(tmp_path).preprocess()
+    shards = preprocessor(tmp_path).store.manifest()["shards"]
+
+    unchanged = preprocessor(tmp_path)
+    unchanged.preprocess()
+    assert unchanged.store.manifest()["shards"] == shards
+
+
+def test_normalization_only_for_standardized_versions(db, matches, tmp_path):
+    insert_results(db, matches)
+    raw = preprocessor(tmp_path)
+    raw.preprocess()
+    assert raw.cache.normalization(raw.fingerprint) is None
+
+    standardized = preprocessor(tmp_path, standardize=True)
+    standardized.preprocess()
+    stats = standardized.cache.normalization(standardized.fingerprint)
+    assert stats is not None
+
+    uuids = raw.store.uuids()
+    raw_home = raw.store.load(uuids)[0]
+    standardized_home = standardized.store.load(uuids)[0]
+    np.testing.assert_allclose(
+        standardized_home, standardize_windows(raw_home, stats), rtol=1e-6
+    )
+
+
+def test_failed_append_saves_no_metadata(db, matches, tmp_path, monkeypatch):
+    insert_results(db, matches)
+    failing = preprocessor(tmp_path)
+
+    def append(*args, **kwargs):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(failing.store, "append", append)
+    failing.preprocess()
+    rows = db.execute_query(f"SELECT COUNT(*) FROM {PREDICT_METADATA_TABLE}")
+    assert rows[0][0] == 0
+
+    # the next run still builds every match
+    retry = preprocessor(tmp_path)
+    retry.preprocess()
+    assert len(retry.store) > 0
+    assert len(retry._get_processed_matches()) == len(retry.store)
+
+
+def test_matches_stored_without_result_are_not_processed(db, matches, tmp_path):
+    played, fixtures = matches.iloc[:-6], matches.iloc[-6:]
+    insert_results(db, played)
+    insert_fixtures(db, fixtures)
+    first = preprocessor(tmp_path)
+    first.preprocess()
+    processed = first._get_processed_matches()
+    # a fixture marked played while its stored target is still missing
+    fixture = fixtures.iloc[0]
+    key = (fixture.season_link, fixture.home, fixture.away)
+    assert key not in processed
+    db.execute_query(
+        f"""
+        UPDATE {PREDICT_METADATA_TABLE} SET type = 'training'
+        WHERE season_link = ? AND home = ? AND away = ?
+        """,
+        key,
+    )
+    assert preprocessor(tmp_path)._get_processed_matches() == processed
+
+
+def test_parallel_windows_match_serial_windows(db, matches, tmp_path):
+    insert_results(db, matches)
+    serial = preprocessor(tmp_path / "serial")
+    serial.preprocess()
+    parallel = preprocessor(tmp_path / "parallel", workers=2)
+    parallel.preprocess()
+
+    uuids = serial.store.uuids()
+    for serial_array, parallel_array in zip(
+        serial.store.load(uuids)[:3], parallel.store.load(uuids)[:3]
+    ):
+        np.testing.assert_array_equal(serial_array, parallel_array)
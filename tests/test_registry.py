@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+from src.ml.registry import ModelRegistry, data_version, training_fingerprint
+from src.ml.train import MLTrainer
+
+CONFIG = {"epochs": 30, "batch_size": 32, "hyperparameters": None, "performance": False}
+
+
+@pytest.fixture
+def registry(tmp_path):
+    return ModelRegistry(tmp_path / "registry")
+
+
+def artifacts(path, content: str) -> list:
+    path.mkdir(parents=True, exist_ok=True)
+    (path / "best_model.keras").write_text(content)
+    (path / "charts").mkdir(exist_ok=True)
+    (path / "charts" / "loss.png").write_text(content)
+    return [path / "best_model.keras", path / "charts", path / "missing.txt"]
+
+
+def test_register_copies_artifacts_and_swaps_current(registry, tmp_path):
+    assert registry.current() is None and registry.artifact("best_model.keras") is None
+    first = registry.register("a" * 16, {}, artifacts(tmp_path / "run", "first"))
+    assert registry.current() == first
+    # the registered copy does not change with the next training run
+    second = registry.register("b" * 16, {}, artifacts(tmp_path / "run", "second"))
+    assert registry.current() == second
+    assert registry.artifact("best_model.keras", first).read_text() == "first"
+    assert registry.artifact("charts/loss.png").read_text() == "second"
+    assert not registry.artifact("missing.txt").exists()
+    assert registry.version_of(registry.artifact("best_model.keras")) == second
+
+    registry.set_current(first)
+    assert registry.current() == first
+    assert not (registry.path / "CURRENT.tmp").exists()
+    with pytest.raises(ValueError):
+        registry.set_current("v9999-unknown")
+    assert registry.current() == first
+    assert [version["version"] for version in registry.versions()] == [first, second]
+
+
+def test_find_by_fingerprint(registry, tmp_path):
+    fingerprint, components = training_fingerprint(
+        data_version(["a", "b"], [0, 1]), "features", CONFIG
+    )
+    assert registry.find(fingerprint) is None
+    version = registry.register(fingerprint, components, [], make_current=False)
+    assert registry.find(fingerprint) == version and registry.current() is None
+    # other data, another fingerprint
+    assert (
+        training_fingerprint(data_version(["a", "b"], [0, 2]), "features", CONFIG)[0]
+        != fingerprint
+    )
+
+
+def test_training_pipeline_skips_a_trained_fingerprint(
+    db, registry, tmp_path, monkeypatch
+):
+    def load_data(self):
+        self.match_uuids = ["a", "b", "c"]
+        self.target_tensor = np.array([0, 1, 2])
+        self.feature_version = {"fingerprint": "features", "change_id": 7}
+
+    def train_model(self, *args):
+        raise AssertionError("trained again")
+
+    monkeypatch.setattr(MLTrainer, "load_data", load_data)
+    monkeypatch.setattr(MLTrainer, "train_model", train_model)
+    trainer = MLTrainer()
+    trainer.registry = registry
+    trainer.load_data()
+    fingerprint, components = trainer.training_fingerprint(CONFIG)
+    trained = registry.register(fingerprint, components, [])
+    # e.g. an incremental version promoted since
+    registry.register("c" * 16, {}, [])
+
+    assert trainer.training_pipeline() == trained
+    assert registry.current() == trained
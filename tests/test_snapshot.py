@@ -0,0 +1,83 @@
+import pytest
+
+from src.config import TRANSFORMED_TABLE
+from src.data import snapshot
+from src.data.snapshot import SnapshotManager
+from src.ml.preprocess import Preprocessor
+
+
+@pytest.fixture
+def snapshots(db, matches, tmp_path, monkeypatch):
+    """SnapshotManager in tmp_path, the default of every SnapshotManager()"""
+    monkeypatch.setattr(
+        snapshot.SnapshotManager.__init__, "__defaults__", (tmp_path / "snapshots",)
+    )
+    with db.get_connection() as conn:
+        matches.to_sql(TRANSFORMED_TABLE, conn, if_exists="append", index=False)
+        # an export in the same second as a change is not fresh
+        conn.execute(
+            f"UPDATE {TRANSFORMED_TABLE} SET last_updated = '2000-01-01 00:00:00'"
+        )
+        conn.commit()
+    return SnapshotManager()
+
+
+def watermark(db):
+    return db.table_watermark([TRANSFORMED_TABLE])
+
+
+def test_no_snapshot(snapshots, db):
+    assert not snapshots.is_fresh(watermark(db))
+    assert snapshots.read_table(TRANSFORMED_TABLE) is None
+
+
+def test_export_and_read(snapshots, db, matches):
+    manifest = snapshots.export()
+    assert manifest["tables"][TRANSFORMED_TABLE]["rows"] == len(matches)
+    assert snapshots.is_fresh(watermark(db))
+
+    df = snapshots.read_table(TRANSFORMED_TABLE, min_watermark=watermark(db))
+    assert sorted(df["report_link"]) == sorted(matches["report_link"])
+    df = snapshots.read_table(
+        TRANSFORMED_TABLE, columns=["report_link"], filters=[("season", "=", 2000)]
+    )
+    assert list(df.columns) == ["report_link"]
+    assert len(df) == (matches["season_link"].str.contains("/2000/")).sum()
+
+
+def test_stale_snapshot_is_not_read(snapshots, db):
+    snapshots.export()
+    db.execute_query(
+        f"UPDATE {TRANSFORMED_TABLE} SET home_fouls = -1, last_updated = '2999-01-01 00:00:00' WHERE rowid = 1"
+    )
+    assert not snapshots.is_fresh(watermark(db))
+    assert snapshots.read_table(TRANSFORMED_TABLE, min_watermark=watermark(db)) is None
+    # without a watermark the current snapshot is still served
+    assert snapshots.read_table(TRANSFORMED_TABLE) is not None
+
+
+def test_preprocessor_reads_a_fresh_snapshot(snapshots, db, matches):
+    snapshots.export()
+    # a change the watermark does not see only exists in the database
+    db.execute_query(f"UPDATE {TRANSFORMED_TABLE} SET home_fouls = -1")
+    df = Preprocessor(use_snapshot=True).read_data(["Team 0"])
+    involved = (matches["home"] == "Team 0") | (matches["away"] == "Team 0")
+    assert sorted(df["report_link"].dropna()) == sorted(
+        matches.loc[involved, "report_link"]
+    )
+    assert (df["home_fouls"] != -1).all()
+
+
+def test_preprocessor_falls_back_to_the_database(snapshots, db):
+    snapshots.export()
+    db.execute_query(
+        f"UPDATE {TRANSFORMED_TABLE} SET home_fouls = -1, last_updated = '2999-01-01 00:00:00' WHERE rowid = 1"
+    )
+    df = Preprocessor(use_snapshot=True).read_data()
+    assert (df["home_fouls"] == -1).sum() == 1
+
+
+def test_old_snapshots_are_removed(snapshots):
+    names = [snapshots.export(keep=2)["name"] for _ in range(3)]
+    assert sorted(path.name for path in snapshots.path.glob("snapshot-*")) == names[1:]
+    assert snapshots.manifest()["name"] == names[-1]
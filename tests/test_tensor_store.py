@@ -0,0 +1,148 @@
+import numpy as np
+import pytest
+import tensorflow as tf
+
+from src.ml.tensor_store import NO_TARGET, GatheredArray, TensorStore
+
+STORES = [
+    {"layout": "dense"},
+    {"layout": "indexed"},
+    {"layout": "dense", "precision": "float16", "compression": "zstd"},
+    {"layout": "indexed", "precision": "int16", "compression": "zstd"},
+]
+
+
+def windows(rows: int, seed: int, n: int = 4, features: int = 6):
+    """home and away windows of rows matches, small integers so every
+    precision round-trips them exactly"""
+    rng = np.random.default_rng(seed)
+    shape = (rows, n, features)
+    return (
+        rng.integers(0, 100, shape).astype(np.float32),
+        rng.integers(0, 100, shape).astype(np.float32),
+    )
+
+
+def assert_loads(store: TensorStore, uuids, home, away, targets):
+    loaded_home, loaded_away, loaded_targets, missing = store.load(uuids)
+    assert missing == []
+    np.testing.assert_array_equal(loaded_home, home)
+    np.testing.assert_array_equal(loaded_away, away)
+    np.testing.assert_array_equal(loaded_targets, targets)
+
+
+@pytest.mark.parametrize("options", STORES)
+def test_append_compact_round_trip(tmp_path, options):
+    store = TensorStore(tmp_path / "store", **options)
+    uuids = [f"match-{i}" for i in range(30)]
+    home, away = windows(30, seed=0)
+    targets = np.array([i % 3 for i in range(30)], dtype=np.int32)
+    store.append(uuids[:20], home[:20], away[:20], list(targets[:20]))
+    store.append(uuids[20:], home[20:], away[20:], [*targets[20:-1], None])
+    targets[-1] = NO_TARGET
+    # rebuilt matches are appended again, the latest shard wins
+    rebuilt_home, rebuilt_away = windows(1, seed=1)
+    store.append([uuids[5]], rebuilt_home, rebuilt_away, [targets[5]])
+    home[5], away[5] = rebuilt_home[0], rebuilt_away[0]
+
+    store = TensorStore(tmp_path / "store", **options)
+    assert len(store) == 30
+    assert len(store.manifest()["shards"]) == 3
+    assert_loads(store, uuids, home, away, targets)
+
+    order = uuids[::-1]
+    store.compact(order=order)
+    assert len(store.manifest()["shards"]) == 1
+    assert sorted(path.name for path in (tmp_path / "store").iterdir()) == sorted(
+        [store.manifest()["shards"][0]["name"], "MANIFEST.json"]
+    )
+    store = TensorStore(tmp_path / "store", **options)
+    assert store.uuids() == order
+    assert_loads(store, uuids, home, away, targets)
+
+
+@pytest.mark.parametrize("options", STORES)
+def test_open_memmap(tmp_path, options):
+    store = TensorStore(tmp_path / "store", **options)
+    uuids = [f"match-{i}" for i in range(30)]
+    home, away = windows(30, seed=0)
+    targets = np.arange(30, dtype=np.int32) % 3
+    store.append(uuids[:20], home[:20], away[:20], list(targets[:20]))
+    store.append(uuids[20:], home[20:], away[20:], list(targets[20:]))
+    manifest = store.manifest()
+
+    # rows spread over both shards are gathered, the store is not rewritten
+    wanted = [uuids[i] for i in (25, 3, 18, 21)] + ["unknown"]
+    mapped_home, mapped_away, mapped_targets, missing = store.open_memmap(wanted)
+    assert isinstance(mapped_home, GatheredArray)
+    assert missing == ["unknown"]
+    assert store.manifest() == manifest
+    expected_home, expected_away, expected_targets, _ = store.load(wanted)
+    np.testing.assert_array_equal(np.asarray(mapped_home), expected_home)
+    np.testing.assert_array_equal(np.asarray(mapped_away), expected_away)
+    np.testing.assert_array_equal(np.asarray(mapped_targets), expected_targets)
+    np.testing.assert_array_equal(mapped_home[[3, 0]], expected_home[[3, 0]])
+    np.testing.assert_array_equal(mapped_home[1:3], expected_home[1:3])
+
+    # consecutive rows of one shard are plain slices
+    mapped_home, _, mapped_targets, _ = store.open_memmap(uuids[2:12])
+    assert not isinstance(mapped_home, GatheredArray)
+    np.testing.assert_array_equal(np.asarray(mapped_home), home[2:12])
+    np.testing.assert_array_equal(np.asarray(mapped_targets), targets[2:12])
+
+
+def write_legacy(path, match_uuid, home, away, target):
+    match_path = path / match_uuid
+    match_path.mkdir(parents=True)
+    tensors = {
+        "home_tensor.ten": tf.constant(home[None]),
+        "away_tensor.ten": tf.constant(away[None]),
+        "target_tensor.ten": tf.constant([] if target is None else [target], tf.int32),
+    }
+    for name, tensor in tensors.items():
+        tf.io.write_file(str(match_path / name), tf.io.serialize_tensor(tensor))
+
+
+def test_migrate_legacy(tmp_path):
+    legacy_path = tmp_path / "processed_tensors"
+    uuids = [f"match-{i}" for i in range(7)]
+    home, away = windows(7, seed=0)
+    targets = [0, 1, 2, 0, 1, 2, None]
+    for i, match_uuid in enumerate(uuids):
+        write_legacy(legacy_path, match_uuid, home[i], away[i], targets[i])
+    (legacy_path / "broken").mkdir()
+    (legacy_path / "broken" / "home_tensor.ten").write_bytes(b"not a tensor")
+
+    store = TensorStore(tmp_path / "store")
+    result = store.migrate_legacy(legacy_path, shard_size=3, remove=True)
+    assert result["migrated"] == 7
+    assert list(result["failed"]) == ["broken"]
+    assert len(store.manifest()["shards"]) == 3
+    assert TensorStore.legacy_uuids(legacy_path) == ["broken"]
+
+    store = TensorStore(tmp_path / "store")
+    assert_loads(store, uuids, home, away, [0, 1, 2, 0, 1, 2, NO_TARGET])
+    # an interrupted or repeated migration skips what is already stored
+    assert store.migrate_legacy(legacy_path)["migrated"] == 0
+
+
+def test_maybe_compact(tmp_path):
+    store = TensorStore(tmp_path / "store")
+    uuids = [f"match-{i}" for i in range(10)]
+    home, away = windows(10, seed=0)
+    store.append(uuids, home, away, [0] * 10)
+    store.append(uuids[:2], home[:2], away[:2], [1] * 2)
+    # 2 of 12 rows superseded
+    assert not store.maybe_compact(max_shards=2, max_superseded=0.2)
+
+    reader = TensorStore(tmp_path / "store")
+    assert len(reader) == 10
+    assert not store.maybe_compact(max_shards=1)
+    assert len(store.manifest()["shards"]) == 2
+
+    # the reader released the store
+    reader.close()
+    assert store.maybe_compact(max_shards=1)
+    assert len(store.manifest()["shards"]) == 1
+    assert_loads(store, uuids, home, away, [1, 1] + [0] * 8)
+    assert not store.maybe_compact(max_shards=1)
@@ -0,0 +1,56 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from src.ml import train
+from src.ml.train import MLTrainer
+
+
+class Loaded(Exception):
+    pass
+
+
+def test_performance_threads_are_configured_before_loading(db, monkeypatch):
+    calls = []
+    monkeypatch.setattr(
+        train, "configure_performance_threads", lambda: calls.append("threads")
+    )
+
+    def load_data(self):
+        calls.append("load_data")
+        raise Loaded
+
+    monkeypatch.setattr(MLTrainer, "load_data", load_data)
+    with pytest.raises(Loaded):
+        MLTrainer().training_pipeline(performance=True)
+    assert calls == ["threads", "load_data"]
+
+
+def test_performance_threads_take_effect():
+    # a fresh interpreter, this one already executed TensorFlow ops
+    script = """
+import os
+import tensorflow as tf
+from src.ml.runtime import configure_performance_threads
+
+assert configure_performance_threads()
+tf.constant(1.0) + 1
+assert tf.config.threading.get_intra_op_parallelism_threads() == (os.cpu_count() or 1)
+"""
+    subprocess.run(
+        [sys.executable, "-c", script],
+        check=True,
+        cwd=Path(__file__).parents[1],
+    )
+
+
+def test_roll_holdout_keeps_the_latest_matches():
+    # rows 0-9 trained, 10-14 held out, 15-24 new
+    rows, holdout = MLTrainer.roll_holdout(list(range(15, 25)), list(range(10, 15)))
+    assert holdout == [12, 13, 14, 23, 24]
+    assert rows == [*range(15, 23), 10, 11]
+
+    # too few new matches to hold any out
+    assert MLTrainer.roll_holdout([15, 16], [10, 11]) == ([15, 16], [10, 11])
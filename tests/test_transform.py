@@ -0,0 +1,42 @@
+from src.config import RAW_TABLE, TRANSFORMED_TABLE
+from src.data.blobs import BlobStore
+from src.transform import DataTransformer
+
+
+def test_only_untransformed_matches_are_selected(db, matches):
+    blobs = BlobStore(db)
+    played = matches.iloc[:3]
+    for match in played.itertuples():
+        db.execute_query(
+            f"""
+            INSERT INTO {RAW_TABLE}
+            (season_link, date, home, away, score, report_link, team_stats_id, extra_stats_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                match.season_link,
+                match.date,
+                match.home,
+                match.away,
+                "1–0",
+                match.report_link,
+                blobs.put("<div id='team_stats'></div>"),
+                blobs.put("<div id='team_stats_extra'></div>"),
+            ),
+        )
+    with db.get_connection() as conn:
+        played.iloc[:1].to_sql(TRANSFORMED_TABLE, conn, if_exists="append", index=False)
+        conn.commit()
+
+    # full scan, then the change log delta after a run that consumed nothing
+    transformer = DataTransformer()
+    transformer.changes.begin().commit()
+    for use_changes in (False, True):
+        if use_changes:
+            transformer.changes.begin()
+            transformer._use_changed_matches_filter()
+        rows = db.execute_query(
+            f"SELECT report_link {transformer.table_filter}",
+            transformer.table_filter_params,
+        )
+        assert sorted(row[0] for row in rows) == sorted(played["report_link"][1:])